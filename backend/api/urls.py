@@ -0,0 +1,13 @@
+from django.urls import path
+
+from api import views
+
+urlpatterns = [
+    path('path/', views.actor_path, name='actor-path'),
+    path('actors/popular/', views.popular_actors, name='actor-popular'),
+    path('actors/search/', views.search_actors, name='actor-search'),
+    path('puzzle/', views.puzzle, name='puzzle'),
+    path('chain/validate/', views.validate_chain, name='chain-validate'),
+    path('hint/', views.hint, name='hint'),
+    path('snapshot/', views.graph_snapshot, name='graph-snapshot'),
+]
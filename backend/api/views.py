@@ -0,0 +1,443 @@
+"""
+JSON API поверх снимка графа партнёров по съёмкам.
+
+Граф отвечает за топологию (mmap, без запросов к базе), а имена актёров
+и названия тайтлов для ответа добираются двумя ORM-запросами по PK.
+"""
+import json
+from functools import lru_cache, wraps
+
+import numpy as np
+from django.db import connection
+from django.http import FileResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from etl import popularity
+from etl.idmap import MISSING, const_number
+from graph.puzzles import MAX_DISTANCE, MIN_DISTANCE, random_puzzle
+from graph.search import TitleFilter, shortest_path
+from graph import snapshot
+from graph.oracle import UNKNOWN
+from graph.store import GraphNotPublished, get_snapshot
+from sixmovies.models import Actor, Title
+
+DEFAULT_MAX_DEPTH = 6
+MAX_DEPTH = 10
+
+# самая длинная цепочка, которую принимает валидация
+MAX_CHAIN = 64
+
+# сколько подсказок отдаём по умолчанию и максимум
+DEFAULT_HINTS = 5
+MAX_HINTS = 50
+
+# сколько актёров отдаёт автодополнение по умолчанию и максимум
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 25
+
+# страница рейтинга популярных актёров
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# сколько общих тайтлов (самых популярных) показываем на каждое звено
+TITLES_PER_LINK = 3
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def graph_required(view):
+    """До первой публикации графа вьюхи поверх снимка отвечают 503, а не 500."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except GraphNotPublished:
+            return JsonResponse({"error": "граф ещё не опубликован"}, status=503)
+    return wrapper
+
+
+def _int_param(params, name, default, lo, hi):
+    raw = params.get(name)
+    if raw in (None, ""):
+        return default
+    try:
+        value = int(raw)
+    except (TypeError, ValueError):
+        raise BadRequest(f"{name} должен быть целым числом")
+    if not lo <= value <= hi:
+        raise BadRequest(f"{name} должен быть в диапазоне {lo}..{hi}")
+    return value
+
+
+def _bool_param(params, name):
+    return str(params.get(name, "")).lower() in ("1", "true", "yes")
+
+
+def _actor_index(graph, nconst):
+    if not nconst:
+        raise BadRequest("нужны параметры from и to (nconst)")
+    v = _find_actor(graph, nconst)
+    if v is None:
+        raise LookupError(nconst)
+    return v
+
+
+def _find_actor(graph, nconst):
+    number = const_number(nconst) if isinstance(nconst, str) else MISSING
+    return graph.actor_index(number) if number != MISSING else None
+
+
+def title_filter(params) -> TitleFilter:
+    return TitleFilter(
+        movies_only=_bool_param(params, "movies_only"),
+        min_votes=_int_param(params, "min_votes", 0, 0, 10 ** 9),
+    )
+
+
+def link_titles(graph, u, v, title_mask=None) -> list:
+    """Самые популярные общие тайтлы u и v (плотные индексы), с учётом фильтра."""
+    shared = graph.shared_titles(u, v)
+    if title_mask is not None:
+        shared = shared[title_mask[shared]]
+    best = shared[(-graph.title_votes[shared]).argsort(kind="stable")[:TITLES_PER_LINK]]
+    return [int(t) for t in best]
+
+
+def load_titles(graph, links) -> dict:
+    """Плотные индексы тайтлов всех звеньев → JSON тайтла, одним запросом."""
+    pks = {int(graph.title_ids[t]): t for link in links for t in link}
+    return {
+        pks[row["id"]]: {
+            "tconst": row["tconst"],
+            "title": row["primary_title"],
+            "type": row["title_type"],
+            "year": row["start_year"],
+            "votes": row["imdb_votes"],
+        }
+        for row in Title.objects.filter(id__in=pks).values(
+            "id", "tconst", "primary_title", "title_type", "start_year", "imdb_votes",
+        )
+    }
+
+
+def describe_chain(graph, chain, title_mask=None) -> dict:
+    """Плотные индексы цепочки → актёры и звенья с общими тайтлами для JSON."""
+    links = [link_titles(graph, u, v, title_mask) for u, v in zip(chain, chain[1:])]
+    titles = load_titles(graph, links)
+
+    actor_ids = [int(graph.actor_ids[v]) for v in chain]
+    actors = {a["id"]: a for a in Actor.objects.filter(id__in=actor_ids).values("id", "nconst", "name")}
+    people = [
+        {"nconst": actors[pk]["nconst"], "name": actors[pk]["name"]} if pk in actors else None
+        for pk in actor_ids
+    ]
+    return {
+        "actors": people,
+        "links": [
+            {
+                "from": people[i] and people[i]["nconst"],
+                "to": people[i + 1] and people[i + 1]["nconst"],
+                "titles": [titles[t] for t in link if t in titles],
+            }
+            for i, link in enumerate(links)
+        ],
+    }
+
+
+@require_GET
+@graph_required
+def actor_path(request):
+    """GET /api/path/?from=nm…&to=nm…[&max_depth=6][&movies_only=1][&min_votes=N]"""
+    snap = get_snapshot()
+    graph = snap.graph
+    try:
+        source = _actor_index(graph, request.GET.get("from"))
+        target = _actor_index(graph, request.GET.get("to"))
+        max_depth = _int_param(request.GET, "max_depth", DEFAULT_MAX_DEPTH, 1, MAX_DEPTH)
+        filters = title_filter(request.GET)
+    except BadRequest as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except LookupError as e:
+        return JsonResponse({"error": f"актёр {e.args[0]} не найден в графе"}, status=404)
+
+    title_mask, edge_mask = filters.masks(graph)
+    chain = shortest_path(graph, source, target, max_depth=max_depth, edge_mask=edge_mask)
+    if chain is None:
+        return JsonResponse({"degrees": None, "actors": [], "links": []})
+
+    return JsonResponse({"degrees": len(chain) - 1, **describe_chain(graph, chain, title_mask)})
+
+
+@csrf_exempt
+@require_POST
+@graph_required
+def validate_chain(request):
+    """
+    POST /api/chain/validate/ {"chain": ["nm…", …], "movies_only": false, "min_votes": 0}
+
+    Проверяет все звенья цепочки за один запрос: пары ищутся в CSR-графе
+    бинарным поиском по соседям, без SQL на каждую пару.
+    """
+    try:
+        payload = json.loads(request.body or b"{}")
+        chain = payload.get("chain") if isinstance(payload, dict) else None
+        if not isinstance(chain, list) or not 2 <= len(chain) <= MAX_CHAIN:
+            raise BadRequest(f"chain — список из 2..{MAX_CHAIN} nconst")
+        filters = title_filter(payload)
+    except ValueError as e:
+        message = str(e) if isinstance(e, BadRequest) else "тело запроса должно быть JSON"
+        return JsonResponse({"error": message}, status=400)
+
+    snap = get_snapshot()
+    graph = snap.graph
+    title_mask, _ = filters.masks(graph)
+    vertices = [_find_actor(graph, nconst) for nconst in chain]
+
+    links = [
+        link_titles(graph, u, v, title_mask) if u is not None and v is not None else []
+        for u, v in zip(vertices, vertices[1:])
+    ]
+    titles = load_titles(graph, links)
+
+    result = [
+        {
+            "from": chain[i],
+            "to": chain[i + 1],
+            "valid": bool(link),
+            "titles": [titles[t] for t in link if t in titles],
+        }
+        for i, link in enumerate(links)
+    ]
+    return JsonResponse({
+        "valid": all(link["valid"] for link in result),
+        "unknown": [nconst for nconst, v in zip(chain, vertices) if v is None],
+        "links": result,
+    })
+
+
+@require_GET
+def puzzle(request):
+    """GET /api/puzzle/[?handshakes=N] — случайная головоломка из готового пула."""
+    try:
+        distance = _int_param(request.GET, "handshakes", None, MIN_DISTANCE, MAX_DISTANCE)
+    except BadRequest as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    found = random_puzzle(distance)
+    if found is None:
+        return JsonResponse({"error": "пул головоломок пуст"}, status=503)
+
+    start_id, target_id, distance = found
+    actors = {
+        a["id"]: {"nconst": a["nconst"], "name": a["name"]}
+        for a in Actor.objects.filter(id__in=[start_id, target_id]).values("id", "nconst", "name")
+    }
+    return JsonResponse({
+        "start": actors.get(start_id),
+        "target": actors.get(target_id),
+        "handshakes": distance,
+    })
+
+
+@csrf_exempt
+@require_POST
+@graph_required
+def hint(request):
+    """
+    POST /api/hint/ {"chain": ["nm…", …], "target": "nm…", "limit": 5}
+
+    Соседи последнего актёра цепочки, ближайшие к цели, при равенстве —
+    самые популярные. Поле расстояний до цели берётся из LRU-кэша воркера.
+    """
+    try:
+        payload = json.loads(request.body or b"{}")
+        if not isinstance(payload, dict):
+            raise BadRequest("тело запроса должно быть JSON-объектом")
+        chain = payload.get("chain")
+        if not isinstance(chain, list) or not 1 <= len(chain) <= MAX_CHAIN:
+            raise BadRequest(f"chain — список из 1..{MAX_CHAIN} nconst")
+        limit = _int_param(payload, "limit", DEFAULT_HINTS, 1, MAX_HINTS)
+    except ValueError as e:
+        message = str(e) if isinstance(e, BadRequest) else "тело запроса должно быть JSON"
+        return JsonResponse({"error": message}, status=400)
+
+    snap = get_snapshot()
+    graph = snap.graph
+    try:
+        last = _actor_index(graph, chain[-1])
+        target = _actor_index(graph, payload.get("target"))
+    except BadRequest:
+        return JsonResponse({"error": "нужны chain и target (nconst)"}, status=400)
+    except LookupError as e:
+        return JsonResponse({"error": f"актёр {e.args[0]} не найден в графе"}, status=404)
+
+    field = snap.fields.get(graph, target)
+    remaining = int(field[last])
+    if remaining == UNKNOWN:
+        return JsonResponse({"remaining": None, "hints": []})
+
+    # уже выбранные актёры подсказками не считаются
+    used = {v for v in (_find_actor(graph, nconst) for nconst in chain) if v is not None}
+    neighbors = graph.neighbors(last)
+    candidates = neighbors[(field[neighbors] != UNKNOWN) & ~np.isin(neighbors, list(used))]
+    order = np.lexsort((-graph.actor_votes[candidates], field[candidates]))[:limit]
+    best = [int(v) for v in candidates[order]]
+
+    actors = {
+        a["id"]: a
+        for a in Actor.objects.filter(id__in=[int(graph.actor_ids[v]) for v in best]).values("id", "nconst", "name")
+    }
+    links = [link_titles(graph, last, v) for v in best]
+    titles = load_titles(graph, links)
+
+    hints = []
+    for v, link in zip(best, links):
+        actor = actors.get(int(graph.actor_ids[v]))
+        if actor is None:
+            continue
+        hints.append({
+            "nconst": actor["nconst"],
+            "name": actor["name"],
+            "distance": int(field[v]),
+            "titles": [titles[t] for t in link if t in titles],
+        })
+    return JsonResponse({"remaining": remaining, "hints": hints})
+
+
+@require_GET
+@graph_required
+def search_actors(request):
+    """GET /api/actors/search/?q=…[&limit=10] — префиксный поиск с опечатками, по популярности."""
+    try:
+        limit = _int_param(request.GET, "limit", DEFAULT_SUGGESTIONS, 1, MAX_SUGGESTIONS)
+    except BadRequest as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    snap = get_snapshot()
+    graph = snap.graph
+    if snap.names is None:
+        return JsonResponse({"error": "индекс имён ещё не собран"}, status=503)
+    found = snap.names.search(request.GET.get("q", ""), graph.actor_votes, limit)
+
+    ids = [int(graph.actor_ids[v]) for v in found]
+    actors = {a["id"]: a for a in Actor.objects.filter(id__in=ids).values("id", "nconst", "name")}
+    return JsonResponse({
+        "results": [
+            {
+                "nconst": actors[pk]["nconst"],
+                "name": actors[pk]["name"],
+                "popularity": int(graph.actor_votes[v]),
+            }
+            for v, pk in zip(found, ids)
+            if pk in actors
+        ],
+    })
+
+
+def _popularity_version():
+    with connection.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s)", [popularity.VERSION_TABLE])
+        if cur.fetchone()[0] is None:
+            return None
+        cur.execute(f"SELECT version FROM {popularity.VERSION_TABLE}")
+        row = cur.fetchone()
+    return row and row[0]
+
+
+def _popular_etag(request):
+    version = _popularity_version()
+    if version is None:
+        return None
+    return f"{version}:{request.GET.get('page', '1')}:{request.GET.get('page_size', DEFAULT_PAGE_SIZE)}"
+
+
+@lru_cache(maxsize=64)
+def _popular_page(version, page, page_size):
+    """Страница рейтинга; версия в ключе кэша отбрасывает страницы прошлой сборки."""
+    lo = (page - 1) * page_size + 1
+    with connection.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT p.rank, a.nconst, a.name, p.score
+            FROM {popularity.TABLE} p
+            JOIN {Actor._meta.db_table} a ON a.id = p.actor_id
+            WHERE p.rank BETWEEN %s AND %s
+            ORDER BY p.rank
+            """,
+            [lo, lo + page_size - 1],
+        )
+        rows = cur.fetchall()
+        cur.execute(f"SELECT max(rank) FROM {popularity.TABLE}")
+        total = cur.fetchone()[0] or 0
+
+    return {
+        "page": page,
+        "page_size": page_size,
+        "total": total,
+        "results": [
+            {"rank": rank, "nconst": nconst, "name": name, "score": score}
+            for rank, nconst, name, score in rows
+        ],
+    }
+
+
+@require_GET
+@cache_control(public=True, max_age=300)
+@condition(etag_func=_popular_etag)
+def popular_actors(request):
+    """GET /api/actors/popular/[?page=1][&page_size=100] — рейтинг из actor_popularity, с ETag."""
+    try:
+        page = _int_param(request.GET, "page", 1, 1, 10 ** 6)
+        page_size = _int_param(request.GET, "page_size", DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    except BadRequest as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    version = _popularity_version()
+    if version is None:
+        return JsonResponse({"error": "рейтинг популярности ещё не посчитан"}, status=503)
+    return JsonResponse(_popular_page(version, page, page_size))
+
+
+def _open_snapshot():
+    """
+    (meta, открытый файл снимка) одной версии графа или None, если снимка нет.
+    publish() удаляет старые версии, поэтому файл может исчезнуть между
+    get_snapshot() и open() — это тот же «снимок не собран», а не 500.
+    """
+    path = get_snapshot().path / "snapshot"
+    try:
+        meta = snapshot.load_meta(path)
+        return meta and (meta, open(path / snapshot.SNAPSHOT_FILE, "rb"))
+    except FileNotFoundError:
+        return None
+
+
+@require_GET
+@graph_required
+@cache_control(public=True, max_age=3600)
+def graph_snapshot(request):
+    """
+    GET /api/snapshot/ — gzip-снимок подграфа топ-актёров (формат — graph/snapshot.py).
+    FileResponse отдаёт файл с диска через wsgi.file_wrapper (sendfile), без чтения в память.
+    """
+    opened = _open_snapshot()
+    if opened is None:
+        return JsonResponse({"error": "снимок ещё не собран"}, status=503)
+    meta, f = opened
+
+    # ETag и тело — из одного открытого файла, версия между ними смениться не может
+    etag = quote_etag(meta["version"])
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        f.close()
+    else:
+        response = FileResponse(f, as_attachment=True, filename=f"sixmovies-{meta['version']}.bin.gz")
+        response["X-Snapshot-Version"] = meta["version"]
+    response["ETag"] = etag
+    return response
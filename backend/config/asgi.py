@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# граф открываем и прогреваем при старте воркера, а не на первом запросе;
+# новые версии после ETL воркер подхватывает сам (graph/store.py)
+from graph.store import preload  # noqa: E402
+
+preload()
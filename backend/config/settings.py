@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'sixmovies',
+    'etl',
 ]
 
 MIDDLEWARE = [
@@ -87,6 +88,10 @@ DATABASES = {
         'PASSWORD': os.getenv("DB_PASSWORD"),
         'HOST': os.getenv("DB_HOST", "localhost"),
         'PORT': os.getenv("DB_PORT", "5432"),
+        # постоянные соединения на поток воркера вместо connect/close на каждый запрос;
+        # перед повторным использованием Django проверяет, что соединение живо
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", "600")),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -126,3 +131,12 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/6.0/howto/static-files/
 
 STATIC_URL = 'static/'
+
+
+# Co-star graph
+# Снимок графа «актёр → партнёры по тайтлам», который строит etl/costar_graph
+
+GRAPH_DIR = Path(os.getenv("GRAPH_DIR", BASE_DIR / "data" / "graph"))
+
+# сколько байт полей расстояний «до цели» держит кэш подсказок в каждом воркере
+HINT_CACHE_BYTES = int(os.getenv("HINT_CACHE_BYTES", 256 * 2 ** 20))
@@ -0,0 +1,23 @@
+import os
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+django.setup()
+
+from sixmovies.models import Actor, Title, TitlePrincipal
+from etl import popularity
+
+
+def build_popularity():
+    known_for = Actor.known_for.through._meta
+    return popularity.refresh(
+        title_table=Title._meta.db_table,
+        principal_table=TitlePrincipal._meta.db_table,
+        known_for_table=known_for.db_table,
+        known_for_actor=known_for.get_field("actor").column,
+        known_for_title=known_for.get_field("title").column,
+    )
+
+
+if __name__ == "__main__":
+    build_popularity()
@@ -0,0 +1,49 @@
+import os
+import django
+import time
+
+import numpy as np
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+django.setup()
+
+from django.conf import settings
+from sixmovies.models import Actor
+from etl.db import stream_rows
+from graph import versions
+from graph.csr import CoStarGraph
+from graph.names import NameIndex
+
+
+def build_search():
+    """Собирает индекс автодополнения по именам актёров графа в каталог names/ версии снимка."""
+    start = time.time()
+    root = versions.building(settings.GRAPH_DIR)
+    graph = CoStarGraph.load(root)
+
+    # Actor.id → плотный индекс графа бинарным поиском по отсортированным id
+    order = np.argsort(graph.actor_ids)
+    sorted_ids = np.asarray(graph.actor_ids)[order]
+
+    print("→ Читаю имена актёров стримингом...")
+    actors, names = [], []
+    meta = Actor._meta
+    rows = stream_rows(
+        f"SELECT {meta.pk.column}, {meta.get_field('name').column} FROM {meta.db_table}",
+        name="build_actor_search",
+    )
+    for pk, name in rows:
+        pos = np.searchsorted(sorted_ids, pk)
+        if pos < len(sorted_ids) and sorted_ids[pos] == pk:
+            actors.append(int(order[pos]))
+            names.append(name)
+
+    index = NameIndex.build(actors, names, graph.actor_votes)
+    index.save(root / "names_new")
+    versions.replace_dir(root / "names_new", root / "names")
+
+    print(f"✓ индекс имён: {len(actors):,} актёров, {len(index):,} ключей за {time.time() - start:.1f} сек")
+
+
+if __name__ == "__main__":
+    build_search()
@@ -0,0 +1,219 @@
+"""
+Массовая запись в нормализованные таблицы без bulk_create.
+
+Строки копятся в буфере в формате COPY (по умолчанию binary), на flush()
+уходят одним COPY во временную staging-таблицу и сливаются в целевую
+таблицу одним INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+flush_returning() делает то же самое и сразу возвращает PK каждого
+ключа из пакета — и только что вставленного, и уже существовавшего.
+"""
+import io
+import struct
+
+# тип колонки → тип staging-колонки в Postgres
+PG_TYPES = {
+    "int": "bigint",
+    "float": "double precision",
+    "bool": "boolean",
+    "text": "text",
+}
+
+# внутренние типы Django-полей → тип колонки
+DJANGO_KINDS = {
+    "AutoField": "int",
+    "BigAutoField": "int",
+    "SmallAutoField": "int",
+    "IntegerField": "int",
+    "BigIntegerField": "int",
+    "SmallIntegerField": "int",
+    "PositiveIntegerField": "int",
+    "PositiveBigIntegerField": "int",
+    "PositiveSmallIntegerField": "int",
+    "FloatField": "float",
+    "BooleanField": "bool",
+    "CharField": "text",
+    "TextField": "text",
+    "SlugField": "text",
+}
+
+BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+BINARY_TRAILER = struct.pack("!h", -1)
+BINARY_NULL = struct.pack("!i", -1)
+
+MERGE_SQL = """
+    INSERT INTO {table} ({columns})
+    SELECT {columns} FROM {staging}
+    ON CONFLICT DO NOTHING
+"""
+
+# INSERT видит вставленные строки через RETURNING, а JOIN в том же запросе —
+# только снимок до вставки, т.е. уже существовавшие: вместе это все ключи пакета
+UPSERT_RETURNING_SQL = """
+    WITH inserted AS (
+        INSERT INTO {table} ({columns})
+        SELECT {columns} FROM {staging}
+        ON CONFLICT DO NOTHING
+        RETURNING {pk}, {keys}
+    )
+    SELECT {pk}, {keys} FROM inserted
+    UNION ALL
+    SELECT {target_pk}, {target_keys}
+    FROM (SELECT DISTINCT {keys} FROM {staging}) s
+    JOIN {table} t ON {join}
+"""
+
+
+def _binary_field(kind: str, value) -> bytes:
+    if value is None:
+        return BINARY_NULL
+    if kind == "int":
+        return struct.pack("!iq", 8, value)
+    if kind == "float":
+        return struct.pack("!id", 8, value)
+    if kind == "bool":
+        return struct.pack("!i?", 1, value)
+    data = str(value).encode("utf-8")
+    return struct.pack("!i", len(data)) + data
+
+
+def _text_field(kind: str, value) -> str:
+    if value is None:
+        return "\\N"
+    if kind == "bool":
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class BulkWriter:
+    """
+    Буферизованный COPY-писатель в одну таблицу.
+
+    columns — список (имя колонки, тип), тип из PG_TYPES.
+    merge_sql — свой шаблон слияния с плейсхолдерами {table}, {columns}, {staging};
+    по умолчанию INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+    commit=False — flush не коммитит: вызывающий сам фиксирует транзакцию,
+    например вместе с контрольной точкой (etl/checkpoint.py).
+    """
+
+    def __init__(self, conn, table: str, columns, merge_sql: str = MERGE_SQL, binary: bool = True,
+                 commit: bool = True):
+        self.conn = conn
+        self.table = table
+        self.columns = list(columns)
+        self.kinds = [kind for _, kind in self.columns]
+        self.merge_sql = merge_sql
+        self.binary = binary
+        self.commit = commit
+        self.staging = f"_stg_{table}"
+        self._reset()
+
+        # binary COPY шлёт текст как есть, договариваемся об UTF-8
+        conn.set_client_encoding("UTF8")
+        with conn.cursor() as cur:
+            cur.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {self.staging} ("
+                + ", ".join(f"{name} {PG_TYPES[kind]}" for name, kind in self.columns)
+                + ") ON COMMIT DELETE ROWS"
+            )
+        conn.commit()
+
+    @classmethod
+    def for_model(cls, conn, model, fields, **kwargs):
+        """Писатель в таблицу Django-модели; fields — имена полей (FK — без _id)."""
+        columns = []
+        for name in fields:
+            field = model._meta.get_field(name)
+            target = field.target_field if field.is_relation else field
+            columns.append((field.column, DJANGO_KINDS[target.get_internal_type()]))
+        return cls(conn, model._meta.db_table, columns, **kwargs)
+
+    def _reset(self):
+        self.buf = io.BytesIO() if self.binary else io.StringIO()
+        if self.binary:
+            self.buf.write(BINARY_HEADER)
+        self.rows = 0
+
+    def __len__(self):
+        return self.rows
+
+    def add(self, *values):
+        if self.binary:
+            self.buf.write(struct.pack("!h", len(values)))
+            for kind, value in zip(self.kinds, values):
+                self.buf.write(_binary_field(kind, value))
+        else:
+            self.buf.write("\t".join(_text_field(k, v) for k, v in zip(self.kinds, values)))
+            self.buf.write("\n")
+        self.rows += 1
+
+    def _copy_to_staging(self, cur) -> str:
+        if self.binary:
+            self.buf.write(BINARY_TRAILER)
+        self.buf.seek(0)
+
+        names = ", ".join(name for name, _ in self.columns)
+        fmt = "binary" if self.binary else "text"
+        cur.copy_expert(
+            f"COPY {self.staging} ({names}) FROM STDIN WITH (FORMAT {fmt})",
+            self.buf,
+        )
+        return names
+
+    def _finish(self, cur):
+        if self.commit:
+            self.conn.commit()
+        else:
+            # ON COMMIT DELETE ROWS не сработает до коммита — чистим staging сами.
+            # DELETE, а не TRUNCATE: TRUNCATE в длинной транзакции вызывающего
+            # берёт ACCESS EXCLUSIVE и на каждом flush заводит новый relfilenode
+            cur.execute(f"DELETE FROM {self.staging}")
+        self._reset()
+
+    def flush(self) -> int:
+        """COPY буфера в staging + слияние в целевую таблицу. Возвращает число вставленных строк."""
+        if not self.rows:
+            return 0
+
+        with self.conn.cursor() as cur:
+            names = self._copy_to_staging(cur)
+            cur.execute(self.merge_sql.format(table=self.table, columns=names, staging=self.staging))
+            inserted = cur.rowcount
+            self._finish(cur)
+        return inserted
+
+    def flush_returning(self, keys, pk: str = "id") -> dict:
+        """
+        Upsert пакета одним запросом с возвратом PK каждого ключа.
+        keys — колонки естественного ключа; ответ {ключ: pk}, где ключ —
+        значение колонки, если она одна, иначе кортеж значений.
+        """
+        if not self.rows:
+            return {}
+
+        keys = list(keys)
+        sql = UPSERT_RETURNING_SQL.format(
+            table=self.table,
+            columns=", ".join(name for name, _ in self.columns),
+            staging=self.staging,
+            pk=pk,
+            keys=", ".join(keys),
+            target_pk=f"t.{pk}",
+            target_keys=", ".join(f"t.{k}" for k in keys),
+            join=" AND ".join(f"t.{k} = s.{k}" for k in keys),
+        )
+
+        with self.conn.cursor() as cur:
+            self._copy_to_staging(cur)
+            cur.execute(sql)
+            rows = cur.fetchall()
+            self._finish(cur)
+
+        if len(keys) == 1:
+            return {row[1]: row[0] for row in rows}
+        return {tuple(row[1:]): row[0] for row in rows}
@@ -0,0 +1,61 @@
+import argparse
+import os
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+django.setup()
+
+from sixmovies.models import Actor, ActorProfession, Genre, Profession, Title, TitlePrincipal, TitlePrincipalCharacter
+from etl import deferred_ddl
+
+
+def _target_tables():
+    """Таблицы, которые заливают нормализаторы."""
+    models = [
+        Title,
+        Genre,
+        Title.genres.through,
+        Actor,
+        Profession,
+        ActorProfession,
+        Actor.known_for.through,
+        TitlePrincipal,
+        TitlePrincipalCharacter,
+    ]
+    return [model._meta.db_table for model in models]
+
+
+def _lookup_keys():
+    """Ключи flush_returning нормализаторов: по ним BulkWriter ищет строки каждым пакетом."""
+    def columns(model, *fields):
+        return [model._meta.get_field(field).column for field in fields]
+
+    return {
+        Title._meta.db_table: [columns(Title, "tconst")],
+        Actor._meta.db_table: [columns(Actor, "nconst")],
+        Profession._meta.db_table: [columns(Profession, "name")],
+        TitlePrincipal._meta.db_table: [columns(TitlePrincipal, "title", "actor", "ordering")],
+    }
+
+
+def prepare_bulk_load():
+    deferred_ddl.prepare(_target_tables(), keep=_lookup_keys())
+
+
+def finish_bulk_load():
+    deferred_ddl.finish(_target_tables())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Отложенные индексы и внешние ключи для полной перезагрузки")
+    parser.add_argument(
+        "step",
+        choices=("prepare", "finish"),
+        help="prepare — удалить перед нормализацией, finish — построить заново после неё",
+    )
+    args = parser.parse_args()
+
+    if args.step == "prepare":
+        prepare_bulk_load()
+    else:
+        finish_bulk_load()
@@ -0,0 +1,65 @@
+"""
+Контрольные точки нормализаторов.
+
+Нормализатор читает raw-таблицу keyset-чанками по возрастанию ключа и после
+каждого чанка пишет в etl_checkpoint последний обработанный ключ — в той же
+транзакции, что и сами данные чанка. Поэтому после падения запись
+в etl_checkpoint точно соответствует тому, что уже лежит в базе, и --resume
+продолжает со следующего ключа. Успешный прогон удаляет свою точку.
+"""
+from etl.db import get_cursor
+
+TABLE = "etl_checkpoint"
+
+DDL = f"""
+CREATE TABLE IF NOT EXISTS {TABLE} (
+    stage      text PRIMARY KEY,
+    last_key   text[] NOT NULL,
+    rows       bigint NOT NULL,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+"""
+
+SAVE_SQL = f"""
+    INSERT INTO {TABLE} (stage, last_key, rows)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (stage) DO UPDATE
+    SET last_key = EXCLUDED.last_key, rows = EXCLUDED.rows, updated_at = now()
+"""
+
+
+def start(stage: str, resume: bool = False):
+    """
+    (последний ключ, обработано строк) для продолжения или (None, 0).
+    Без resume старая точка стирается — прогон начнётся сначала.
+    """
+    with get_cursor(commit=True) as cur:
+        cur.execute(DDL)
+        if not resume:
+            cur.execute(f"DELETE FROM {TABLE} WHERE stage = %s", (stage,))
+            return None, 0
+        cur.execute(f"SELECT last_key, rows FROM {TABLE} WHERE stage = %s", (stage,))
+        row = cur.fetchone()
+
+    if row is None:
+        print(f"→ {stage}: контрольной точки нет, начинаю сначала")
+        return None, 0
+    print(f"→ {stage}: продолжаю после ключа {tuple(row[0])}, уже обработано {row[1]:,} строк")
+    return tuple(row[0]), row[1]
+
+
+def save(cur, stage: str, key, rows: int):
+    """Записывает точку курсором вызывающего — коммит делает он вместе с данными чанка."""
+    cur.execute(SAVE_SQL, (stage, [str(k) for k in key], rows))
+
+
+def commit(conn, stage: str, key, rows: int):
+    """save() и commit соединения, в котором лежат записи чанка."""
+    with conn.cursor() as cur:
+        save(cur, stage, key, rows)
+    conn.commit()
+
+
+def clear(stage: str):
+    with get_cursor(commit=True) as cur:
+        cur.execute(f"DELETE FROM {TABLE} WHERE stage = %s", (stage,))
@@ -1,66 +1,410 @@
+import gzip
+import io
 import os
+import queue
+import threading
 import psycopg2
-from psycopg2.extras import DictCursor
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 from pathlib import Path
 
+from etl.db import extra_connections, get_connection
+
 load_dotenv()
 
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = int(os.getenv("DB_PORT"))
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
 IMDB_DATA_DIR = Path(os.getenv("IMDB_DATA_DIR"))
 
-def get_connection():
-    return psycopg2.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        cursor_factory=DictCursor,
-    )
-
-def safe_copy(path: Path, table: str):
-    print(f"[LOAD] {path.name} → {table}")
+# сколько соединений использовать для параллельного COPY больших дампов
+COPY_WORKERS = int(os.getenv("ETL_COPY_WORKERS", os.cpu_count() or 1))
+
+COPY_SQL = (
+    "COPY {table} FROM STDIN "
+    "WITH (FORMAT text, DELIMITER E'\\t', NULL '\\N')"
+)
+
+# по сколько строк переотправлять файл после упавшего COPY
+RECOVERY_CHUNK = int(os.getenv("ETL_RECOVERY_CHUNK", "50000"))
+
+# .tsv.gz: размер распакованного блока и сколько блоков держим в очереди
+GZIP_BLOCK_SIZE = int(os.getenv("ETL_GZIP_BLOCK_SIZE", str(1 << 20)))
+GZIP_QUEUE_BLOCKS = int(os.getenv("ETL_GZIP_QUEUE_BLOCKS", "16"))
+
+# сюда попадают строки, которые не смог принять COPY
+QUARANTINE_TABLE = "etl_copy_quarantine"
+
+QUARANTINE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {QUARANTINE_TABLE} (
+    id          bigserial PRIMARY KEY,
+    table_name  text,
+    source      text,
+    line_number bigint,
+    raw_line    text,
+    error       text,
+    created_at  timestamptz DEFAULT now()
+);
+"""
+
+def dump_path(name: str) -> Path:
+    """Путь к дампу IMDb: исходный .tsv.gz, если он лежит рядом, иначе .tsv."""
+    gz = IMDB_DATA_DIR / f"{name}.tsv.gz"
+    return gz if gz.exists() else IMDB_DATA_DIR / f"{name}.tsv"
+
+def safe_copy(path: Path, table: str, workers: int = 1):
+    _prepare_quarantine(table)
+
+    if path.suffix == ".gz":
+        return _copy_gzip(path, table, workers)
+
+    ranges = split_ranges(path, workers)
+
+    if len(ranges) == 1:
+        print(f"[LOAD] {path.name} → {table}")
+        start, end = ranges[0]
+        bad = _copy_range(path, table, start, end)
+    else:
+        print(f"[LOAD] {path.name} → {table} ({len(ranges)} диапазонов)")
+        with extra_connections(len(ranges)), ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            futures = [
+                pool.submit(_copy_range, path, table, start, end)
+                for start, end in ranges
+            ]
+            bad = sum(f.result() for f in futures)
+
+    if bad:
+        print(f"[DONE] COPY завершён, плохих строк: {bad} (см. {QUARANTINE_TABLE})")
+    else:
+        print("[OK] Быстрый COPY успешно выполнен.")
+
+
+# -----------------------
+# 🔥 ВОССТАНОВЛЕНИЕ ПОСЛЕ ОШИБКИ COPY
+# -----------------------
+def _prepare_quarantine(table: str):
+    """Создаёт таблицу карантина и чистит строки прошлой загрузки этой таблицы."""
     conn = get_connection()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(QUARANTINE_DDL)
+            cur.execute(f"DELETE FROM {QUARANTINE_TABLE} WHERE table_name = %s", (table,))
+    finally:
+        conn.close()
+
+
+def _recover(conn, sql: str, table: str, source: str, lines) -> tuple[int, int]:
+    """
+    Повторяет COPY чанками по RECOVERY_CHUNK строк под savepoint'ами.
+    Упавший чанк делится пополам, пока не останутся отдельные плохие строки —
+    они уходят в карантин, всё остальное грузится обычным COPY.
+    """
+    total = 0
+    bad = 0
+    chunk = []
+
+    def flush():
+        nonlocal total, bad
+        quarantined = []
+        with conn.cursor() as cur:
+            _copy_bisect(cur, sql, chunk, quarantined)
+            if quarantined:
+                execute_values(
+                    cur,
+                    f"INSERT INTO {QUARANTINE_TABLE} "
+                    "(table_name, source, line_number, raw_line, error) VALUES %s",
+                    [
+                        (table, source, line_number, _as_text(line), error)
+                        for line_number, line, error in quarantined
+                    ],
+                )
+        conn.commit()
+        total += len(chunk)
+        bad += len(quarantined)
+        chunk.clear()
+
+    for item in lines:
+        chunk.append(item)
+        if len(chunk) >= RECOVERY_CHUNK:
+            flush()
 
+    if chunk:
+        flush()
+
+    return total, bad
+
+
+def _copy_bisect(cur, sql: str, chunk: list, quarantined: list):
+    cur.execute("SAVEPOINT etl_copy")
     try:
-        with conn.cursor() as cur, open(path, "r", encoding="utf-8") as f:
+        cur.copy_expert(sql, io.BytesIO(b"".join(line for _, line in chunk)))
+        cur.execute("RELEASE SAVEPOINT etl_copy")
+        return
+    except psycopg2.Error as e:
+        cur.execute("ROLLBACK TO SAVEPOINT etl_copy")
+        cur.execute("RELEASE SAVEPOINT etl_copy")
+        error = str(e).strip()
+
+    if len(chunk) == 1:
+        line_number, line = chunk[0]
+        quarantined.append((line_number, line, error))
+        return
+
+    mid = len(chunk) // 2
+    _copy_bisect(cur, sql, chunk[:mid], quarantined)
+    _copy_bisect(cur, sql, chunk[mid:], quarantined)
+
+
+def _as_text(line: bytes) -> str:
+    # в text нельзя положить NUL, а битая кодировка — частая причина ошибки
+    return line.decode("utf-8", "replace").rstrip("\r\n").replace("\x00", "")
+
+
+def _count_lines(path: Path, offset: int) -> int:
+    """Сколько строк начинается до байта offset (нужно только на пути ошибки)."""
+    count = 0
+    with open(path, "rb") as f:
+        left = offset
+        while left > 0:
+            block = f.read(min(left, 1 << 24))
+            if not block:
+                break
+            count += block.count(b"\n")
+            left -= len(block)
+    return count
+
 
-            sql = (
-                f"COPY {table} FROM STDIN "
-                "WITH (FORMAT text, DELIMITER E'\\t', NULL '\\N')"
-            )
+def _range_lines(f, end: int, line_number: int):
+    while f.tell() < end:
+        yield line_number, f.readline()
+        line_number += 1
+
+
+# -----------------------
+# 🔥 COPY ПО ДИАПАЗОНАМ ФАЙЛА
+# -----------------------
+class _RangeReader:
+    """file-like для copy_expert: отдаёт байты файла только до позиции end."""
+
+    def __init__(self, f, end: int):
+        self.f = f
+        self.end = end
+
+    def read(self, size: int = -1) -> bytes:
+        left = self.end - self.f.tell()
+        if left <= 0:
+            return b""
+        if size is None or size < 0 or size > left:
+            size = left
+        return self.f.read(size)
+
+
+def split_ranges(path: Path, parts: int) -> list[tuple[int, int]]:
+    """Режет файл на диапазоны байт [start, end), выровненные по началу строк."""
+    size = path.stat().st_size
+    bounds = [0]
+
+    with open(path, "rb") as f:
+        for i in range(1, parts):
+            f.seek(size * i // parts)
+            f.readline()  # дочитываем строку, в которую попали
+            pos = f.tell()
+            if bounds[-1] < pos < size:
+                bounds.append(pos)
+
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _copy_range(path: Path, table: str, start: int, end: int):
+    sql = COPY_SQL.format(table=table)
+    conn = get_connection()
+    # читаем файл байтами, поэтому явно говорим серверу, что это UTF-8
+    conn.set_client_encoding("UTF8")
+
+    try:
+        with conn.cursor() as cur, open(path, "rb") as f:
+            f.seek(start)
+            # заголовок есть только у того, кому достался первый диапазон
+            if start == 0:
+                f.readline()
+            data_start = f.tell()
 
             try:
-                # быстрая попытка COPY
-                cur.copy_expert(sql, f)
+                cur.copy_expert(sql, _RangeReader(f, end))
                 conn.commit()
-                print(f"[OK] Быстрый COPY успешно выполнен.")
+                return 0
+
+            except psycopg2.Error:
+                print(f"[WARN] COPY {path.name} [{start}:{end}] упал, ищу плохие строки...")
+                conn.rollback()
+
+                f.seek(data_start)
+                first_line = _count_lines(path, data_start) + 1
+                total, bad = _recover(
+                    conn, sql, table, path.name,
+                    _range_lines(f, end, first_line),
+                )
+                print(f"[DONE] восстановление {path.name} [{start}:{end}]. Всего: {total}, плохих строк: {bad}")
+                return bad
+
+    finally:
+        conn.close()
+
+
+# -----------------------
+# 🔥 COPY ИЗ .tsv.gz
+# -----------------------
+class _GzipBlocks(threading.Thread):
+    """
+    Распаковывает .tsv.gz в отдельном потоке (zlib отпускает GIL)
+    и кладёт в ограниченную очередь блоки, выровненные по строкам.
+    Элемент очереди — (номер первой строки, байты); None — конец данных.
+    """
+
+    def __init__(self, path: Path, consumers: int):
+        super().__init__(daemon=True)
+        self.path = path
+        self.consumers = consumers
+        self.blocks = queue.Queue(maxsize=GZIP_QUEUE_BLOCKS)
+        self.stop = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            with gzip.open(self.path, "rb") as gz:
+                gz.readline()  # заголовок
+                line_number = 2
+                tail = b""
+
+                while not self.stop.is_set():
+                    data = gz.read(GZIP_BLOCK_SIZE)
+                    if not data:
+                        break
+                    data = tail + data
+                    cut = data.rfind(b"\n") + 1
+                    block, tail = data[:cut], data[cut:]
+                    if block:
+                        self._put((line_number, block))
+                        line_number += block.count(b"\n")
+
+                if tail:
+                    self._put((line_number, tail + b"\n"))
+        except Exception as e:
+            self.error = e
+        finally:
+            for _ in range(self.consumers):
+                self._put(None)
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.blocks.put(item, timeout=1)
                 return
+            except queue.Full:
+                continue
 
-            except Exception:
-                print("[WARN] COPY упал, fallback режим...")
 
-                f.seek(0)
-                header = next(f)
+class _QueueReader:
+    """file-like для copy_expert поверх общей очереди блоков; запоминает, что прочитал."""
+
+    def __init__(self, source: _GzipBlocks):
+        self.source = source
+        self.spans = []  # (первая строка, число строк) каждого взятого блока
+        self.buf = memoryview(b"")
+        self.done = False
+
+    def read(self, size: int = -1) -> bytes:
+        if not self.buf and not self.done:
+            item = self._next_block()
+            if item is None:
+                self.done = True
+                if self.source.error:
+                    raise RuntimeError(f"распаковка {self.source.path.name} упала") from self.source.error
+            else:
+                line_number, block = item
+                self.spans.append((line_number, block.count(b"\n")))
+                self.buf = memoryview(block)
 
-                total = 0
-                bad = 0
+        if size is None or size < 0:
+            size = len(self.buf)
+        chunk, self.buf = self.buf[:size], self.buf[size:]
+        return bytes(chunk)
+
+    def _next_block(self):
+        # после stop распаковщик перестаёт класть блоки и может не доставить всем None —
+        # ждём с таймаутом, чтобы не повиснуть в get() навсегда
+        while True:
+            try:
+                return self.source.blocks.get(timeout=1)
+            except queue.Empty:
+                if self.source.stop.is_set():
+                    raise RuntimeError(f"загрузка {self.source.path.name} прервана")
 
-                for line_num, line in enumerate(f, start=2):
-                    total += 1
-                    try:
-                        cur.copy_expert(sql, line)
-                    except Exception:
-                        bad += 1
-                        continue
 
+def _gzip_lines(path: Path, spans: list):
+    """Повторно читает .tsv.gz и отдаёт (номер, строка) только из указанных блоков."""
+    spans = iter(spans)
+    first, count = next(spans, (None, 0))
+
+    with gzip.open(path, "rb") as gz:
+        for line_number, line in enumerate(gz, start=1):
+            if first is None:
+                return
+            if line_number < first:
+                continue
+            yield line_number, line if line.endswith(b"\n") else line + b"\n"
+            if line_number == first + count - 1:
+                first, count = next(spans, (None, 0))
+
+
+def _copy_blocks(source: _GzipBlocks, table: str):
+    sql = COPY_SQL.format(table=table)
+    conn = get_connection()
+    conn.set_client_encoding("UTF8")
+    reader = _QueueReader(source)
+
+    try:
+        with conn.cursor() as cur:
+            try:
+                cur.copy_expert(sql, reader, size=GZIP_BLOCK_SIZE)
                 conn.commit()
-                print(f"[DONE] fallback завершён. Всего: {total}, плохих строк: {bad}")
+                return 0
+
+            except psycopg2.Error:
+                print(f"[WARN] COPY {source.path.name} упал, ищу плохие строки...")
+                conn.rollback()
+
+                total, bad = _recover(
+                    conn, sql, table, source.path.name,
+                    _gzip_lines(source.path, reader.spans),
+                )
+                print(f"[DONE] восстановление {source.path.name}. Всего: {total}, плохих строк: {bad}")
+                return bad
+
+            except Exception:
+                source.stop.set()
+                raise
 
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+
+def _copy_gzip(path: Path, table: str, workers: int = 1):
+    """COPY из .tsv.gz без распаковки на диск: распаковка идёт параллельно записи."""
+    workers = max(workers, 1)
+    print(f"[LOAD] {path.name} → {table} (gzip, {workers} соединений)")
+
+    source = _GzipBlocks(path, workers)
+    source.start()
+
+    try:
+        with extra_connections(workers), ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_copy_blocks, source, table) for _ in range(workers)]
+            bad = sum(f.result() for f in futures)
+    finally:
+        source.stop.set()
+        source.join()
+
+    if bad:
+        print(f"[DONE] COPY завершён, плохих строк: {bad} (см. {QUARANTINE_TABLE})")
+    else:
+        print("[OK] Быстрый COPY успешно выполнен.")
@@ -0,0 +1,84 @@
+import os
+import django
+import time
+
+import numpy as np
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+django.setup()
+
+from django.conf import settings
+from sixmovies.models import Actor, Title, TitlePrincipal
+from etl.db import get_cursor
+from etl.idmap import copy_int_columns
+from etl.popularity import CATEGORIES, TABLE as POPULARITY_TABLE
+from graph import versions
+from graph.csr import CoStarGraph
+
+PAIRS_SQL = """
+    SELECT
+        p.title_id::bigint,
+        substr(t.tconst, 3)::bigint,
+        p.actor_id::bigint,
+        substr(a.nconst, 3)::bigint,
+        (t.title_type = 'movie')::int::bigint,
+        coalesce(t.imdb_votes, 0)::bigint
+    FROM {principal} p
+    JOIN {title} t ON t.id = p.title_id
+    JOIN {actor} a ON a.id = p.actor_id
+    WHERE p.category IN ({categories})
+"""
+
+
+def build_graph():
+    """Строит CSR-граф партнёров по съёмкам в новую версию снимка под settings.GRAPH_DIR."""
+    print("→ Выгружаю пары тайтл–актёр из TitlePrincipal...")
+    start = time.time()
+
+    title_ids, title_tconst, actor_ids, actor_nconst, is_movie, votes = copy_int_columns(
+        PAIRS_SQL.format(
+            principal=TitlePrincipal._meta.db_table,
+            title=Title._meta.db_table,
+            actor=Actor._meta.db_table,
+            categories=", ".join(f"'{c}'" for c in CATEGORIES),
+        ),
+        6,
+    )
+    print(f"→ {len(title_ids):,} пар за {time.time() - start:.1f} сек, строю CSR...")
+
+    graph = CoStarGraph.from_pairs(
+        title_ids, title_tconst, actor_ids, actor_nconst,
+        title_is_movie=is_movie.astype(bool),
+        title_votes=votes,
+    )
+    load_popularity(graph)
+    path = versions.start(settings.GRAPH_DIR)
+    graph.save(path)
+
+    print(
+        f"✓ граф: {graph.num_actors:,} актёров, {graph.num_edges // 2:,} связей, "
+        f"{len(graph.title_ids):,} тайтлов за {time.time() - start:.1f} сек → {path}"
+    )
+
+
+def load_popularity(graph):
+    """actor_votes берём из материализованного рейтинга, если он уже посчитан."""
+    with get_cursor() as cur:
+        cur.execute("SELECT to_regclass(%s)", [POPULARITY_TABLE])
+        if cur.fetchone()[0] is None:
+            print(f"⚠️ {POPULARITY_TABLE} нет — популярность считаю по рёбрам графа")
+            return
+
+    actor_ids, scores = copy_int_columns(f"SELECT actor_id::bigint, score FROM {POPULARITY_TABLE}", 2)
+    order = np.argsort(graph.actor_ids)
+    pos = np.searchsorted(graph.actor_ids, actor_ids, sorter=order)
+    pos[pos == len(order)] = 0
+    found = np.asarray(graph.actor_ids)[order[pos]] == actor_ids
+
+    votes = np.zeros(graph.num_actors, dtype=np.int64)
+    votes[order[pos[found]]] = scores[found]
+    graph.actor_votes = votes
+
+
+if __name__ == "__main__":
+    build_graph()
@@ -0,0 +1,19 @@
+import os
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+django.setup()
+
+from django.conf import settings
+from graph import versions
+
+
+def publish_graph():
+    """Отдаёт собранную версию снимка воркерам API: они подхватят её без рестарта."""
+    version = versions.publish(settings.GRAPH_DIR)
+    print(f"✓ опубликована версия графа {version}")
+    return version
+
+
+if __name__ == "__main__":
+    publish_graph()
@@ -1,22 +1,208 @@
+"""
+Единый слой доступа к базе для ETL: пул psycopg2-соединений.
+
+Пул потокобезопасный и знает о fork: в дочернем процессе (ProcessPoolExecutor,
+multiprocessing) заводится свой пул, а унаследованные сокеты родителя не
+трогаются. Соединение из get_connection() — обычный psycopg2 connection,
+только close() возвращает его в пул. Если соединение долго лежало без дела,
+перед выдачей оно проверяется SELECT 1, а слишком старые пересоздаются.
+Когда все POOL_MAX соединений заняты, get_connection() ждёт освобождения,
+а не открывает новое сверх лимита max_connections. Код, который сам
+запускает n параллельных потоков с соединениями, поднимает лимит на время
+работы через extra_connections(n), чтобы потоки не ждали друг друга до PoolTimeout.
+"""
+import os
+import threading
+import time
 from contextlib import contextmanager
 from typing import Iterator, Any
 
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as PgConnection
 from psycopg2.extras import DictCursor
-import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# сколько строк за один round trip тянет server-side курсор
+STREAM_ITERSIZE = int(os.getenv("ETL_STREAM_ITERSIZE", "10000"))
+
+# сколько строк в одном keyset-чанке нормализатора (единица транзакции и контрольной точки)
+KEYSET_CHUNK = int(os.getenv("ETL_KEYSET_CHUNK", "50000"))
+
+# размер пула на процесс: сколько соединений открыть сразу и больше скольки не открывать
+POOL_MIN = int(os.getenv("ETL_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("ETL_POOL_MAX", "16"))
+
+# сколько секунд ждать свободного соединения, прежде чем сдаться
+POOL_TIMEOUT = float(os.getenv("ETL_POOL_TIMEOUT", "300"))
+
+# соединение, пролежавшее в пуле дольше, проверяется SELECT 1 перед выдачей
+HEALTH_CHECK_AFTER = float(os.getenv("ETL_POOL_HEALTH_CHECK_AFTER", "30"))
+
+# соединения старше этого пересоздаются (0 — не ограничивать)
+MAX_AGE = float(os.getenv("ETL_POOL_MAX_AGE", "3600"))
+
+
+def _dsn() -> dict:
+    return {
+        "host": os.getenv("DB_HOST", "localhost"),
+        "port": os.getenv("DB_PORT", "5432"),
+        "dbname": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+    }
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+class PooledConnection(PgConnection):
+    """psycopg2-соединение, у которого close() возвращает его в пул."""
+
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            return super().close()
+        self.pool.put(self)
+
+    def discard(self):
+        """Закрывает соединение по-настоящему, минуя пул."""
+        self.pool = None
+        super().close()
+
+
+class ConnectionPool:
+    def __init__(self, minconn: int = POOL_MIN, maxconn: int = POOL_MAX):
+        self.pid = os.getpid()
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(maxconn)
+        # сколько мест снять с лимита, когда соединения вернутся (см. shrink)
+        self._debt = 0
+        for _ in range(minconn):
+            self._idle.append(self._connect())
+
+    def _connect(self) -> PooledConnection:
+        conn = psycopg2.connect(**_dsn(), cursor_factory=DictCursor, connection_factory=PooledConnection)
+        conn.pool = self
+        conn.created_at = conn.last_used = time.monotonic()
+        conn.checked_out = False
+        return conn
+
+    def _healthy(self, conn: PooledConnection) -> bool:
+        now = time.monotonic()
+        if conn.closed or (MAX_AGE and now - conn.created_at > MAX_AGE):
+            return False
+        if now - conn.last_used < HEALTH_CHECK_AFTER:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def get(self) -> PooledConnection:
+        if not self._slots.acquire(timeout=POOL_TIMEOUT):
+            raise PoolTimeout(f"нет свободного соединения за {POOL_TIMEOUT:.0f} сек")
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    conn = self._connect()
+                elif not self._healthy(conn):
+                    conn.discard()
+                    continue
+                conn.checked_out = True
+                return conn
+        except BaseException:
+            self._release()
+            raise
+
+    def put(self, conn: PooledConnection):
+        if not conn.checked_out:
+            return  # повторный close()
+        conn.checked_out = False
+        try:
+            if conn.closed:
+                # соединение порвалось у вызывающего — в пул его не возвращаем
+                conn.discard()
+                return
+            if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+            conn.last_used = time.monotonic()
+            with self._lock:
+                self._idle.append(conn)
+        except psycopg2.Error:
+            conn.discard()
+        finally:
+            self._release()
+
+    def _release(self):
+        with self._lock:
+            if self._debt:
+                self._debt -= 1
+                return
+        self._slots.release()
+
+    def grow(self, n: int):
+        """Ещё n соединений сверх текущего лимита."""
+        self._slots.release(n)
+
+    def shrink(self, n: int):
+        """Снимает n соединений с лимита; занятые места снимаются, когда их вернут в пул."""
+        with self._lock:
+            for _ in range(n):
+                if not self._slots.acquire(blocking=False):
+                    self._debt += 1
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.discard()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# пулы родительского процесса: держим ссылки, чтобы сборщик не закрыл чужие сокеты
+_inherited = []
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    pool = _pool
+    if pool is None or pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                if _pool is not None:
+                    _inherited.append(_pool)
+                _pool = ConnectionPool()
+            pool = _pool
+    return pool
+
+
 def get_connection():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST", "localhost"),
-        port=os.getenv("DB_PORT", "5432"),
-        dbname=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        cursor_factory=DictCursor,
-    )
+    """Соединение из пула процесса; close() вернёт его обратно."""
+    return get_pool().get()
+
+
+@contextmanager
+def extra_connections(n: int):
+    """Лимит пула процесса выше на n, пока вызывающий держит n своих потоков."""
+    pool = get_pool()
+    pool.grow(n)
+    try:
+        yield
+    finally:
+        pool.shrink(n)
 
 @contextmanager
 def get_cursor(commit: bool = False) -> Iterator[Any]:
@@ -28,4 +214,77 @@ def get_cursor(commit: bool = False) -> Iterator[Any]:
             if commit:
                 conn.commit()
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+def stream_rows(query: str, params=None, name: str = "etl_stream", itersize: int = STREAM_ITERSIZE) -> Iterator[Any]:
+    """
+    Настоящий стриминг raw-таблицы: именованный (server-side) курсор
+    отдаёт строки порциями по itersize, а не тянет весь результат в память.
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor(name=name) as cur:
+            cur.itersize = itersize
+            cur.execute(query, params)
+            yield from cur
+    finally:
+        conn.close()
+
+
+@contextmanager
+def _cursor_on(conn, commit: bool = False) -> Iterator[Any]:
+    """Курсор на соединении вызывающего или, если его нет, на соединении из пула."""
+    if conn is None:
+        with get_cursor(commit) as cur:
+            yield cur
+        return
+    with conn.cursor() as cur:
+        yield cur
+    if commit:
+        conn.commit()
+
+
+def keyset_index(table: str, key, conn=None):
+    """Индекс, по которому keyset_chunks и etl.shards идут по возрастанию key."""
+    key = list(key)
+    with _cursor_on(conn, commit=True) as cur:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {table}_{'_'.join(key)}_keyset ON {table} ({', '.join(key)})")
+
+
+def keyset_chunks(table: str, columns, key, where: str = "TRUE", after=None,
+                  chunk_size: int = KEYSET_CHUNK, conn=None) -> Iterator[Any]:
+    """
+    Читает table чанками по возрастанию key без OFFSET: каждый запрос
+    начинается строго после последнего ключа предыдущего чанка.
+    Отдаёт (строки, ключ последней строки); after — ключ, с которого продолжить.
+    key должен быть уникален; индекс по нему создаётся при первом чтении.
+    conn — соединение, которое вызывающий уже держит (нормализатор пишет через
+    него чанк и контрольную точку): чтение идёт по нему же, и один нормализатор
+    не занимает два соединения пула.
+    """
+    columns, key = list(columns), list(key)
+    positions = [columns.index(k) for k in key]
+    key_sql = ", ".join(key)
+    keyset_index(table, key, conn)
+
+    base = (
+        f"SELECT {', '.join(columns)} FROM {table} "
+        f"WHERE ({where}) AND {' AND '.join(f'{k} IS NOT NULL' for k in key)}"
+    )
+    while True:
+        with _cursor_on(conn) as cur:
+            if after is None:
+                cur.execute(f"{base} ORDER BY {key_sql} LIMIT %s", (chunk_size,))
+            else:
+                marks = ", ".join(["%s"] * len(key))
+                cur.execute(
+                    f"{base} AND ({key_sql}) > ({marks}) ORDER BY {key_sql} LIMIT %s",
+                    (*after, chunk_size),
+                )
+            rows = cur.fetchall()
+        if not rows:
+            return
+        after = tuple(rows[-1][i] for i in positions)
+        yield rows, after
+        if len(rows) < chunk_size:
+            return
@@ -0,0 +1,164 @@
+"""
+Режим массовой загрузки для полной перезагрузки (manage.py imdb_etl --bulk).
+
+Пока нормализаторы заливают данные, Postgres не должен обновлять вторичные
+индексы и проверять внешние ключи на каждую строку: prepare() запоминает их
+определения в etl_deferred_ddl и удаляет, finish() строит индексы заново —
+по соединению на индекс, каждый с параллельными maintenance-воркерами, —
+возвращает внешние ключи через NOT VALID + VALIDATE и обновляет статистику
+ANALYZE. Уникальные индексы и первичные ключи остаются: на них держится
+ON CONFLICT в BulkWriter. Остаются и индексы, ведущая колонка которых входит
+в ключ flush_returning (keep в prepare): каждым пакетом BulkWriter джойнит
+staging с целевой таблицей по этому ключу, и без индекса каждый пакет читал
+бы таблицу целиком. raw-таблицы imdb_* в этом режиме UNLOGGED — их
+пересоздают каждый прогон, WAL для них не нужен.
+
+Определения лежат в базе и удаляются из etl_deferred_ddl в той же
+транзакции, что восстанавливает объект, поэтому после падения посередине
+повторный finish() вернёт всё, что ещё не вернулось.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from etl.db import get_cursor
+
+TABLE = "etl_deferred_ddl"
+
+# сколько индексов и внешних ключей восстанавливать одновременно (по соединению на каждый)
+REBUILD_CONNECTIONS = int(os.getenv("ETL_REBUILD_CONNECTIONS", "4"))
+
+# параллельные воркеры и память на одну сборку индекса
+MAINTENANCE_WORKERS = int(os.getenv("ETL_MAINTENANCE_WORKERS", "4"))
+MAINTENANCE_WORK_MEM = os.getenv("ETL_MAINTENANCE_WORK_MEM", "1GB")
+
+DDL = f"""
+CREATE TABLE IF NOT EXISTS {TABLE} (
+    kind       text NOT NULL,   -- index | fk
+    table_name text NOT NULL,
+    name       text NOT NULL,
+    definition text NOT NULL,
+    PRIMARY KEY (kind, table_name, name)
+);
+"""
+
+# неуникальные индексы, не обслуживающие никакое ограничение, с колонками по порядку
+INDEXES_SQL = """
+    SELECT t.relname, c.relname, pg_get_indexdef(i.indexrelid),
+           ARRAY(
+               SELECT a.attname::text
+               FROM unnest(i.indkey::int2[]) WITH ORDINALITY k(attnum, n)
+               JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+               ORDER BY k.n
+           )
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    JOIN pg_class t ON t.oid = i.indrelid
+    WHERE i.indrelid = ANY(%s::regclass[])
+      AND NOT i.indisunique
+      AND NOT i.indisprimary
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint k WHERE k.conindid = i.indexrelid)
+"""
+
+FOREIGN_KEYS_SQL = """
+    SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+    FROM pg_constraint
+    WHERE contype = 'f' AND conrelid = ANY(%s::regclass[])
+"""
+
+SAVE_SQL = f"""
+    INSERT INTO {TABLE} (kind, table_name, name, definition)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT DO NOTHING
+"""
+
+FORGET_SQL = f"DELETE FROM {TABLE} WHERE kind = %s AND table_name = %s AND name = %s"
+
+
+def unlogged(ddl: str) -> str:
+    """DDL raw-таблицы → та же таблица UNLOGGED."""
+    return ddl.replace("CREATE TABLE", "CREATE UNLOGGED TABLE")
+
+
+def _serves(columns, keys) -> bool:
+    """Индекс с колонками columns годится для джойна по одному из keys: ведущая колонка из ключа."""
+    return bool(columns) and any(columns[0] in key for key in keys)
+
+
+def prepare(tables, keep=None):
+    """
+    Удаляет вторичные индексы и внешние ключи tables, запомнив их определения.
+    keep — {таблица: [ключ, …]}: индексы, ведущая колонка которых входит в ключ, не трогаем.
+    """
+    tables, keep = list(tables), keep or {}
+    with get_cursor(commit=True) as cur:
+        cur.execute(DDL)
+        cur.execute(INDEXES_SQL, (tables,))
+        indexes = [
+            (table, name, definition)
+            for table, name, definition, columns in cur.fetchall()
+            if not _serves(columns, keep.get(table, ()))
+        ]
+        cur.execute(FOREIGN_KEYS_SQL, (tables,))
+        foreign_keys = cur.fetchall()
+
+        for table, name, definition in foreign_keys:
+            cur.execute(SAVE_SQL, ("fk", table, name, definition))
+            cur.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+        for table, name, definition in indexes:
+            cur.execute(SAVE_SQL, ("index", table, name, definition))
+            cur.execute(f'DROP INDEX "{name}"')
+
+    print(f"→ bulk: отложено {len(indexes)} индексов и {len(foreign_keys)} внешних ключей")
+
+
+def _rebuild_index(table: str, name: str, definition: str):
+    start = time.time()
+    with get_cursor(commit=True) as cur:
+        cur.execute(f"SET max_parallel_maintenance_workers = {MAINTENANCE_WORKERS}")
+        cur.execute("SET maintenance_work_mem = %s", (MAINTENANCE_WORK_MEM,))
+        cur.execute(definition.replace("CREATE INDEX ", "CREATE INDEX IF NOT EXISTS ", 1))
+        cur.execute(FORGET_SQL, ("index", table, name))
+    print(f"✓ индекс {name} за {time.time() - start:.1f} сек")
+
+
+def _restore_foreign_key(table: str, name: str, definition: str):
+    start = time.time()
+    # NOT VALID не держит долгую блокировку, проверку строк делает VALIDATE
+    with get_cursor(commit=True) as cur:
+        cur.execute(
+            "SELECT 1 FROM pg_constraint WHERE conrelid = %s::regclass AND conname = %s",
+            (table, name),
+        )
+        if cur.fetchone() is None:
+            cur.execute(f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition} NOT VALID')
+    with get_cursor(commit=True) as cur:
+        cur.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT "{name}"')
+        cur.execute(FORGET_SQL, ("fk", table, name))
+    print(f"✓ внешний ключ {name} за {time.time() - start:.1f} сек")
+
+
+def finish(tables, connections: int = REBUILD_CONNECTIONS):
+    """Возвращает отложенные индексы и внешние ключи и делает ANALYZE tables."""
+    start = time.time()
+    with get_cursor(commit=True) as cur:
+        cur.execute(DDL)
+        cur.execute(f"SELECT kind, table_name, name, definition FROM {TABLE} ORDER BY kind, table_name, name")
+        deferred = cur.fetchall()
+
+    indexes = [row[1:] for row in deferred if row[0] == "index"]
+    foreign_keys = [row[1:] for row in deferred if row[0] == "fk"]
+    print(f"→ bulk: строю {len(indexes)} индексов и {len(foreign_keys)} внешних ключей в {connections} соединениях...")
+
+    # VALIDATE читает те же таблицы, что и CREATE INDEX, — не запускаем их вперемешку
+    with ThreadPoolExecutor(max_workers=max(connections, 1)) as pool:
+        for future in [pool.submit(_rebuild_index, *index) for index in indexes]:
+            future.result()
+        for future in [pool.submit(_restore_foreign_key, *fk) for fk in foreign_keys]:
+            future.result()
+
+    with get_cursor(commit=True) as cur:
+        for table in tables:
+            cur.execute(f"ANALYZE {table}")
+
+    print(f"✓ bulk: индексы, ключи и статистика готовы за {time.time() - start:.1f} сек")
@@ -0,0 +1,137 @@
+"""
+Инкрементальное обновление дампов IMDb.
+
+Для каждого датасета храним отпечаток (md5) его строк по ключу — tconst/nconst.
+После загрузки свежего дампа в raw-таблицу compute() сравнивает новые отпечатки
+со старыми и складывает в etl_delta только добавленные (I), изменённые (U)
+и пропавшие (D) ключи. Нормализаторы в режиме --delta читают лишь эти ключи,
+а commit() после успешной нормализации делает новые отпечатки базой.
+
+Строка, которая ссылается на тайтл или актёра, ещё не появившегося в дампе,
+нормализуется без этой ссылки. Отпечаток такого ключа не сохраняется
+(pending в commit()), поэтому следующий запуск снова отдаст его
+нормализатору — когда ссылка появится, строка догрузится целиком.
+"""
+import time
+
+from etl.db import get_cursor
+
+# датасет → raw-таблица и ключ; grouped — у ключа несколько строк (principals)
+DATASETS = {
+    "title_basics": {"table": "imdb_title_basics", "key": "tconst", "grouped": False},
+    "name_basics": {"table": "imdb_name_basics", "key": "nconst", "grouped": False},
+    "title_principals": {"table": "imdb_title_principals", "key": "tconst", "grouped": True},
+}
+
+DDL = """
+CREATE TABLE IF NOT EXISTS etl_row_fingerprint (
+    dataset text NOT NULL,
+    key     text NOT NULL,
+    hash    uuid NOT NULL,
+    PRIMARY KEY (dataset, key)
+);
+CREATE TABLE IF NOT EXISTS etl_delta (
+    dataset text NOT NULL,
+    key     text NOT NULL,
+    op      char(1) NOT NULL,
+    hash    uuid,
+    PRIMARY KEY (dataset, key)
+);
+"""
+
+# отпечаток строки — md5 от её текстового представления целиком
+FINGERPRINT_SQL = """
+    SELECT {key} AS key, md5(r::text)::uuid AS hash
+    FROM {table} r
+    WHERE {key} IS NOT NULL
+"""
+
+# для principals отпечаток считается по всем строкам тайтла сразу
+GROUPED_FINGERPRINT_SQL = """
+    SELECT {key} AS key, md5(string_agg(r::text, E'\\n' ORDER BY r::text))::uuid AS hash
+    FROM {table} r
+    WHERE {key} IS NOT NULL
+    GROUP BY {key}
+"""
+
+DELTA_SQL = """
+    DELETE FROM etl_delta WHERE dataset = %(dataset)s;
+
+    CREATE TEMP TABLE _fp_new ON COMMIT DROP AS {fingerprints};
+    CREATE INDEX ON _fp_new (key);
+    ANALYZE _fp_new;
+
+    INSERT INTO etl_delta (dataset, key, op, hash)
+    SELECT %(dataset)s, n.key, CASE WHEN o.key IS NULL THEN 'I' ELSE 'U' END, n.hash
+    FROM _fp_new n
+    LEFT JOIN etl_row_fingerprint o ON o.dataset = %(dataset)s AND o.key = n.key
+    WHERE o.hash IS DISTINCT FROM n.hash;
+
+    INSERT INTO etl_delta (dataset, key, op)
+    SELECT %(dataset)s, o.key, 'D'
+    FROM etl_row_fingerprint o
+    WHERE o.dataset = %(dataset)s
+      AND NOT EXISTS (SELECT 1 FROM _fp_new n WHERE n.key = o.key);
+"""
+
+COMMIT_SQL = """
+    DELETE FROM etl_row_fingerprint o
+    USING etl_delta d
+    WHERE d.dataset = %(dataset)s AND d.op = 'D'
+      AND o.dataset = d.dataset AND o.key = d.key;
+
+    INSERT INTO etl_row_fingerprint (dataset, key, hash)
+    SELECT dataset, key, hash
+    FROM etl_delta
+    WHERE dataset = %(dataset)s AND op IN ('I', 'U')
+      AND key NOT IN ({pending})
+    ON CONFLICT (dataset, key) DO UPDATE SET hash = EXCLUDED.hash;
+
+    DELETE FROM etl_delta WHERE dataset = %(dataset)s;
+"""
+
+
+def compute(dataset: str) -> dict:
+    """Сравнивает свежую raw-таблицу с сохранёнными отпечатками и заполняет etl_delta."""
+    spec = DATASETS[dataset]
+    template = GROUPED_FINGERPRINT_SQL if spec["grouped"] else FINGERPRINT_SQL
+    fingerprints = template.format(table=spec["table"], key=spec["key"])
+
+    print(f"→ Считаю дельту {dataset}...")
+    start = time.time()
+
+    with get_cursor(commit=True) as cur:
+        cur.execute(DDL)
+        cur.execute(DELTA_SQL.format(fingerprints=fingerprints), {"dataset": dataset})
+        cur.execute(
+            "SELECT op, count(*) FROM etl_delta WHERE dataset = %s GROUP BY op",
+            (dataset,),
+        )
+        counts = {op: n for op, n in cur.fetchall()}
+
+    print(
+        f"✓ дельта {dataset}: +{counts.get('I', 0):,} "
+        f"~{counts.get('U', 0):,} -{counts.get('D', 0):,} "
+        f"за {time.time() - start:.1f} сек"
+    )
+    return counts
+
+
+def keys_filter(dataset: str, column: str, ops: str = "IU") -> str:
+    """SQL-условие «column входит в дельту датасета с операциями ops»."""
+    op_list = ", ".join(f"'{op}'" for op in ops)
+    return (
+        f"{column} IN (SELECT key FROM etl_delta "
+        f"WHERE dataset = '{dataset}' AND op IN ({op_list}))"
+    )
+
+
+def commit(dataset: str, pending: str = None):
+    """
+    Новые отпечатки становятся базой для следующего запуска.
+    pending — SELECT ключей дельты, которые ссылаются на ещё не загруженные
+    тайтлы или актёров: их отпечатки не сохраняются, и ключи придут снова.
+    """
+    with get_cursor(commit=True) as cur:
+        cur.execute(COMMIT_SQL.format(pending=pending or "SELECT NULL::text WHERE FALSE"), {"dataset": dataset})
+    print(f"✓ отпечатки {dataset} сохранены")
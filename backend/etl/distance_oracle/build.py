@@ -0,0 +1,73 @@
+import os
+import django
+import shutil
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+django.setup()
+
+from django.conf import settings
+from graph import versions
+from graph.csr import CoStarGraph
+from graph.oracle import MAX_DEPTH, UNKNOWN, DistanceOracle
+from graph.search import BITSET_SOURCES, bitset_distances
+
+# сколько самых популярных актёров (по голосам их тайтлов) покрывает оракул
+TOP_ACTORS = int(os.getenv("ORACLE_TOP_ACTORS", "20000"))
+
+WORKERS = int(os.getenv("ORACLE_WORKERS", os.cpu_count() or 1))
+
+_graph = None
+_oracle = None
+
+
+def _init_worker(graph_path, oracle_path):
+    # граф и матрица открываются через mmap: воркеры пишут свои строки прямо в файл
+    global _graph, _oracle
+    _graph = CoStarGraph.load(graph_path)
+    _oracle = DistanceOracle.load(oracle_path, mode="r+")
+
+
+def _fill_rows(lo, hi):
+    """Один bitset-BFS на строки [lo, hi) матрицы."""
+    dist = bitset_distances(_graph, _oracle.actors[lo:hi], _oracle.actors, MAX_DEPTH)
+    _oracle.distances[lo:hi] = np.where(dist < 0, UNKNOWN, dist).astype(np.uint8)
+    _oracle.distances.flush()
+    return hi - lo
+
+
+def build_oracle():
+    """Пересчитывает матрицу расстояний топ-N актёров и подменяет ею старую."""
+    start = time.time()
+    root = versions.building(settings.GRAPH_DIR)
+    graph = CoStarGraph.load(root)
+    target = root / "oracle"
+    staging = root / "oracle_new"
+
+    shutil.rmtree(staging, ignore_errors=True)
+    oracle = DistanceOracle.create(staging, graph.top_actors(TOP_ACTORS), graph.num_actors)
+    n = len(oracle)
+    bounds = list(range(0, n, BITSET_SOURCES))
+
+    print(f"→ Оракул {n:,} × {n:,} ({n * n / 2 ** 20:,.0f} МиБ), {len(bounds):,} проходов на {WORKERS} процессах...")
+
+    done = 0
+    # spawn, а не fork: сборка может идти из многопоточного оркестратора (imdb_etl)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(WORKERS, mp_context=context, initializer=_init_worker, initargs=(root, staging)) as pool:
+        for rows in pool.map(_fill_rows, bounds, [min(lo + BITSET_SOURCES, n) for lo in bounds]):
+            done += rows
+            if done % (BITSET_SOURCES * 20) == 0 or done == n:
+                print(f"→ строк {done:,}/{n:,} за {time.time() - start:.1f} сек")
+
+    versions.replace_dir(staging, target)
+
+    print(f"✓ оракул расстояний готов за {time.time() - start:.1f} сек → {target}")
+
+
+if __name__ == "__main__":
+    build_oracle()
@@ -0,0 +1,132 @@
+"""
+Резидентная карта tconst/nconst → PK для нормализаторов.
+
+Числовая часть идентификатора (tt0111161 → 111161) и PK лежат в двух
+отсортированных NumPy-массивах. Карта строится один раз за запуск одним
+binary COPY и дальше резолвит целые пакеты бинарным поиском, без запросов
+к базе и без ORM-объектов. Массивы можно сохранить в .npy и открыть через
+mmap — тогда процессы-воркеры делят одни и те же страницы.
+"""
+import io
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from etl.db import get_connection
+
+_COPY_HEADER = 19
+_COPY_TRAILER = 2
+
+MISSING = -1
+
+# карты, общие для всех стадий одного процесса (см. IdMap.shared)
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def copy_int_columns(query: str, ncols: int) -> list:
+    """
+    Результат запроса из ncols NOT NULL bigint-колонок → список NumPy-векторов.
+    Данные идут binary COPY и разбираются np.frombuffer без построчного Python.
+    """
+    fields = [("fields", ">i2")]
+    for i in range(ncols):
+        fields += [(f"len{i}", ">i4"), (f"col{i}", ">i8")]
+
+    buf = io.BytesIO()
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT binary)", buf)
+    finally:
+        conn.close()
+
+    view = buf.getbuffer()
+    rows = np.frombuffer(view[_COPY_HEADER:len(view) - _COPY_TRAILER], dtype=np.dtype(fields))
+    return [rows[f"col{i}"].astype(np.int64) for i in range(ncols)]
+
+
+def const_number(value) -> int:
+    """tt0111161 / nm0000138 → 111161 / 138; мусор → MISSING."""
+    if not value or len(value) < 3 or not value[2:].isdigit():
+        return MISSING
+    return int(value[2:])
+
+
+class IdMap:
+    def __init__(self, keys: np.ndarray, ids: np.ndarray):
+        self.keys = keys
+        self.ids = ids
+
+    @classmethod
+    def from_table(cls, table: str, key_column: str, pk_column: str = "id") -> "IdMap":
+        keys, ids = copy_int_columns(
+            f"SELECT substr({key_column}, 3)::bigint, {pk_column}::bigint "
+            f"FROM {table} WHERE {key_column} ~ '^[a-z][a-z][0-9]+$' ORDER BY 1",
+            2,
+        )
+        return cls(keys, ids)
+
+    @classmethod
+    def from_model(cls, model, key_field: str) -> "IdMap":
+        """Карта для Django-модели: Title/tconst, Actor/nconst."""
+        meta = model._meta
+        return cls.from_table(meta.db_table, meta.get_field(key_field).column, meta.pk.column)
+
+    @classmethod
+    def shared(cls, model, key_field: str) -> "IdMap":
+        """
+        Карта модели, общая для процесса: оркестратор строит её один раз на все
+        стадии, которые её читают, и сбрасывает через forget() после стадий,
+        которые пишут в модель.
+        """
+        key = (model._meta.db_table, key_field)
+        with _shared_lock:
+            if key not in _shared:
+                _shared[key] = cls.from_model(model, key_field)
+            return _shared[key]
+
+    @staticmethod
+    def forget(model):
+        """Сбрасывает общие карты модели — таблица изменилась."""
+        with _shared_lock:
+            for key in [k for k in _shared if k[0] == model._meta.db_table]:
+                del _shared[key]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, numbers) -> np.ndarray:
+        """Вектор числовых ключей → вектор PK (MISSING, если ключа нет)."""
+        numbers = np.asarray(numbers, dtype=np.int64)
+        if not len(self.keys):
+            return np.full(len(numbers), MISSING, dtype=np.int64)
+
+        pos = np.searchsorted(self.keys, numbers)
+        pos[pos == len(self.keys)] = 0
+        found = self.keys[pos] == numbers
+        return np.where(found, self.ids[pos], MISSING)
+
+    def resolve(self, consts) -> dict:
+        """Пакет tconst/nconst → {const: pk} только для найденных."""
+        consts = list(consts)
+        numbers = np.fromiter((const_number(c) for c in consts), dtype=np.int64, count=len(consts))
+        return {
+            const: int(pk)
+            for const, pk in zip(consts, self.lookup(numbers))
+            if pk != MISSING
+        }
+
+    def save(self, path: Path):
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "keys.npy", self.keys)
+        np.save(path / "ids.npy", self.ids)
+
+    @classmethod
+    def open(cls, path: Path) -> "IdMap":
+        """Открывает сохранённую карту через mmap, не читая её в память процесса."""
+        return cls(
+            np.load(path / "keys.npy", mmap_mode="r"),
+            np.load(path / "ids.npy", mmap_mode="r"),
+        )
@@ -0,0 +1,80 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from etl import pipeline
+
+
+class Command(BaseCommand):
+    help = "Полный прогон ETL IMDb: стадии из etl/pipeline.py по DAG зависимостей, независимые — параллельно"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=int(os.getenv("ETL_STAGE_WORKERS", "4")),
+            help="сколько стадий выполнять одновременно",
+        )
+        parser.add_argument(
+            "--delta",
+            action="store_true",
+            help="нормализаторы обрабатывают только изменившиеся ключи",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="нормализаторы продолжают с последней контрольной точки (etl/checkpoint.py)",
+        )
+        parser.add_argument(
+            "--shards",
+            type=int,
+            default=int(os.getenv("ETL_SHARDS", "1")),
+            help="нормализаторы делят raw-таблицу на столько диапазонов ключа и процессов (etl/shards.py)",
+        )
+        parser.add_argument(
+            "--bulk",
+            action="store_true",
+            help="полная перезагрузка: raw-таблицы UNLOGGED, индексы и внешние ключи строятся после нормализации",
+        )
+        parser.add_argument("--only", nargs="+", metavar="STAGE", help="выполнить только эти стадии")
+        parser.add_argument("--skip", nargs="+", metavar="STAGE", help="пропустить эти стадии")
+        parser.add_argument("--list", action="store_true", help="показать стадии и зависимости и выйти")
+
+    def handle(self, *args, **options):
+        if options["bulk"] and options["delta"]:
+            raise CommandError("--bulk — режим полной перезагрузки, с --delta он не сочетается")
+
+        stages = pipeline.bulk(pipeline.STAGES) if options["bulk"] else pipeline.STAGES
+        try:
+            stages = pipeline.select(stages, options["only"], options["skip"])
+        except KeyError as e:
+            raise CommandError(f"неизвестная стадия: {e.args[0]}")
+
+        if options["list"]:
+            for stage in stages:
+                deps = ", ".join(stage.deps) or "—"
+                self.stdout.write(f"{stage.name:<28} ← {deps}")
+            return
+
+        start = time.time()
+        timings, failed = pipeline.run(
+            stages, workers=options["workers"], delta=options["delta"], resume=options["resume"],
+            shards=options["shards"],
+            bulk=options["bulk"],
+        )
+        wall = time.time() - start
+
+        self.stdout.write("\n===== Стадии =====")
+        for name, (begin, end) in sorted(timings.items(), key=lambda item: item[1][0]):
+            self.stdout.write(f"{name:<28} +{begin - start:7.1f} сек  {end - begin:8.1f} сек")
+
+        length, path = pipeline.critical_path(stages, timings)
+        self.stdout.write(f"⏱ всего: {wall:.1f} сек, критический путь: {length:.1f} сек")
+        if path:
+            self.stdout.write(f"  {' → '.join(path)}")
+
+        if failed:
+            for name, error in failed:
+                self.stderr.write(f"✗ {name}: {error!r}")
+            raise CommandError(f"упали стадии: {', '.join(name for name, _ in failed)}")
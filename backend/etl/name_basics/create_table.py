@@ -1,4 +1,5 @@
-from app.etl.common import get_connection
+from etl.deferred_ddl import unlogged
+from etl.db import get_cursor
 
 DDL = """
 DROP TABLE IF EXISTS imdb_name_basics;
@@ -12,8 +13,13 @@ CREATE TABLE imdb_name_basics (
 );
 """
 
-conn = get_connection()
-with conn, conn.cursor() as cur:
-    cur.execute(DDL)
 
-print("[OK] imdb_name_basics создана")
\ No newline at end of file
+def create_table(bulk=False):
+    with get_cursor(commit=True) as cur:
+        cur.execute(unlogged(DDL) if bulk else DDL)
+
+    print("[OK] imdb_name_basics создана")
+
+
+if __name__ == "__main__":
+    create_table()
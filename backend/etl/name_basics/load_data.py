@@ -1,3 +1,9 @@
-from app.etl.common import IMDB_DATA_DIR, safe_copy
+from etl.common import dump_path, safe_copy
 
-safe_copy(IMDB_DATA_DIR / "name.basics.tsv", "imdb_name_basics")
\ No newline at end of file
+
+def load_data():
+    safe_copy(dump_path("name.basics"), "imdb_name_basics")
+
+
+if __name__ == "__main__":
+    load_data()
@@ -1,21 +1,85 @@
+import argparse
 import os
 import csv
+import shutil
+import tempfile
 import django
 import time
+from pathlib import Path
 from dotenv import load_dotenv
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 django.setup()
 
-from sixmovies.models import Actor, Profession, ActorProfession, Title
-from django.db import transaction
+from sixmovies.models import Actor, Profession, ActorProfession, Title, TitlePrincipal, TitlePrincipalCharacter
+from django.db import connection, transaction
 
-from etl.db import get_connection
+from etl import checkpoint, delta as deltas, shards as sharding
+from etl.bulk import BulkWriter
+from etl.db import get_connection, keyset_chunks
+from etl.idmap import IdMap
 
 load_dotenv()
 
 BATCH_SIZE = 5000
 ERROR_LOG = "etl_errors_name_basics.csv"
+# шард пишет в свой «<ERROR_LOG>.shard<N>», после прогона файлы сливаются в ERROR_LOG
+_error_log = ERROR_LOG
+DATASET = "name_basics"
+CHECKPOINT = "normalize_name_basics"
+
+RAW_TABLE = "imdb_name_basics"
+KEY = ["nconst"]
+
+# карта tconst → id шард-воркера (см. _init_worker)
+_title_ids = None
+
+DELTA_PURGE_SQL = r"""
+    -- изменённых актёров обновляем на месте: на них ссылаются principals
+    UPDATE {actor} a
+    SET name = r.primary_name,
+        birth_year = CASE WHEN r.birth_year ~ '^\d+$' THEN r.birth_year::int END,
+        death_year = CASE WHEN r.death_year ~ '^\d+$' THEN r.death_year::int END
+    FROM imdb_name_basics r
+    WHERE r.nconst = a.nconst
+      AND r.primary_name IS NOT NULL
+      AND {changed};
+
+    -- профессии и known_for изменённых и пропавших актёров соберутся заново
+    DELETE FROM {actor_profession}
+    WHERE {actor_profession_fk} IN (SELECT id FROM {actor} WHERE {changed_or_deleted});
+    DELETE FROM {known_for}
+    WHERE {known_for_fk} IN (SELECT id FROM {actor} WHERE {changed_or_deleted});
+
+    -- пропавших из дампа актёров удаляем вместе с их ролями
+    DELETE FROM {character}
+    WHERE principal_id IN (
+        SELECT p.id FROM {principal} p JOIN {actor} a ON a.id = p.actor_id WHERE {deleted}
+    );
+    DELETE FROM {principal}
+    WHERE actor_id IN (SELECT id FROM {actor} WHERE {deleted});
+    DELETE FROM {actor} WHERE {deleted};
+"""
+
+# актёры, чьи known_for ссылаются на тайтлы, которых ещё нет в дампе
+PENDING_SQL = """
+    SELECT DISTINCT r.nconst
+    FROM imdb_name_basics r
+    CROSS JOIN LATERAL unnest(string_to_array(r.known_for_titles, ',')) AS k(tconst)
+    WHERE {changed}
+      AND NOT EXISTS (SELECT 1 FROM imdb_title_basics b WHERE b.tconst = trim(k.tconst))
+"""
+
+# все профессии дампа одним запросом — до запуска шардов;
+# btrim по тем же пробельным символам, что и str.strip() в воркерах
+PROFESSIONS_SQL = r"""
+    INSERT INTO {profession} (name)
+    SELECT DISTINCT btrim(p.name, E' \t\n\r\f\x0B')
+    FROM (SELECT primary_profession FROM imdb_name_basics WHERE {where}) b
+    CROSS JOIN LATERAL unnest(string_to_array(b.primary_profession, ',')) AS p(name)
+    WHERE btrim(p.name, E' \t\n\r\f\x0B') <> ''
+    ON CONFLICT DO NOTHING
+"""
 
 
 # -----------------------
@@ -23,141 +87,256 @@ ERROR_LOG = "etl_errors_name_basics.csv"
 # -----------------------
 def log_error(nconst, reason, row):
     """Пишет ошибки в CSV для анализа."""
-    with open(ERROR_LOG, "a", newline="", encoding="utf-8") as f:
+    with open(_error_log, "a", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow([nconst, reason, *row])
 
 
+# -----------------------
+# 🔥 ДЕЛЬТА
+# -----------------------
+def prepare_delta():
+    """Считает дельту name_basics и готовит к ней нормализованные таблицы."""
+    deltas.compute(DATASET)
+
+    known_for = Actor.known_for.through
+    sql = DELTA_PURGE_SQL.format(
+        actor=Actor._meta.db_table,
+        actor_profession=ActorProfession._meta.db_table,
+        actor_profession_fk=ActorProfession._meta.get_field("actor").column,
+        known_for=known_for._meta.db_table,
+        known_for_fk=known_for._meta.get_field("actor").column,
+        principal=TitlePrincipal._meta.db_table,
+        character=TitlePrincipalCharacter._meta.db_table,
+        changed=deltas.keys_filter(DATASET, "r.nconst", "U"),
+        changed_or_deleted=deltas.keys_filter(DATASET, "nconst", "UD"),
+        deleted=deltas.keys_filter(DATASET, "nconst", "D"),
+    )
+
+    with transaction.atomic(), connection.cursor() as cur:
+        cur.execute(sql)
+
+
 # -----------------------
 # 🔥 ОСНОВНАЯ ЛОГИКА
 # -----------------------
-def normalize_name_basics():
-    print("→ Подключаюсь к raw-таблице imdb_name_basics...")
-    conn = get_connection()
-    cur = conn.cursor()
+def normalize_name_basics(delta=False, resume=False, shards=1):
+    if shards > 1:
+        return normalize_name_basics_sharded(shards, delta=delta, resume=resume)
+
+    after, total = checkpoint.start(CHECKPOINT, resume)
+    # при продолжении дельта уже посчитана и таблицы к ней подготовлены
+    if delta and after is None:
+        prepare_delta()
+
+    _init_error_log()
+    start = time.time()
+
+    print("→ Строю карту tconst → id...")
+    title_ids = IdMap.shared(Title, "tconst")
+
+    print("→ Читаю raw-таблицу imdb_name_basics keyset-чанками...")
+    total = normalize_chunks(CHECKPOINT, _where(delta), after, total, title_ids)
+
+    if delta:
+        deltas.commit(DATASET, PENDING_SQL.format(changed=_where(delta)))
+    checkpoint.clear(CHECKPOINT)
+
+    print(f"✓ Загружено {total:,} актёров за {time.time() - start:.1f} сек")
+    print(f"⚠ Ошибочные строки записаны в {ERROR_LOG}")
+
+
+def normalize_name_basics_sharded(shards, delta=False, resume=False):
+    """
+    Та же нормализация на shards процессах, каждый — свой диапазон nconst.
+    Профессии досеваются заранее, чтобы воркеры не вставляли одни и те же имена наперегонки.
+    """
+    ranges = sharding.saved_plan(CHECKPOINT, resume)
+    if delta and ranges is None:
+        prepare_delta()
+    if ranges is None:
+        ranges = sharding.plan(CHECKPOINT, RAW_TABLE, KEY, shards, _where(delta))
+
+    _init_error_log()
+    start = time.time()
+
+    with transaction.atomic(), connection.cursor() as cur:
+        cur.execute(PROFESSIONS_SQL.format(profession=Profession._meta.db_table, where=_where(delta)))
+        print(f"→ профессии: добавлено {cur.rowcount:,}")
+
+    print("→ Строю карту tconst → id для воркеров...")
+    maps_dir = Path(tempfile.mkdtemp(prefix="etl_name_basics_"))
+    try:
+        IdMap.shared(Title, "tconst").save(maps_dir / "titles")
+
+        total = sharding.run(
+            CHECKPOINT, _normalize_shard, ranges, KEY[0], _where(delta), resume,
+            initializer=_init_worker, initargs=(maps_dir,),
+        )
+    finally:
+        shutil.rmtree(maps_dir, ignore_errors=True)
+        _merge_error_logs()
 
+    if delta:
+        deltas.commit(DATASET, PENDING_SQL.format(changed=_where(delta)))
+    sharding.clear(CHECKPOINT)
+
+    print(f"✓ Загружено {total:,} актёров на {len(ranges)} шардах за {time.time() - start:.1f} сек")
+    print(f"⚠ Ошибочные строки записаны в {ERROR_LOG}")
+
+
+def _init_worker(maps_dir):
+    # карта открывается через mmap: воркеры делят одни и те же страницы
+    global _title_ids
+    _title_ids = IdMap.open(maps_dir / "titles")
+
+
+def _normalize_shard(stage, where, after, total):
+    global _error_log
+    _error_log = f"{ERROR_LOG}.{stage.rsplit('.', 1)[1]}"
+    return normalize_chunks(stage, where, after, total, _title_ids)
+
+
+def _merge_error_logs():
+    # дописываем ошибки шардов в общий CSV в порядке номеров шардов
+    parts = sorted(Path(ERROR_LOG).parent.glob(f"{Path(ERROR_LOG).name}.shard*"),
+                   key=lambda part: int(part.suffix[len(".shard"):]))
+    with open(ERROR_LOG, "a", newline="", encoding="utf-8") as out:
+        for part in parts:
+            with open(part, newline="", encoding="utf-8") as f:
+                shutil.copyfileobj(f, out)
+            part.unlink()
+
+
+def _where(delta):
+    return deltas.keys_filter(DATASET, "nconst") if delta else "TRUE"
+
+
+def _init_error_log():
     # создаём CSV, если его нет
     if not os.path.exists(ERROR_LOG):
         with open(ERROR_LOG, "w", newline="", encoding="utf-8") as f:
             writer = csv.writer(f)
             writer.writerow(["nconst", "error_reason", "raw_row"])
 
-    cur.execute("""
-        SELECT
-            nconst,
-            primary_name,
-            birth_year,
-            death_year,
-            primary_profession,
-            known_for_titles
-        FROM imdb_name_basics
-    """)
-
-    print("→ Читаю строки стримингом...")
-
-    batch = []
-    profession_cache = {p.name: p for p in Profession.objects.all()}
-    total = 0
-    start = time.time()
 
-    for row in cur:
-        (
-            nconst,
-            primary_name,
-            birth_year,
-            death_year,
-            professions_str,
-            known_for_titles_str
-        ) = row
-
-        # 1) Заголовок
-        if nconst == "nconst":
-            continue
-
-        # 2) Нет имени → логируем
-        if not primary_name or primary_name == "\\N":
-            log_error(nconst, "EMPTY_NAME", row)
-            continue
-
-        # 3) ошибки парсинга birth_year
-        try:
-            by = int(birth_year) if birth_year and birth_year.isdigit() else None
-        except Exception:
-            log_error(nconst, "INVALID_BIRTH_YEAR", row)
-            by = None
-
-        # 4) ошибки парсинга death_year
-        try:
-            dy = int(death_year) if death_year and death_year.isdigit() else None
-        except Exception:
-            log_error(nconst, "INVALID_DEATH_YEAR", row)
-            dy = None
-
-        # 5) Профессии, безопасно
-        professions = []
-        if professions_str:
-            for p in professions_str.split(","):
-                p = p.strip()
-                if p:
-                    professions.append(p)
-                else:
-                    log_error(nconst, "EMPTY_PROFESSION", row)
-
-        # 6) known_for_titles, безопасно
-        known_for_titles = []
-        if known_for_titles_str:
-            for t in known_for_titles_str.split(","):
-                t = t.strip()
-                if t:
-                    known_for_titles.append(t)
-                else:
-                    log_error(nconst, "EMPTY_KNOWN_FOR_ENTRY", row)
-
-        batch.append({
-            "nconst": nconst,
-            "name": primary_name,
-            "birth_year": by,
-            "death_year": dy,
-            "professions": professions,
-            "known_for": known_for_titles,
-        })
-
-        if len(batch) >= BATCH_SIZE:
-            process_batch(batch, profession_cache)
-            total += len(batch)
-            print(f"→ обработано {total:,} записей…")
-            batch = []
-
-    # остаток
-    if batch:
-        process_batch(batch, profession_cache)
-        total += len(batch)
-
-    print(f"✓ Загружено {total:,} актёров за {time.time() - start:.1f} сек")
-    print(f"⚠ Ошибочные строки записаны в {ERROR_LOG}")
+def normalize_chunks(stage, where, after, total, title_ids):
+    """
+    Нормализует строки raw-таблицы (where) keyset-чанками после ключа after.
+    Каждый чанк коммитится вместе с контрольной точкой stage; возвращает total + число строк.
+    """
+    # данные чанка и его контрольная точка коммитятся одной транзакцией
+    write_conn = get_connection()
+    chunks = keyset_chunks(
+        RAW_TABLE,
+        ["nconst", "primary_name", "birth_year", "death_year", "primary_profession", "known_for_titles"],
+        key=KEY,
+        where=where,
+        after=after,
+        conn=write_conn,
+    )
+
+    profession_cache = {p.name: p.id for p in Profession.objects.all()}
+
+    writers = {
+        "actors": BulkWriter.for_model(
+            write_conn, Actor, ["nconst", "name", "birth_year", "death_year"], commit=False
+        ),
+        "profession_names": BulkWriter.for_model(write_conn, Profession, ["name"], commit=False),
+        "professions": BulkWriter.for_model(write_conn, ActorProfession, ["actor", "profession"], commit=False),
+        "known_for": BulkWriter.for_model(write_conn, Actor.known_for.through, ["actor", "title"], commit=False),
+    }
+
+    for rows, last_key in chunks:
+        batch = []
+        for row in rows:
+            (
+                nconst,
+                primary_name,
+                birth_year,
+                death_year,
+                professions_str,
+                known_for_titles_str
+            ) = row
+
+            # 1) Заголовок
+            if nconst == "nconst":
+                continue
+
+            # 2) Нет имени → логируем
+            if not primary_name or primary_name == "\\N":
+                log_error(nconst, "EMPTY_NAME", row)
+                continue
+
+            # 3) ошибки парсинга birth_year
+            try:
+                by = int(birth_year) if birth_year and birth_year.isdigit() else None
+            except Exception:
+                log_error(nconst, "INVALID_BIRTH_YEAR", row)
+                by = None
+
+            # 4) ошибки парсинга death_year
+            try:
+                dy = int(death_year) if death_year and death_year.isdigit() else None
+            except Exception:
+                log_error(nconst, "INVALID_DEATH_YEAR", row)
+                dy = None
+
+            # 5) Профессии, безопасно
+            professions = []
+            if professions_str:
+                for p in professions_str.split(","):
+                    p = p.strip()
+                    if p:
+                        professions.append(p)
+                    else:
+                        log_error(nconst, "EMPTY_PROFESSION", row)
+
+            # 6) known_for_titles, безопасно
+            known_for_titles = []
+            if known_for_titles_str:
+                for t in known_for_titles_str.split(","):
+                    t = t.strip()
+                    if t:
+                        known_for_titles.append(t)
+                    else:
+                        log_error(nconst, "EMPTY_KNOWN_FOR_ENTRY", row)
+
+            batch.append({
+                "nconst": nconst,
+                "name": primary_name,
+                "birth_year": by,
+                "death_year": dy,
+                "professions": professions,
+                "known_for": known_for_titles,
+            })
+
+            if len(batch) >= BATCH_SIZE:
+                process_batch(batch, profession_cache, writers, title_ids)
+                batch = []
+
+        if batch:
+            process_batch(batch, profession_cache, writers, title_ids)
+
+        total += len(rows)
+        checkpoint.commit(write_conn, stage, last_key, total)
+        print(f"→ {stage}: обработано {total:,} записей… (ключ {last_key})")
+
+    write_conn.close()
+    return total
 
 
 # -----------------------
 # 🔥 ОБРАБОТКА ПАКЕТОВ
 # -----------------------
-def process_batch(batch, profession_cache):
+def process_batch(batch, profession_cache, writers, title_ids):
 
     # 1) Создание Actor
-    actors_to_create = [
-        Actor(
-            nconst=item["nconst"],
-            name=item["name"],
-            birth_year=item["birth_year"],
-            death_year=item["death_year"],
-        )
-        for item in batch
-    ]
-
-    Actor.objects.bulk_create(actors_to_create, ignore_conflicts=True)
+    for item in batch:
+        writers["actors"].add(item["nconst"], item["name"], item["birth_year"], item["death_year"])
 
-    # 2) lookup актёров
-    nconsts = [i["nconst"] for i in batch]
-    db_actors = {a.nconst: a for a in Actor.objects.filter(nconst__in=nconsts)}
+    # 2) id актёров (новых и уже существовавших) приходят тем же запросом
+    db_actors = writers["actors"].flush_returning(["nconst"])
 
     # 3) профессии
     new_prof_names = set()
@@ -167,43 +346,50 @@ def process_batch(batch, profession_cache):
             if p and p not in profession_cache:
                 new_prof_names.add(p)
 
-    if new_prof_names:
-        Profession.objects.bulk_create([Profession(name=p) for p in new_prof_names])
-        for p in Profession.objects.filter(name__in=new_prof_names):
-            profession_cache[p.name] = p
+    for p in new_prof_names:
+        writers["profession_names"].add(p)
+    profession_cache.update(writers["profession_names"].flush_returning(["name"]))
 
     # 4) Actor ↔ Profession
-    prof_links = []
     for item in batch:
-        actor = db_actors[item["nconst"]]
+        actor_id = db_actors[item["nconst"]]
         for p in item["professions"]:
-            prof_links.append(
-                ActorProfession(
-                    actor_id=actor.id,
-                    profession_id=profession_cache[p].id
-                )
-            )
+            writers["professions"].add(actor_id, profession_cache[p])
 
-    ActorProfession.objects.bulk_create(prof_links, ignore_conflicts=True)
+    writers["professions"].flush()
 
     # 5) Actor ↔ Title (known_for)
-    through = Actor.known_for.through
-    known_links = []
-
     all_tconsts = {t for item in batch for t in item["known_for"] if t}
-    db_titles = {t.tconst: t for t in Title.objects.filter(tconst__in=all_tconsts)}
+    db_titles = title_ids.resolve(all_tconsts)
 
     for item in batch:
-        actor = db_actors[item["nconst"]]
+        actor_id = db_actors[item["nconst"]]
         for t in item["known_for"]:
-            title = db_titles.get(t)
-            if title:
-                known_links.append(
-                    through(actor_id=actor.id, title_id=title.id)
-                )
+            title_id = db_titles.get(t)
+            if title_id:
+                writers["known_for"].add(actor_id, title_id)
 
-    through.objects.bulk_create(known_links, ignore_conflicts=True)
+    writers["known_for"].flush()
 
 
 if __name__ == "__main__":
-    normalize_name_basics()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Нормализация imdb_name_basics → Actor, Profession")
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="обработать только актёров, изменившихся с прошлого запуска",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="продолжить с последней контрольной точки после падения",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="на сколько диапазонов nconst разбить таблицу и сколько процессов запустить",
+    )
+    args = parser.parse_args()
+
+    normalize_name_basics(delta=args.delta, resume=args.resume, shards=args.shards)
\ No newline at end of file
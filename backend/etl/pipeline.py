@@ -0,0 +1,180 @@
+"""
+DAG стадий ETL IMDb для manage.py imdb_etl.
+
+Стадия — функция модуля ETL («module:function»), которая импортируется
+только перед запуском: скрипты остаются запускаемыми по отдельности, а
+оркестратор выполняет их в одном процессе, деля пул соединений etl.db и
+общие карты IdMap. Независимые ветки (сырые загрузки разных дампов,
+стадии поверх графа) идут параллельно в потоках, так что общее время
+стремится к длине критического пути.
+"""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from importlib import import_module
+
+from django.apps import apps
+from django.db import connections
+
+from etl.db import extra_connections
+from etl.idmap import IdMap
+
+# сырые дампы: у каждого стадии create (таблица) и load (COPY)
+RAW_DATASETS = ("title_basics", "title_ratings", "name_basics", "title_principals",
+                "title_akas", "title_crew", "title_episode")
+
+
+# флаги прогона, которые понимают нормализаторы: --delta, --resume и --shards
+NORMALIZE_OPTIONS = ("delta", "resume", "shards")
+
+
+class Stage:
+    def __init__(self, name: str, target: str, deps=(), writes=(), options=()):
+        self.name = name
+        self.target = target      # "module:function"
+        self.deps = tuple(deps)
+        self.writes = tuple(writes)  # метки моделей, чьи IdMap устаревают после стадии
+        self.options = tuple(options)  # какие флаги прогона функция принимает как kwargs
+
+    def run(self, **options):
+        module, func = self.target.split(":")
+        fn = getattr(import_module(module), func)
+        return fn(**{name: options[name] for name in self.options if name in options})
+
+
+def _raw(dataset):
+    return [
+        Stage(f"{dataset}.create", f"etl.{dataset}.create_table:create_table", options=["bulk"]),
+        Stage(f"{dataset}.load", f"etl.{dataset}.load_data:load_data", deps=[f"{dataset}.create"]),
+    ]
+
+
+STAGES = [stage for dataset in RAW_DATASETS for stage in _raw(dataset)] + [
+    Stage("title_basics.normalize", "etl.title_basics.normalize:normalize_titles",
+          deps=["title_basics.load"], writes=["sixmovies.Title"], options=NORMALIZE_OPTIONS),
+    Stage("title_ratings.normalize", "etl.title_ratings.normalize:normalize_ratings",
+          deps=["title_ratings.load", "title_basics.normalize"], options=["resume"]),
+    Stage("name_basics.normalize", "etl.name_basics.normalize:normalize_name_basics",
+          deps=["name_basics.load", "title_basics.normalize"], writes=["sixmovies.Actor"], options=NORMALIZE_OPTIONS),
+    Stage("title_principals.normalize", "etl.title_principals.normalize:normalize_principals",
+          deps=["title_principals.load", "title_basics.normalize", "name_basics.normalize"], options=NORMALIZE_OPTIONS),
+    Stage("popularity", "etl.actor_popularity.build:build_popularity",
+          deps=["title_ratings.normalize", "name_basics.normalize", "title_principals.normalize"]),
+    Stage("graph", "etl.costar_graph.build:build_graph", deps=["popularity"]),
+    Stage("graph.names", "etl.actor_search.build:build_search", deps=["graph"]),
+    Stage("graph.oracle", "etl.distance_oracle.build:build_oracle", deps=["graph"]),
+    Stage("graph.snapshot", "etl.snapshot.build:build_snapshot", deps=["graph"]),
+    Stage("puzzles", "etl.puzzle_pool.build:build_pool", deps=["graph.oracle"]),
+    Stage("graph.publish", "etl.costar_graph.publish:publish_graph",
+          deps=["graph.names", "graph.oracle", "graph.snapshot", "puzzles"]),
+]
+
+
+def bulk(stages) -> list:
+    """
+    Стадии для полной перезагрузки с --bulk: перед нормализаторами bulk.prepare
+    снимает вторичные индексы и внешние ключи целевых таблиц, после них
+    bulk.finish строит всё заново, и только потом идут стадии, читающие
+    нормализованные таблицы.
+    """
+    normalize = [s.name for s in stages if s.name.endswith(".normalize")]
+    result = [Stage("bulk.prepare", "etl.bulk_load.constraints:prepare_bulk_load")]
+    for s in stages:
+        deps = list(s.deps)
+        if s.name in normalize:
+            deps.append("bulk.prepare")
+        elif any(d in normalize for d in deps):
+            deps = [d for d in deps if d not in normalize] + ["bulk.finish"]
+        result.append(Stage(s.name, s.target, deps, s.writes, s.options))
+    result.append(Stage("bulk.finish", "etl.bulk_load.constraints:finish_bulk_load", deps=normalize))
+    return result
+
+
+def select(stages, only=None, skip=None) -> list:
+    """
+    Подмножество стадий; зависимости на невыбранные стадии считаются
+    выполненными (например, --only graph поверх уже нормализованной базы).
+    """
+    names = {s.name for s in stages}
+    for name in list(only or []) + list(skip or []):
+        if name not in names:
+            raise KeyError(name)
+
+    chosen = [s for s in stages if (not only or s.name in only) and s.name not in (skip or ())]
+    kept = {s.name for s in chosen}
+    return [Stage(s.name, s.target, [d for d in s.deps if d in kept], s.writes, s.options) for s in chosen]
+
+
+def _run_stage(stage: Stage, options: dict):
+    start = time.time()
+    print(f"▶ {stage.name} [{threading.current_thread().name}]")
+    try:
+        stage.run(**options)
+    finally:
+        # соединения Django у каждого потока свои — закрываем их после стадии:
+        # close_old_connections оставил бы их жить до CONN_MAX_AGE
+        connections.close_all()
+    for label in stage.writes:
+        IdMap.forget(apps.get_model(label))
+    return start, time.time()
+
+
+def run(stages, workers: int = 4, **options):
+    """
+    Выполняет стадии по готовности зависимостей; options (delta, resume, shards, bulk)
+    передаются стадиям, которые их принимают.
+    Возвращает ({стадия: (начало, конец)}, [(стадия, исключение)]);
+    после первой ошибки новые стадии не запускаются.
+    """
+    pending = {s.name: len(s.deps) for s in stages}
+    children = {s.name: [] for s in stages}
+    for s in stages:
+        for dep in s.deps:
+            children[dep].append(s)
+
+    timings, failed = {}, []
+    # стадии делят пул соединений процесса: каждой — своё место сверх POOL_MAX
+    with extra_connections(workers), ThreadPoolExecutor(max_workers=workers, thread_name_prefix="etl") as pool:
+        running = {}
+
+        def submit(stage):
+            running[pool.submit(_run_stage, stage, options)] = stage
+
+        for s in stages:
+            if not s.deps:
+                submit(s)
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    timings[stage.name] = future.result()
+                except Exception as e:
+                    failed.append((stage.name, e))
+                    continue
+                for child in children[stage.name]:
+                    pending[child.name] -= 1
+                    if pending[child.name] == 0 and not failed:
+                        submit(child)
+
+    if not failed and len(timings) < len(stages):
+        stuck = sorted(set(pending) - set(timings))
+        raise RuntimeError(f"цикл в зависимостях стадий: {', '.join(stuck)}")
+    return timings, failed
+
+
+def critical_path(stages, timings) -> tuple:
+    """(длительность, цепочка стадий) самого длинного пути по фактическим временам."""
+    by_name = {s.name: s for s in stages}
+    best = {}
+
+    def finish(name):
+        if name not in best:
+            start, end = timings[name]
+            prev = max(((finish(d), d) for d in by_name[name].deps if d in timings), default=((0.0, []), None))
+            (length, path), _ = prev
+            best[name] = (length + end - start, path + [name])
+        return best[name]
+
+    return max((finish(name) for name in timings), default=(0.0, []))
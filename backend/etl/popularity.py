@@ -0,0 +1,86 @@
+"""
+Материализованный рейтинг популярности актёров.
+
+Счёт актёра — сумма imdb_votes различных тайтлов, где он снимался
+(TitlePrincipal с ролью actor/actress) или которыми известен (known_for).
+Таблица пересобирается целиком раз за прогон ETL в staging-копию и
+подменяется одной транзакцией; версия (md5 рейтинга) служит ETag для API
+и не меняется, если рейтинг остался прежним.
+"""
+import time
+
+from etl.db import get_cursor
+
+TABLE = "actor_popularity"
+VERSION_TABLE = "actor_popularity_version"
+STAGING_TABLE = f"{TABLE}_new"
+
+# какие роли в TitlePrincipal считаются «снимался»
+CATEGORIES = ("actor", "actress")
+
+BUILD_SQL = """
+    DROP TABLE IF EXISTS {staging};
+
+    CREATE TABLE {staging} AS
+    WITH credits AS (
+        SELECT actor_id, title_id FROM {principal} WHERE category IN ({categories})
+        UNION
+        SELECT {known_for_actor}, {known_for_title} FROM {known_for}
+    ), scores AS (
+        SELECT c.actor_id, sum(coalesce(t.imdb_votes, 0))::bigint AS score
+        FROM credits c
+        JOIN {title} t ON t.id = c.title_id
+        GROUP BY c.actor_id
+    )
+    SELECT actor_id, score, row_number() OVER (ORDER BY score DESC, actor_id)::int AS rank
+    FROM scores;
+
+    ALTER TABLE {staging} ADD CONSTRAINT {staging}_pkey PRIMARY KEY (actor_id);
+    CREATE UNIQUE INDEX {staging}_rank ON {staging} (rank);
+"""
+
+SWAP_SQL = """
+    CREATE TABLE IF NOT EXISTS {version_table} (
+        version      text        NOT NULL,
+        refreshed_at timestamptz NOT NULL DEFAULT now()
+    );
+
+    DROP TABLE IF EXISTS {table};
+    ALTER TABLE {staging} RENAME TO {table};
+    ALTER INDEX {staging}_pkey RENAME TO {table}_pkey;
+    ALTER INDEX {staging}_rank RENAME TO {table}_rank;
+
+    DELETE FROM {version_table};
+    INSERT INTO {version_table} (version)
+    SELECT md5(coalesce(string_agg(actor_id || ':' || score, ',' ORDER BY rank), ''))
+    FROM {table};
+"""
+
+
+def refresh(title_table: str, principal_table: str, known_for_table: str,
+            known_for_actor: str, known_for_title: str) -> int:
+    """Пересчитывает рейтинг и возвращает число актёров в нём."""
+    names = {
+        "table": TABLE,
+        "version_table": VERSION_TABLE,
+        "staging": STAGING_TABLE,
+        "title": title_table,
+        "principal": principal_table,
+        "known_for": known_for_table,
+        "known_for_actor": known_for_actor,
+        "known_for_title": known_for_title,
+        "categories": ", ".join(f"'{c}'" for c in CATEGORIES),
+    }
+
+    print("→ Считаю популярность актёров...")
+    start = time.time()
+
+    with get_cursor(commit=True) as cur:
+        cur.execute(BUILD_SQL.format(**names))
+        cur.execute(f"ANALYZE {STAGING_TABLE}")
+        cur.execute(SWAP_SQL.format(**names))
+        cur.execute(f"SELECT count(*) FROM {TABLE}")
+        total = cur.fetchone()[0]
+
+    print(f"✓ популярность: {total:,} актёров за {time.time() - start:.1f} сек")
+    return total
@@ -0,0 +1,113 @@
+import io
+import os
+import django
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+django.setup()
+
+from django.conf import settings
+from etl.db import get_cursor
+from graph import versions
+from graph.csr import CoStarGraph
+from graph.oracle import NOT_IN_ORACLE, UNKNOWN, DistanceOracle
+from graph.puzzles import DDL, MAX_DISTANCE, MIN_DISTANCE, POOL_TABLE
+from graph.search import BITSET_SOURCES, bitset_distances
+
+# сколько самых популярных актёров участвуют в головоломках
+TOP_ACTORS = int(os.getenv("PUZZLE_TOP_ACTORS", "5000"))
+
+# сколько целей на каждое расстояние берём от одного стартового актёра
+PER_SOURCE = int(os.getenv("PUZZLE_PER_SOURCE", "20"))
+
+WORKERS = int(os.getenv("PUZZLE_WORKERS", os.cpu_count() or 1))
+
+STAGING_TABLE = f"{POOL_TABLE}_new"
+
+SWAP_SQL = f"""
+    DROP TABLE IF EXISTS {POOL_TABLE};
+    ALTER TABLE {STAGING_TABLE} RENAME TO {POOL_TABLE};
+    ALTER INDEX {STAGING_TABLE}_pkey RENAME TO {POOL_TABLE}_pkey;
+"""
+
+_graph = None
+_oracle = None
+
+
+def _init_worker(path, use_oracle):
+    # граф и оракул открываются через mmap: все воркеры делят одни и те же страницы
+    global _graph, _oracle
+    _graph = CoStarGraph.load(path)
+    _oracle = DistanceOracle.load(path / "oracle") if use_oracle else None
+
+
+def _puzzles_for(sources, targets, seed):
+    """Один bitset-BFS на ≤ 64 источника → список (distance, source, target) плотными индексами."""
+    rng = np.random.default_rng(seed)
+    if _oracle is not None:
+        # расстояния уже посчитаны оракулом — читаем строки матрицы вместо BFS
+        rows = _oracle.distances[_oracle.row_of[sources]][:, _oracle.row_of[targets]]
+        dist = np.where(rows == UNKNOWN, -1, rows).astype(np.int16)
+    else:
+        dist = bitset_distances(_graph, sources, targets, MAX_DISTANCE)
+
+    found = []
+    for i, source in enumerate(sources):
+        for d in range(MIN_DISTANCE, MAX_DISTANCE + 1):
+            hits = targets[dist[i] == d]
+            if len(hits) > PER_SOURCE:
+                hits = rng.choice(hits, PER_SOURCE, replace=False)
+            found.extend((d, int(source), int(t)) for t in hits)
+    return found
+
+
+def build_pool():
+    """Считает точные расстояния между топ-актёрами и пересобирает таблицу пула."""
+    start = time.time()
+    root = versions.building(settings.GRAPH_DIR)
+    graph = CoStarGraph.load(root)
+    top = graph.top_actors(TOP_ACTORS)
+    chunks = [top[i:i + BITSET_SOURCES] for i in range(0, len(top), BITSET_SOURCES)]
+
+    # оракул той же версии покрывает топ-актёров, если его N не меньше нашего
+    use_oracle = (root / "oracle").exists()
+    if use_oracle:
+        oracle = DistanceOracle.load(root / "oracle")
+        use_oracle = bool(np.all(oracle.row_of[top] != NOT_IN_ORACLE))
+    source = "строк оракула" if use_oracle else "проходов bitset-BFS"
+
+    print(f"→ {len(top):,} актёров, {len(chunks):,} {source} на {WORKERS} процессах...")
+
+    by_distance = {d: [] for d in range(MIN_DISTANCE, MAX_DISTANCE + 1)}
+    # spawn, а не fork: сборка может идти из многопоточного оркестратора (imdb_etl)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(WORKERS, mp_context=context, initializer=_init_worker, initargs=(root, use_oracle)) as pool:
+        for n, found in enumerate(pool.map(_puzzles_for, chunks, [top] * len(chunks), range(len(chunks))), 1):
+            for d, source, target in found:
+                by_distance[d].append((source, target))
+            if n % 10 == 0 or n == len(chunks):
+                print(f"→ проходов {n:,}/{len(chunks):,}")
+
+    buf = io.StringIO()
+    for d, pairs in by_distance.items():
+        for seq, (source, target) in enumerate(pairs):
+            buf.write(f"{d}\t{seq}\t{graph.actor_ids[source]}\t{graph.actor_ids[target]}\n")
+    buf.seek(0)
+
+    with get_cursor(commit=True) as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+        cur.execute(DDL.format(table=STAGING_TABLE))
+        cur.copy_expert(f"COPY {STAGING_TABLE} (distance, seq, start_id, target_id) FROM STDIN", buf)
+        cur.execute(SWAP_SQL)
+
+    for d, pairs in by_distance.items():
+        print(f"✓ {d} рукопожатий: {len(pairs):,} головоломок")
+    print(f"✓ пул головоломок пересобран за {time.time() - start:.1f} сек")
+
+
+if __name__ == "__main__":
+    build_pool()
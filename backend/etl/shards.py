@@ -0,0 +1,154 @@
+"""
+Шардированная нормализация на пуле процессов.
+
+raw-таблица делится по диапазонам первой колонки ключа (tconst, nconst) на
+шарды примерно равного размера — квантили по выборке TABLESAMPLE. Каждый шард
+нормализует отдельный процесс со своим пулом соединений etl.db, своими
+BulkWriter и своей контрольной точкой «<стадия>.shard<N>». Диапазоны не
+пересекаются, так что шарды не спорят за одни и те же строки целевых таблиц;
+общие справочники (Genre, Profession) нормализатор досевает одним set-based
+INSERT до запуска шардов, а карты IdMap сохраняет в .npy — воркеры открывают
+их через mmap.
+
+Границы шардов хранятся в etl_checkpoint под «<стадия>.shards», поэтому
+--resume продолжает каждый шард в тех же границах.
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from etl import checkpoint
+from etl.db import get_cursor, keyset_index
+
+# сколько строк выборки берём на шард для квантилей границ
+SAMPLE_ROWS_PER_SHARD = int(os.getenv("ETL_SHARD_SAMPLE_ROWS", "20000"))
+
+# границы — квантили ключа по выборке блоков, а не сортировка всей таблицы
+BOUNDS_SQL = """
+    SELECT percentile_disc(%(fractions)s::float8[]) WITHIN GROUP (ORDER BY {column})
+    FROM {table} {sample}
+    WHERE ({where}) AND {column} IS NOT NULL
+"""
+
+
+def _literal(value) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def range_filter(column: str, lo, hi) -> str:
+    """SQL-условие lo <= column < hi; None — без границы с этой стороны."""
+    parts = []
+    if lo is not None:
+        parts.append(f"{column} >= {_literal(lo)}")
+    if hi is not None:
+        parts.append(f"{column} < {_literal(hi)}")
+    return " AND ".join(parts) or "TRUE"
+
+
+def _ranges(bounds) -> list:
+    bounds = list(bounds)
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def saved_plan(stage: str, resume: bool = False):
+    """
+    Диапазоны шардов прерванного прогона или None.
+    Без resume старый план и точки шардов стираются — прогон начнётся сначала.
+    """
+    with get_cursor(commit=True) as cur:
+        cur.execute(checkpoint.DDL)
+        if not resume:
+            cur.execute(
+                f"DELETE FROM {checkpoint.TABLE} WHERE stage = %s OR stage LIKE %s",
+                (f"{stage}.shards", f"{stage}.shard%"),
+            )
+            return None
+        cur.execute(f"SELECT last_key FROM {checkpoint.TABLE} WHERE stage = %s", (f"{stage}.shards",))
+        row = cur.fetchone()
+
+    if row is None:
+        return None
+    print(f"→ {stage}: продолжаю прерванный прогон на {len(row[0]) + 1} шардах")
+    return _ranges(row[0])
+
+
+def plan(stage: str, table: str, key, shards: int, where: str = "TRUE") -> list:
+    """
+    Делит строки table (where) на shards диапазонов первой колонки key
+    и запоминает границы. key — тот же ключ, что у keyset_chunks: его индекс
+    нужен шардам, поэтому создаём его до запуска процессов.
+    """
+    keyset_index(table, key)
+    column = key[0]
+    fractions = [i / shards for i in range(1, shards)]
+
+    start = time.time()
+    with get_cursor(commit=True) as cur:
+        cur.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", (table,))
+        rows = cur.fetchone()[0]
+        if rows <= 0:
+            # только что загруженная таблица ещё без статистики
+            cur.execute(f"ANALYZE {table}")
+            cur.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", (table,))
+            rows = cur.fetchone()[0]
+        percent = 100.0 * SAMPLE_ROWS_PER_SHARD * shards / rows if rows > 0 else 100.0
+
+        bounds = [None]
+        if percent < 100:
+            cur.execute(
+                BOUNDS_SQL.format(column=column, table=table, where=where, sample=f"TABLESAMPLE SYSTEM ({percent})"),
+                {"fractions": fractions},
+            )
+            bounds = cur.fetchone()[0] or [None]
+        if None in bounds:
+            # выборка не задела отфильтрованных строк (маленькая дельта) — считаем по всем
+            cur.execute(BOUNDS_SQL.format(column=column, table=table, where=where, sample=""), {"fractions": fractions})
+            bounds = cur.fetchone()[0] or []
+
+        # у principals строки одного tconst идут подряд — соседние квантили могут совпасть
+        bounds = sorted(set(b for b in bounds if b is not None))
+        checkpoint.save(cur, f"{stage}.shards", bounds, len(bounds) + 1)
+
+    print(f"→ {table}: {len(bounds) + 1} шардов по {column} за {time.time() - start:.1f} сек")
+    return _ranges(bounds)
+
+
+def _run_shard(target, stage: str, where: str, resume: bool):
+    after, rows = checkpoint.start(stage, resume)
+    return target(stage, where, after, rows)
+
+
+def run(stage: str, target, ranges, column: str, where: str = "TRUE", resume: bool = False,
+        initializer=None, initargs=()) -> int:
+    """
+    target(стадия шарда, where, after, rows) → rows на каждом диапазоне в своём процессе.
+    target и initializer — функции уровня модуля нормализатора: spawn-воркер
+    импортирует модуль заново, и тот сам выполняет django.setup().
+    Возвращает суммарное число обработанных строк.
+    """
+    total = 0
+    # spawn, а не fork: нормализация может идти из многопоточного оркестратора (imdb_etl)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(len(ranges), mp_context=context, initializer=initializer, initargs=initargs) as pool:
+        futures = {
+            pool.submit(
+                _run_shard, target, f"{stage}.shard{i}",
+                f"({where}) AND {range_filter(column, lo, hi)}", resume,
+            ): i
+            for i, (lo, hi) in enumerate(ranges)
+        }
+        for future in as_completed(futures):
+            rows = future.result()
+            total += rows
+            print(f"✓ {stage}: шард {futures[future]} готов, {rows:,} строк")
+    return total
+
+
+def clear(stage: str):
+    """Прогон завершён: план и точки шардов больше не нужны."""
+    with get_cursor(commit=True) as cur:
+        cur.execute(
+            f"DELETE FROM {checkpoint.TABLE} WHERE stage = %s OR stage LIKE %s",
+            (f"{stage}.shards", f"{stage}.shard%"),
+        )
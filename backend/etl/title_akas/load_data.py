@@ -1,6 +1,12 @@
 from pathlib import Path
-from app.etl.common import IMDB_DATA_DIR, safe_copy
+from etl.common import COPY_WORKERS, dump_path, safe_copy
 
-FILE = IMDB_DATA_DIR / "title.akas.tsv"
+FILE = dump_path("title.akas")
 
-safe_copy(FILE, "imdb_title_akas")
\ No newline at end of file
+
+def load_data():
+    safe_copy(FILE, "imdb_title_akas", workers=COPY_WORKERS)
+
+
+if __name__ == "__main__":
+    load_data()
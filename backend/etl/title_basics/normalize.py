@@ -1,3 +1,4 @@
+import argparse
 import os
 import django
 import time
@@ -6,110 +7,343 @@ from dotenv import load_dotenv
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 django.setup()
 
-from django.db import transaction
-from sixmovies.models import Title, Genre
+from django.db import connection, transaction
+from sixmovies.models import Actor, Title, Genre, TitlePrincipal, TitlePrincipalCharacter
+from etl import checkpoint, delta as deltas, shards as sharding
+from etl.bulk import BulkWriter
+from etl.db import get_connection, keyset_chunks
 
 load_dotenv()
 
 BATCH_SIZE = 5000
 
+DATASET = "title_basics"
+CHECKPOINT = "normalize_titles"
 
-def normalize_titles():
-    from etl.db import get_connection  # импорт внутри функции — важно
+RAW_TABLE = "imdb_title_basics"
+KEY = ["tconst"]
 
-    print("→ Подключаюсь к raw-таблице imdb_title_basics...")
-    conn = get_connection()
-    cur = conn.cursor()
+RAW_FILTER = "title_type IN ('movie', 'tvSeries')"
 
-    cur.execute("""
-        SELECT tconst, title_type, primary_title, original_title,
-               is_adult, start_year, end_year, runtime_minutes, genres
-        FROM imdb_title_basics
-        WHERE title_type IN ('movie', 'tvSeries')
-    """)
+# -----------------------
+# 🔥 SQL-ДВИЖОК: всё преобразование внутри Postgres
+# -----------------------
+TITLE_ROWS_SQL = r"""
+    SELECT
+        tconst,
+        title_type,
+        primary_title,
+        original_title,
+        is_adult = '1' AS is_adult,
+        CASE WHEN start_year ~ '^\d+$' THEN start_year::int END AS start_year,
+        CASE WHEN end_year ~ '^\d+$' THEN end_year::int END AS end_year,
+        CASE WHEN runtime_minutes ~ '^\d+$' THEN runtime_minutes::int END AS runtime_minutes
+    FROM imdb_title_basics
+    WHERE {raw_filter}
+"""
 
-    print("→ Читаю строки стримингом...")
+TITLES_SQL = """
+    INSERT INTO {title} (
+        tconst, title_type, primary_title, original_title,
+        is_adult, start_year, end_year, runtime_minutes
+    )
+    {title_rows}
+    ON CONFLICT DO NOTHING
+"""
 
-    batch = []
-    genre_cache = {g.name: g for g in Genre.objects.all()}
-    total = 0
+GENRES_SQL = """
+    INSERT INTO {genre} (name)
+    SELECT DISTINCT g.name
+    FROM (SELECT genres FROM imdb_title_basics WHERE {raw_filter}) b
+    CROSS JOIN LATERAL unnest(string_to_array(b.genres, ',')) AS g(name)
+    WHERE NOT EXISTS (SELECT 1 FROM {genre} x WHERE x.name = g.name)
+    ON CONFLICT DO NOTHING
+"""
+
+TITLE_GENRES_SQL = """
+    INSERT INTO {title_genre} ({title_fk}, {genre_fk})
+    SELECT t.id, g.id
+    FROM (SELECT tconst, genres FROM imdb_title_basics WHERE {raw_filter}) b
+    JOIN {title} t ON t.tconst = b.tconst
+    CROSS JOIN LATERAL unnest(string_to_array(b.genres, ',')) AS x(name)
+    JOIN {genre} g ON g.name = x.name
+    ON CONFLICT DO NOTHING
+"""
+
+# -----------------------
+# 🔥 ДЕЛЬТА: подготовка таблиц перед догрузкой изменённых ключей
+# -----------------------
+DELTA_PURGE_SQL = """
+    -- изменённые тайтлы обновляем на месте: на них ссылаются principals и known_for
+    UPDATE {title} t
+    SET title_type = r.title_type,
+        primary_title = r.primary_title,
+        original_title = r.original_title,
+        is_adult = r.is_adult,
+        start_year = r.start_year,
+        end_year = r.end_year,
+        runtime_minutes = r.runtime_minutes
+    FROM ({title_rows}) r
+    WHERE r.tconst = t.tconst;
+
+    -- жанры изменённых и пропавших тайтлов соберутся заново
+    DELETE FROM {title_genre}
+    WHERE {title_fk} IN (SELECT id FROM {title} WHERE {changed_or_deleted});
+
+    -- пропавшие из дампа тайтлы удаляем вместе со ссылками на них
+    DELETE FROM {character}
+    WHERE principal_id IN (
+        SELECT p.id FROM {principal} p JOIN {title} t ON t.id = p.title_id WHERE {deleted}
+    );
+    DELETE FROM {principal}
+    WHERE title_id IN (SELECT id FROM {title} WHERE {deleted});
+    DELETE FROM {known_for}
+    WHERE {known_for_fk} IN (SELECT id FROM {title} WHERE {deleted});
+    DELETE FROM {title} WHERE {deleted};
+"""
+
+
+def _tables(delta=False):
+    through = Title.genres.through
+    known_for = Actor.known_for.through
+    tables = {
+        "title": Title._meta.db_table,
+        "genre": Genre._meta.db_table,
+        "title_genre": through._meta.db_table,
+        "title_fk": through._meta.get_field("title").column,
+        "genre_fk": through._meta.get_field("genre").column,
+        "principal": TitlePrincipal._meta.db_table,
+        "character": TitlePrincipalCharacter._meta.db_table,
+        "known_for": known_for._meta.db_table,
+        "known_for_fk": known_for._meta.get_field("title").column,
+        "raw_filter": RAW_FILTER,
+    }
+    if delta:
+        # в режиме дельты читаем только добавленные и изменённые tconst
+        tables["raw_filter"] = f"{RAW_FILTER} AND {deltas.keys_filter(DATASET, 'tconst')}"
+    tables["title_rows"] = TITLE_ROWS_SQL.format(**tables)
+    return tables
+
+
+def prepare_delta():
+    """Считает дельту title_basics и готовит к ней нормализованные таблицы."""
+    deltas.compute(DATASET)
+
+    tables = _tables()
+    tables["title_rows"] = TITLE_ROWS_SQL.format(
+        raw_filter=f"{RAW_FILTER} AND {deltas.keys_filter(DATASET, 'tconst', 'U')}"
+    )
+    tables["changed_or_deleted"] = deltas.keys_filter(DATASET, "tconst", "UD")
+    tables["deleted"] = deltas.keys_filter(DATASET, "tconst", "D")
+
+    with transaction.atomic(), connection.cursor() as cur:
+        cur.execute(DELTA_PURGE_SQL.format(**tables))
+
+
+def normalize_titles(delta=False, resume=False, shards=1):
+    if shards > 1:
+        return normalize_titles_sharded(shards, delta=delta, resume=resume)
+
+    after, total = checkpoint.start(CHECKPOINT, resume)
+    # при продолжении дельта уже посчитана и таблицы к ней подготовлены
+    if delta and after is None:
+        prepare_delta()
+
+    print("→ Читаю raw-таблицу imdb_title_basics keyset-чанками...")
     start_time = time.time()
+    total = normalize_chunks(CHECKPOINT, _tables(delta)["raw_filter"], after, total)
 
-    for row in cur:
-        (
-            tconst,
-            title_type,
-            primary_title,
-            original_title,
-            is_adult,
-            start_year,
-            end_year,
-            runtime_minutes,
-            genres_str,
-        ) = row
-
-        batch.append({
-            "tconst": tconst,
-            "title_type": title_type,
-            "primary_title": primary_title,
-            "original_title": original_title,
-            "is_adult": bool(is_adult),
-            "start_year": int(start_year) if start_year else None,
-            "end_year": int(end_year) if end_year else None,
-            "runtime_minutes": int(runtime_minutes) if runtime_minutes else None,
-            "genres": genres_str.split(",") if genres_str else [],
-        })
-
-        if len(batch) >= BATCH_SIZE:
-            process_batch(batch, genre_cache)
-            total += len(batch)
-            print(f"→ обработано {total:,} записей")
-            batch = []
-
-    if batch:
-        process_batch(batch, genre_cache)
-        total += len(batch)
+    if delta:
+        deltas.commit(DATASET)
+    checkpoint.clear(CHECKPOINT)
 
     print(f"✓ Загружено {total:,} тайтлов за {time.time() - start_time:.1f} сек")
 
 
-def process_batch(batch, genre_cache):
+def normalize_titles_sharded(shards, delta=False, resume=False):
+    """
+    Та же нормализация на shards процессах, каждый — свой диапазон tconst.
+    Жанры досеваются заранее, чтобы воркеры не создавали одни и те же наперегонки.
+    """
+    ranges = sharding.saved_plan(CHECKPOINT, resume)
+    if delta and ranges is None:
+        prepare_delta()
+
+    tables = _tables(delta)
+    if ranges is None:
+        ranges = sharding.plan(CHECKPOINT, RAW_TABLE, KEY, shards, tables["raw_filter"])
+
+    start_time = time.time()
+
+    with transaction.atomic(), connection.cursor() as cur:
+        cur.execute(GENRES_SQL.format(**tables))
+        print(f"→ жанры: добавлено {cur.rowcount:,}")
+
+    total = sharding.run(CHECKPOINT, normalize_chunks, ranges, KEY[0], tables["raw_filter"], resume)
+
+    if delta:
+        deltas.commit(DATASET)
+    sharding.clear(CHECKPOINT)
+
+    print(f"✓ Загружено {total:,} тайтлов на {len(ranges)} шардах за {time.time() - start_time:.1f} сек")
+
+
+def normalize_chunks(stage, where, after, total):
+    """
+    Нормализует строки raw-таблицы (where) keyset-чанками после ключа after.
+    Каждый чанк коммитится вместе с контрольной точкой stage; возвращает total + число строк.
+    """
+    # данные чанка и его контрольная точка коммитятся одной транзакцией
+    write_conn = get_connection()
+    chunks = keyset_chunks(
+        RAW_TABLE,
+        [
+            "tconst", "title_type", "primary_title", "original_title",
+            "is_adult", "start_year", "end_year", "runtime_minutes", "genres",
+        ],
+        key=KEY,
+        where=where,
+        after=after,
+        conn=write_conn,
+    )
+
+    genre_cache = {g.name: g for g in Genre.objects.all()}
+
+    writers = {
+        "titles": BulkWriter.for_model(write_conn, Title, [
+            "tconst", "title_type", "primary_title", "original_title",
+            "is_adult", "start_year", "end_year", "runtime_minutes",
+        ], commit=False),
+        "genres": BulkWriter.for_model(write_conn, Title.genres.through, ["title", "genre"], commit=False),
+    }
+
+    for rows, last_key in chunks:
+        batch = []
+        for row in rows:
+            (
+                tconst,
+                title_type,
+                primary_title,
+                original_title,
+                is_adult,
+                start_year,
+                end_year,
+                runtime_minutes,
+                genres_str,
+            ) = row
+
+            batch.append({
+                "tconst": tconst,
+                "title_type": title_type,
+                "primary_title": primary_title,
+                "original_title": original_title,
+                "is_adult": is_adult == "1",
+                "start_year": int(start_year) if start_year else None,
+                "end_year": int(end_year) if end_year else None,
+                "runtime_minutes": int(runtime_minutes) if runtime_minutes else None,
+                "genres": genres_str.split(",") if genres_str else [],
+            })
+
+            if len(batch) >= BATCH_SIZE:
+                process_batch(batch, genre_cache, writers)
+                batch = []
+
+        if batch:
+            process_batch(batch, genre_cache, writers)
+
+        total += len(rows)
+        checkpoint.commit(write_conn, stage, last_key, total)
+        print(f"→ {stage}: обработано {total:,} записей (ключ {last_key})")
+
+    write_conn.close()
+    return total
+
+
+def process_batch(batch, genre_cache, writers):
     # 1) сохраняем Title
-    objs = [
-        Title(
-            tconst=item["tconst"],
-            title_type=item["title_type"],
-            primary_title=item["primary_title"],
-            original_title=item["original_title"],
-            is_adult=item["is_adult"],
-            start_year=item["start_year"],
-            end_year=item["end_year"],
-            runtime_minutes=item["runtime_minutes"],
+    for item in batch:
+        writers["titles"].add(
+            item["tconst"],
+            item["title_type"],
+            item["primary_title"],
+            item["original_title"],
+            item["is_adult"],
+            item["start_year"],
+            item["end_year"],
+            item["runtime_minutes"],
         )
-        for item in batch
-    ]
-
-    Title.objects.bulk_create(objs, ignore_conflicts=True)
 
-    # 2) вытягиваем обратно с PK
-    tconsts = [i["tconst"] for i in batch]
-    db_titles = {t.tconst: t for t in Title.objects.filter(tconst__in=tconsts)}
+    # 2) PK приходят тем же запросом, без повторного SELECT
+    db_titles = writers["titles"].flush_returning(["tconst"])
 
     # 3) подготавливаем связи
-    through = Title.genres.through
-    m2m = []
-
     for item in batch:
-        t = db_titles[item["tconst"]]
+        title_id = db_titles[item["tconst"]]
         for g in item["genres"]:
             if g not in genre_cache:
                 genre_cache[g] = Genre.objects.create(name=g)
 
-            m2m.append(through(title_id=t.id, genre_id=genre_cache[g].id))
+            writers["genres"].add(title_id, genre_cache[g].id)
 
     # 4) массовая вставка M2M
-    through.objects.bulk_create(m2m, ignore_conflicts=True)
+    writers["genres"].flush()
+
+
+def normalize_titles_sql(delta=False):
+    """Та же нормализация set-based SQL'ем: Python только оркестрирует и печатает отчёт."""
+    if delta:
+        prepare_delta()
+
+    tables = _tables(delta)
+
+    steps = [
+        ("тайтлы", TITLES_SQL),
+        ("жанры", GENRES_SQL),
+        ("связи тайтл ↔ жанр", TITLE_GENRES_SQL),
+    ]
+
+    print("→ Нормализую imdb_title_basics внутри Postgres...")
+    start_time = time.time()
+
+    with transaction.atomic(), connection.cursor() as cur:
+        for label, sql in steps:
+            step_start = time.time()
+            cur.execute(sql.format(**tables))
+            print(f"→ {label}: добавлено {cur.rowcount:,} строк за {time.time() - step_start:.1f} сек")
+
+    if delta:
+        deltas.commit(DATASET)
+
+    print(f"✓ title_basics нормализованы за {time.time() - start_time:.1f} сек")
 
 
 if __name__ == "__main__":
-    normalize_titles()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Нормализация imdb_title_basics → Title, Genre")
+    parser.add_argument(
+        "--engine",
+        choices=("python", "sql"),
+        default="python",
+        help="python — пакетами через ORM, sql — целиком внутри Postgres",
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="обработать только тайтлы, изменившиеся с прошлого запуска",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="продолжить с последней контрольной точки после падения (только --engine python)",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="на сколько диапазонов tconst разбить таблицу и сколько процессов запустить (только --engine python)",
+    )
+    args = parser.parse_args()
+
+    if args.engine == "sql":
+        normalize_titles_sql(delta=args.delta)
+    else:
+        normalize_titles(delta=args.delta, resume=args.resume, shards=args.shards)
\ No newline at end of file
@@ -1,3 +1,9 @@
-from app.etl.common import IMDB_DATA_DIR, safe_copy
+from etl.common import dump_path, safe_copy
 
-safe_copy(IMDB_DATA_DIR / "title.crew.tsv", "imdb_title_crew")
\ No newline at end of file
+
+def load_data():
+    safe_copy(dump_path("title.crew"), "imdb_title_crew")
+
+
+if __name__ == "__main__":
+    load_data()
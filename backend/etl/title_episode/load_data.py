@@ -1,3 +1,9 @@
-from app.etl.common import IMDB_DATA_DIR, safe_copy
+from etl.common import dump_path, safe_copy
 
-safe_copy(IMDB_DATA_DIR / "title.episode.tsv", "imdb_title_episode")
\ No newline at end of file
+
+def load_data():
+    safe_copy(dump_path("title.episode"), "imdb_title_episode")
+
+
+if __name__ == "__main__":
+    load_data()
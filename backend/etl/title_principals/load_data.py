@@ -1,3 +1,9 @@
-from app.etl.common import IMDB_DATA_DIR, safe_copy
+from etl.common import COPY_WORKERS, dump_path, safe_copy
 
-safe_copy(IMDB_DATA_DIR / "title.principals.tsv", "imdb_title_principals")
\ No newline at end of file
+
+def load_data():
+    safe_copy(dump_path("title.principals"), "imdb_title_principals", workers=COPY_WORKERS)
+
+
+if __name__ == "__main__":
+    load_data()
@@ -1,137 +1,243 @@
+import argparse
 import os
+import shutil
+import tempfile
 import django
 import time
+from pathlib import Path
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 django.setup()
 
-from django.db import transaction
+from django.db import connection, transaction
 from sixmovies.models import Actor, Title, TitlePrincipal, TitlePrincipalCharacter
-from etl.db import get_connection
+from etl import checkpoint, delta as deltas, shards as sharding
+from etl.bulk import BulkWriter
+from etl.db import get_connection, keyset_chunks
+from etl.idmap import IdMap
 
 
 BATCH_SIZE = 5000
+DATASET = "title_principals"
+CHECKPOINT = "normalize_principals"
+
+RAW_TABLE = "imdb_title_principals"
+KEY = ["tconst", "ordering"]
+
+# карты id шард-воркера (см. _init_worker)
+_id_maps = None
+
+# тайтлы, чей состав ссылается на тайтл или актёра, которых ещё нет в дампах
+PENDING_SQL = """
+    SELECT DISTINCT r.tconst
+    FROM imdb_title_principals r
+    WHERE {changed}
+      AND (NOT EXISTS (SELECT 1 FROM imdb_title_basics b WHERE b.tconst = r.tconst)
+           OR NOT EXISTS (SELECT 1 FROM imdb_name_basics n WHERE n.nconst = r.nconst))
+"""
+
+# у изменённых и пропавших тайтлов состав удаляем целиком — он загрузится заново
+DELTA_PURGE_SQL = """
+    DELETE FROM {character}
+    WHERE principal_id IN (
+        SELECT p.id FROM {principal} p JOIN {title} t ON t.id = p.title_id WHERE {changed_or_deleted}
+    );
+    DELETE FROM {principal}
+    WHERE title_id IN (SELECT id FROM {title} WHERE {changed_or_deleted});
+"""
+
+
+def prepare_delta():
+    """Считает дельту title_principals и убирает устаревшие составы."""
+    deltas.compute(DATASET)
+
+    sql = DELTA_PURGE_SQL.format(
+        title=Title._meta.db_table,
+        principal=TitlePrincipal._meta.db_table,
+        character=TitlePrincipalCharacter._meta.db_table,
+        changed_or_deleted=deltas.keys_filter(DATASET, "tconst", "UD"),
+    )
+
+    with transaction.atomic(), connection.cursor() as cur:
+        cur.execute(sql)
+
+
+def normalize_principals(delta=False, resume=False, shards=1):
+    if shards > 1:
+        return normalize_principals_sharded(shards, delta=delta, resume=resume)
+
+    after, total = checkpoint.start(CHECKPOINT, resume)
+    # при продолжении дельта уже посчитана и старые составы уже удалены
+    if delta and after is None:
+        prepare_delta()
 
+    start = time.time()
+
+    print("→ Строю карты tconst/nconst → id...")
+    id_maps = {
+        "titles": IdMap.shared(Title, "tconst"),
+        "actors": IdMap.shared(Actor, "nconst"),
+    }
 
-def normalize_principals():
-    print("→ Читаю raw-таблицу imdb_title_principals стримингом...")
+    print("→ Читаю raw-таблицу imdb_title_principals keyset-чанками...")
+    total = normalize_chunks(CHECKPOINT, _where(delta), after, total, id_maps)
 
-    conn = get_connection()
-    cur = conn.cursor()
+    if delta:
+        deltas.commit(DATASET, PENDING_SQL.format(changed=_where(delta)))
+    checkpoint.clear(CHECKPOINT)
+
+    print(f"✓ principals загрузились: {total:,} строк за {time.time() - start:.1f} сек")
 
-    cur.execute("""
-        SELECT
-            tconst,
-            ordering,
-            nconst,
-            category,
-            job,
-            characters
-        FROM imdb_title_principals
-    """)
 
-    batch = []
-    total = 0
+def normalize_principals_sharded(shards, delta=False, resume=False):
+    """
+    Та же нормализация на shards процессах, каждый — свой диапазон tconst.
+    Справочников у principals нет, общие у воркеров только карты id.
+    """
+    ranges = sharding.saved_plan(CHECKPOINT, resume)
+    if delta and ranges is None:
+        prepare_delta()
+    if ranges is None:
+        ranges = sharding.plan(CHECKPOINT, RAW_TABLE, KEY, shards, _where(delta))
+
     start = time.time()
 
-    for row in cur:
-        (
-            tconst,
-            ordering,
-            nconst,
-            category,
-            job,
-            chars_json,
-        ) = row
-
-        if tconst == "tconst":
-            continue  # пропускаем заголовок
-
-        # characters: ['Spider-Man', 'Peter Parker'] → список строк
-        if chars_json:
-            chars_json = chars_json.strip()
-            chars_json = chars_json.strip("{}[]")
+    print("→ Строю карты tconst/nconst → id для воркеров...")
+    maps_dir = Path(tempfile.mkdtemp(prefix="etl_principals_"))
+    try:
+        IdMap.shared(Title, "tconst").save(maps_dir / "titles")
+        IdMap.shared(Actor, "nconst").save(maps_dir / "actors")
+
+        total = sharding.run(
+            CHECKPOINT, _normalize_shard, ranges, KEY[0], _where(delta), resume,
+            initializer=_init_worker, initargs=(maps_dir,),
+        )
+    finally:
+        shutil.rmtree(maps_dir, ignore_errors=True)
+
+    if delta:
+        deltas.commit(DATASET, PENDING_SQL.format(changed=_where(delta)))
+    sharding.clear(CHECKPOINT)
+
+    print(f"✓ principals загрузились на {len(ranges)} шардах: {total:,} строк за {time.time() - start:.1f} сек")
+
+
+def _init_worker(maps_dir):
+    # карты открываются через mmap: воркеры делят одни и те же страницы
+    global _id_maps
+    _id_maps = {
+        "titles": IdMap.open(maps_dir / "titles"),
+        "actors": IdMap.open(maps_dir / "actors"),
+    }
+
+
+def _normalize_shard(stage, where, after, total):
+    return normalize_chunks(stage, where, after, total, _id_maps)
+
+
+def _where(delta):
+    return deltas.keys_filter(DATASET, "tconst") if delta else "TRUE"
+
+
+def normalize_chunks(stage, where, after, total, id_maps):
+    """
+    Нормализует строки raw-таблицы (where) keyset-чанками после ключа after.
+    Каждый чанк коммитится вместе с контрольной точкой stage; возвращает total + число строк.
+    """
+    # данные чанка и его контрольная точка коммитятся одной транзакцией
+    write_conn = get_connection()
+    chunks = keyset_chunks(
+        RAW_TABLE,
+        ["tconst", "ordering", "nconst", "category", "job", "characters"],
+        key=KEY,
+        where=where,
+        after=after,
+        conn=write_conn,
+    )
+
+    writers = {
+        "principals": BulkWriter.for_model(
+            write_conn, TitlePrincipal, ["title", "actor", "ordering", "category", "job"], commit=False
+        ),
+        "characters": BulkWriter.for_model(
+            write_conn, TitlePrincipalCharacter, ["principal", "character_name"], commit=False
+        ),
+    }
+
+    for rows, last_key in chunks:
+        batch = []
+        for row in rows:
+            (
+                tconst,
+                ordering,
+                nconst,
+                category,
+                job,
+                chars_json,
+            ) = row
+
+            if tconst == "tconst":
+                continue  # пропускаем заголовок
+
+            # characters: ['Spider-Man', 'Peter Parker'] → список строк
             if chars_json:
-                characters = [c.strip().strip('"') for c in chars_json.split(",")]
+                chars_json = chars_json.strip()
+                chars_json = chars_json.strip("{}[]")
+                if chars_json:
+                    characters = [c.strip().strip('"') for c in chars_json.split(",")]
+                else:
+                    characters = []
             else:
                 characters = []
-        else:
-            characters = []
-
-        batch.append({
-            "tconst": tconst,
-            "nconst": nconst,
-            "ordering": int(ordering) if ordering else None,
-            "category": category,
-            "job": job if job else None,
-            "characters": characters,
-        })
-
-        if len(batch) >= BATCH_SIZE:
-            process_batch(batch)
-            total += len(batch)
-            print(f"→ обработано {total:,} записей…")
-            batch = []
-
-    if batch:
-        process_batch(batch)
-        total += len(batch)
 
-    print(f"✓ principals загрузились: {total:,} строк за {time.time() - start:.1f} сек")
+            batch.append({
+                "tconst": tconst,
+                "nconst": nconst,
+                "ordering": int(ordering) if ordering else None,
+                "category": category,
+                "job": job if job else None,
+                "characters": characters,
+            })
 
+            if len(batch) >= BATCH_SIZE:
+                process_batch(batch, writers, id_maps)
+                batch = []
 
-def process_batch(batch):
-    """Сохраняем TitlePrincipal + TitlePrincipalCharacter в базу."""
-    title_cache = {}
-    actor_cache = {}
+        if batch:
+            process_batch(batch, writers, id_maps)
 
-    # вытягиваем все tconst и nconst
-    tconsts = {item["tconst"] for item in batch}
-    nconsts = {item["nconst"] for item in batch}
+        total += len(rows)
+        checkpoint.commit(write_conn, stage, last_key, total)
+        print(f"→ {stage}: обработано {total:,} записей… (ключ {last_key})")
 
-    # заранее грузим Title
-    for t in Title.objects.filter(tconst__in=tconsts):
-        title_cache[t.tconst] = t
+    write_conn.close()
+    return total
 
-    # заранее грузим Actor
-    for a in Actor.objects.filter(nconst__in=nconsts):
-        actor_cache[a.nconst] = a
 
-    principals_to_create = []
-    characters_to_create = []
+def process_batch(batch, writers, id_maps):
+    """Сохраняем TitlePrincipal + TitlePrincipalCharacter в базу."""
+    # резолвим все tconst и nconst пакета по картам в памяти
+    title_cache = id_maps["titles"].resolve({item["tconst"] for item in batch})
+    actor_cache = id_maps["actors"].resolve({item["nconst"] for item in batch})
 
     for item in batch:
-        title = title_cache.get(item["tconst"])
-        actor = actor_cache.get(item["nconst"])
+        title_id = title_cache.get(item["tconst"])
+        actor_id = actor_cache.get(item["nconst"])
 
-        if not title or not actor:
+        if not title_id or not actor_id:
             continue
 
-        principal = TitlePrincipal(
-            title_id=title.id,
-            actor_id=actor.id,
-            ordering=item["ordering"] or 0,
-            category=item["category"],
-            job=item["job"],
+        writers["principals"].add(
+            title_id,
+            actor_id,
+            item["ordering"] or 0,
+            item["category"],
+            item["job"],
         )
-        principals_to_create.append(principal)
 
-    # сохраняем principals
-    TitlePrincipal.objects.bulk_create(principals_to_create, ignore_conflicts=True)
-
-    # теперь надо получить id-шники только что созданных principals
-    # используем повторный выбор по (title, actor, ordering)
-    lookup_keys = [
-        (p.title_id, p.actor_id, p.ordering)
-        for p in principals_to_create
-    ]
-
-    db_principals = {}
-    for p in TitlePrincipal.objects.filter(
-        title_id__in=[k[0] for k in lookup_keys],
-        actor_id__in=[k[1] for k in lookup_keys]
-    ):
-        db_principals[(p.title_id, p.actor_id, p.ordering)] = p.id
+    # сохраняем principals и тем же запросом получаем id каждого
+    # (title, actor, ordering) — и нового, и уже существовавшего
+    db_principals = writers["principals"].flush_returning(["title_id", "actor_id", "ordering"])
 
     # создаём characters
     for item in batch:
@@ -139,30 +245,42 @@ def process_batch(batch):
         nconst = item["nconst"]
         ordering = item["ordering"] or 0
 
-        title = title_cache.get(tconst)
-        actor = actor_cache.get(nconst)
+        title_id = title_cache.get(tconst)
+        actor_id = actor_cache.get(nconst)
 
-        if not title or not actor:
+        if not title_id or not actor_id:
             continue
 
-        pkey = (title.id, actor.id, ordering)
+        pkey = (title_id, actor_id, ordering)
         principal_id = db_principals.get(pkey)
         if not principal_id:
             continue
 
         for cname in item["characters"]:
             if cname.strip():
-                characters_to_create.append(
-                    TitlePrincipalCharacter(
-                        principal_id=principal_id,
-                        character_name=cname,
-                    )
-                )
+                writers["characters"].add(principal_id, cname)
 
-    TitlePrincipalCharacter.objects.bulk_create(characters_to_create, ignore_conflicts=True)
+    writers["characters"].flush()
 
 
 if __name__ == "__main__":
-    normalize_principals()
-
-    
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Нормализация imdb_title_principals → TitlePrincipal")
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="обработать только тайтлы, состав которых изменился с прошлого запуска",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="продолжить с последней контрольной точки после падения",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="на сколько диапазонов tconst разбить таблицу и сколько процессов запустить",
+    )
+    args = parser.parse_args()
+
+    normalize_principals(delta=args.delta, resume=args.resume, shards=args.shards)
@@ -1,3 +1,9 @@
-from app.etl.common import IMDB_DATA_DIR, safe_copy
+from etl.common import dump_path, safe_copy
 
-safe_copy(IMDB_DATA_DIR / "title.ratings.tsv", "imdb_title_ratings")
\ No newline at end of file
+
+def load_data():
+    safe_copy(dump_path("title.ratings"), "imdb_title_ratings")
+
+
+if __name__ == "__main__":
+    load_data()
@@ -1,3 +1,4 @@
+import argparse
 import os
 import django
 import time
@@ -7,85 +8,100 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 django.setup()
 
 from sixmovies.models import Title
-from etl.db import get_connection
-from django.db import transaction
+from django.db import connection, transaction
+from etl import checkpoint
 
 load_dotenv()
 
+# ширина диапазона Title.id на один UPDATE — ограничивает время удержания блокировок
 BATCH_SIZE = 50000
 
-
-def normalize_ratings():
-    print("→ Читаю imdb_title_ratings стримингом…")
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT
-            tconst,
-            average_rating,
-            num_votes
-        FROM imdb_title_ratings
-    """)
-
-    batch = []
-    updated = 0
-    skipped = 0
-
+CHECKPOINT = "normalize_ratings"
+
+PREPARE_SQL = """
+    CREATE INDEX IF NOT EXISTS imdb_title_ratings_tconst_idx ON imdb_title_ratings (tconst);
+    ANALYZE imdb_title_ratings;
+"""
+
+# raw-колонки приводим осторожно: мусор в дампе превращается в NULL, а не в ошибку
+RATINGS_SQL = r"""
+    SELECT
+        tconst,
+        CASE WHEN average_rating ~ '^\d+(\.\d+)?$' THEN average_rating::numeric END AS rating,
+        CASE WHEN num_votes ~ '^\d+$' THEN num_votes::bigint END AS votes
+    FROM imdb_title_ratings
+"""
+
+UPDATE_SQL = """
+    UPDATE {title} t
+    SET imdb_rating = r.rating,
+        imdb_votes = r.votes
+    FROM ({ratings}) r
+    WHERE r.tconst = t.tconst
+      AND t.id BETWEEN %s AND %s
+      AND (t.imdb_rating IS DISTINCT FROM r.rating OR t.imdb_votes IS DISTINCT FROM r.votes)
+"""
+
+STATS_SQL = """
+    SELECT count(*), count(t.id)
+    FROM imdb_title_ratings r
+    LEFT JOIN {title} t ON t.tconst = r.tconst
+"""
+
+
+def normalize_ratings(resume=False):
+    after, updated = checkpoint.start(CHECKPOINT, resume)
+
+    print("→ Обновляю рейтинги join'ом с imdb_title_ratings…")
+    title_table = Title._meta.db_table
     start = time.time()
 
-    for row in cur:
-        tconst, rating, votes = row
+    with connection.cursor() as cur:
+        cur.execute(PREPARE_SQL)
+        cur.execute(f"SELECT min(id), max(id) FROM {title_table}")
+        min_id, max_id = cur.fetchone()
 
-        if tconst == "tconst":
-            continue  # пропускаем заголовок
+    sql = UPDATE_SQL.format(title=title_table, ratings=RATINGS_SQL)
 
-        batch.append({
-            "tconst": tconst,
-            "rating": float(rating) if rating else None,
-            "votes": int(votes) if votes else None
-        })
+    if min_id is not None:
+        # после падения продолжаем со следующего за последним закоммиченным диапазона
+        first = int(after[0]) + 1 if after else min_id
+        for lo in range(first, max_id + 1, BATCH_SIZE):
+            updated = process_batch(sql, lo, lo + BATCH_SIZE - 1, updated)
+            print(f"✓ id до {min(lo + BATCH_SIZE - 1, max_id):,} | обновлено {updated:,}")
 
-        if len(batch) >= BATCH_SIZE:
-            upd = process_batch(batch)
-            updated += upd["updated"]
-            skipped += upd["skipped"]
-            print(f"✓ обновлено {updated:,} | пропущено {skipped:,}")
-            batch.clear()
+    checkpoint.clear(CHECKPOINT)
 
-    if batch:
-        upd = process_batch(batch)
-        updated += upd["updated"]
-        skipped += upd["skipped"]
+    with connection.cursor() as cur:
+        cur.execute(STATS_SQL.format(title=title_table))
+        total, matched = cur.fetchone()
 
     print("\n===== Готово =====")
     print(f"✓ обновлено: {updated:,}")
-    print(f"⚠️ пропущено (нет title): {skipped:,}")
+    print(f"= без изменений: {matched - updated:,}")
+    print(f"⚠️ пропущено (нет title): {total - matched:,}")
     print(f"⏱ время: {time.time() - start:.1f} сек")
 
 
-def process_batch(batch):
-    """Обновляет imdb_rating и imdb_votes у Title."""
-    tconsts = [item["tconst"] for item in batch]
-    titles = {t.tconst: t for t in Title.objects.filter(tconst__in=tconsts)}
-
-    to_update = []
-    skipped = 0
-
-    for item in batch:
-        t = titles.get(item["tconst"])
-        if not t:
-            skipped += 1
-            continue
-        t.imdb_rating = item["rating"]
-        t.imdb_votes = item["votes"]
-        to_update.append(t)
-
-    if to_update:
-        Title.objects.bulk_update(to_update, ["imdb_rating", "imdb_votes"])
-
-    return {"updated": len(to_update), "skipped": skipped}
+def process_batch(sql, lo, hi, updated=0):
+    """
+    Обновляет imdb_rating и imdb_votes у Title с id в [lo, hi], только если они изменились.
+    Контрольная точка пишется в той же транзакции; возвращает накопленное число обновлений.
+    """
+    with transaction.atomic(), connection.cursor() as cur:
+        cur.execute(sql, [lo, hi])
+        updated += cur.rowcount
+        checkpoint.save(cur, CHECKPOINT, (hi,), updated)
+        return updated
 
 
 if __name__ == "__main__":
-    normalize_ratings()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="imdb_title_ratings → Title.imdb_rating, Title.imdb_votes")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="продолжить с последней контрольной точки после падения",
+    )
+    args = parser.parse_args()
+
+    normalize_ratings(resume=args.resume)
@@ -0,0 +1,150 @@
+"""
+Граф партнёров по съёмкам в CSR-виде.
+
+Вершины — актёры, пронумерованные плотно 0..N-1 в порядке nconst
+(тайтлы — так же, в порядке tconst). Соседи актёра v лежат
+в indices[indptr[v]:indptr[v + 1]] по возрастанию, у каждого ребра
+(позиции в indices) есть список общих тайтлов
+edge_titles[edge_title_ptr[e]:edge_title_ptr[e + 1]].
+
+Все массивы хранятся отдельными .npy и открываются через mmap: загрузка
+занимает миллисекунды, а воркеры API делят одни и те же страницы.
+"""
+from pathlib import Path
+
+import numpy as np
+
+# имя массива → dtype, в котором он хранится
+ARRAYS = {
+    "actor_ids": np.int64,       # плотный индекс актёра → Actor.id
+    "actor_nconst": np.int64,    # плотный индекс актёра → числовая часть nconst (по возрастанию)
+    "actor_votes": np.int64,     # популярность актёра: сумма imdb_votes его тайтлов (см. etl/popularity.py)
+    "title_ids": np.int64,       # плотный индекс тайтла → Title.id
+    "title_tconst": np.int64,    # плотный индекс тайтла → числовая часть tconst (по возрастанию)
+    "title_is_movie": np.bool_,  # title_type == 'movie' (иначе сериал)
+    "title_votes": np.int32,     # imdb_votes, 0 если рейтинга нет
+    "indptr": np.int64,
+    "indices": np.int32,
+    "edge_title_ptr": np.int64,
+    "edge_titles": np.int32,
+}
+
+
+class CoStarGraph:
+    def __init__(self, **arrays):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def from_pairs(cls, title_ids, title_tconst, actor_ids, actor_nconst, **title_attrs) -> "CoStarGraph":
+        """
+        Строит граф из строк TitlePrincipal (тайтл, актёр) векторно:
+        сортировка по тайтлу, пары внутри тайтла — сдвигами на 1, 2, … позиции,
+        рёбра и списки общих тайтлов — одной lexsort-группировкой.
+        title_attrs — атрибуты тайтла по тем же строкам (title_is_movie, title_votes).
+        """
+        title_attrs = {name: np.asarray(values) for name, values in title_attrs.items()}
+        actor_nconst, actor_first, a = np.unique(actor_nconst, return_index=True, return_inverse=True)
+        title_tconst, title_first, t = np.unique(title_tconst, return_index=True, return_inverse=True)
+        num_actors = len(actor_nconst)
+
+        # одна пара (тайтл, актёр), даже если у актёра в тайтле несколько ролей
+        pairs = np.unique(t.astype(np.int64) * num_actors + a)
+        t = (pairs // num_actors).astype(np.int32)
+        a = (pairs % num_actors).astype(np.int32)
+
+        # t[i] == t[i + d] ⇔ i и i + d в одном тайтле: все пары актёров тайтла
+        src, dst, via = [], [], []
+        d = 1
+        while d < len(t):
+            same = np.flatnonzero(t[d:] == t[:-d])
+            if not len(same):
+                break
+            src.append(a[same])
+            dst.append(a[same + d])
+            via.append(t[same])
+            d += 1
+
+        empty = [np.empty(0, dtype=np.int32)]
+        u = np.concatenate(src + dst + empty)
+        v = np.concatenate(dst + src + empty)
+        w = np.concatenate(via + via + empty)
+
+        order = np.lexsort((w, v, u))
+        u, v, w = u[order], v[order], w[order]
+
+        new_edge = np.ones(len(u), dtype=bool)
+        new_edge[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+        edge_start = np.flatnonzero(new_edge)
+
+        title_votes = title_attrs.get("title_votes")
+        actor_votes = np.zeros(num_actors, dtype=np.int64)
+        if title_votes is not None:
+            actor_votes = np.bincount(a, weights=title_votes[title_first][t], minlength=num_actors).astype(np.int64)
+
+        indptr = np.zeros(num_actors + 1, dtype=np.int64)
+        np.cumsum(np.bincount(u[edge_start], minlength=num_actors), out=indptr[1:])
+
+        return cls(
+            actor_ids=np.asarray(actor_ids)[actor_first],
+            actor_nconst=actor_nconst,
+            actor_votes=actor_votes,
+            title_ids=np.asarray(title_ids)[title_first],
+            title_tconst=title_tconst,
+            indptr=indptr,
+            indices=v[edge_start],
+            edge_title_ptr=np.append(edge_start, len(u)).astype(np.int64),
+            edge_titles=w,
+            **{name: values[title_first] for name, values in title_attrs.items()},
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "CoStarGraph":
+        return cls(**{
+            name: np.load(path / f"{name}.npy", mmap_mode="r")
+            for name in ARRAYS
+        })
+
+    def save(self, path: Path):
+        path.mkdir(parents=True, exist_ok=True)
+        for name, dtype in ARRAYS.items():
+            np.save(path / f"{name}.npy", np.asarray(getattr(self, name), dtype=dtype))
+
+    @property
+    def num_actors(self) -> int:
+        return len(self.actor_ids)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.indices)
+
+    def top_actors(self, n: int) -> np.ndarray:
+        """Плотные индексы n самых популярных актёров (по actor_votes), от большего к меньшему."""
+        n = min(n, self.num_actors)
+        top = np.argpartition(-self.actor_votes, n - 1)[:n] if n else np.empty(0, dtype=np.int64)
+        return top[np.argsort(-self.actor_votes[top], kind="stable")]
+
+    def actor_index(self, nconst_number: int):
+        """Числовая часть nconst → плотный индекс актёра или None."""
+        pos = int(np.searchsorted(self.actor_nconst, nconst_number))
+        if pos < len(self.actor_nconst) and self.actor_nconst[pos] == nconst_number:
+            return pos
+        return None
+
+    def neighbors(self, v: int) -> np.ndarray:
+        return self.indices[self.indptr[v]:self.indptr[v + 1]]
+
+    def edge(self, u: int, v: int):
+        """Позиция ребра u → v в indices или None, если они не снимались вместе."""
+        start, end = int(self.indptr[u]), int(self.indptr[u + 1])
+        pos = start + int(np.searchsorted(self.indices[start:end], v))
+        if pos < end and self.indices[pos] == v:
+            return pos
+        return None
+
+    def shared_titles(self, u: int, v: int) -> np.ndarray:
+        """Плотные индексы общих тайтлов u и v (пусто, если связи нет)."""
+        e = self.edge(u, v)
+        if e is None:
+            return np.empty(0, dtype=np.int32)
+        return self.edge_titles[self.edge_title_ptr[e]:self.edge_title_ptr[e + 1]]
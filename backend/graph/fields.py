@@ -0,0 +1,52 @@
+"""
+LRU-кэш полей расстояний «до цели» для подсказок.
+
+Поле — uint8-массив на весь граф (≈ 1 байт на актёра), считается одним BFS
+от цели при первой подсказке в партии. Кэш вытесняет самые давние поля, когда
+суммарный размер превышает max_bytes, так что повторная подсказка по той же
+головоломке — чтение готового массива.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from graph.csr import CoStarGraph
+from graph.search import distance_field
+
+
+class FieldCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._graph = None
+        self._fields = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._fields)
+
+    def get(self, graph: CoStarGraph, target: int) -> np.ndarray:
+        with self._lock:
+            if graph is not self._graph:
+                # граф подменили — поля старого снимка больше не годятся
+                self._graph = graph
+                self._fields.clear()
+                self.size = 0
+            field = self._fields.get(target)
+            if field is not None:
+                self._fields.move_to_end(target)
+                return field
+
+        # BFS вне блокировки: подсказки по другим целям не ждут
+        field = distance_field(graph, target)
+        field.setflags(write=False)
+
+        with self._lock:
+            if graph is self._graph and target not in self._fields:
+                self._fields[target] = field
+                self.size += field.nbytes
+                while self.size > self.max_bytes and len(self._fields) > 1:
+                    _, evicted = self._fields.popitem(last=False)
+                    self.size -= evicted.nbytes
+        return field
@@ -0,0 +1,148 @@
+"""
+Автодополнение имён актёров без похода в базу.
+
+Каждое слово имени приводится к ключу: NFKD без диакритики, нижний регистр,
+UTF-8, первые KEY_BYTES байт. Ключи лежат отсортированным S-массивом рядом с
+плотным индексом актёра, поэтому поиск по префиксу — пара searchsorted,
+а опечатки (пропуск, лишняя, заменённая или переставленная буква)
+проверяются одним векторным searchsorted по всем вариантам сразу.
+Ранжирование — по популярности актёра из графа (actor_votes).
+"""
+import re
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+KEY_BYTES = 16
+KEY_DTYPE = f"S{KEY_BYTES}"
+
+# опечатки ищем только в словах не короче, иначе вариантов слишком много и они шумные
+TYPO_MIN_LENGTH = 4
+TYPO_ALPHABET = "abcdefghijklmnopqrstuvwxyz"
+
+# сколько самых популярных актёров одного диапазона ключей берём при поиске с опечатками
+TYPO_RANGE_LIMIT = 200
+
+_SPLIT = re.compile(r"[\W_]+")
+
+
+def fold(text: str) -> str:
+    """«Penélope Cruz» → «penelope cruz»: без диакритики и пунктуации, в нижнем регистре."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(_SPLIT.split(text.casefold())).strip()
+
+
+def _key(word: str) -> bytes:
+    return word.encode("utf-8")[:KEY_BYTES]
+
+
+def _typos(word: str) -> set:
+    """Все варианты слова на расстоянии одной правки (Дамерау–Левенштейн)."""
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    variants = {a + b[1:] for a, b in splits if b}
+    variants |= {a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1}
+    variants |= {a + c + b[1:] for a, b in splits if b for c in TYPO_ALPHABET}
+    variants |= {a + c + b for a, b in splits for c in TYPO_ALPHABET}
+    variants.discard(word)
+    return variants
+
+
+class NameIndex:
+    def __init__(self, keys: np.ndarray, actors: np.ndarray):
+        self.keys = keys
+        self.actors = actors
+
+    @classmethod
+    def build(cls, actors, names, popularity) -> "NameIndex":
+        """
+        actors — плотные индексы графа, names — имена в том же порядке.
+        Одинаковые ключи упорядочены по убыванию popularity.
+        """
+        keys, owners = [], []
+        for v, name in zip(actors, names):
+            for word in set(fold(name or "").split()):
+                keys.append(_key(word))
+                owners.append(v)
+
+        keys = np.array(keys, dtype=KEY_DTYPE)
+        owners = np.array(owners, dtype=np.int32)
+        order = np.lexsort((-np.asarray(popularity)[owners], keys))
+        return cls(keys[order], owners[order])
+
+    @classmethod
+    def load(cls, path: Path) -> "NameIndex":
+        return cls(
+            np.load(path / "keys.npy", mmap_mode="r"),
+            np.load(path / "actors.npy", mmap_mode="r"),
+        )
+
+    def save(self, path: Path):
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "keys.npy", self.keys)
+        np.save(path / "actors.npy", self.actors)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _ranges(self, prefixes):
+        """Префиксы → границы [lo, hi) ключей, которые с них начинаются."""
+        prefixes = [_key(p) for p in prefixes]
+        # 0xff не встречается в UTF-8, поэтому prefix + 0xff больше любого ключа с этим префиксом;
+        # dtype совпадает с keys, иначе searchsorted копирует весь массив ради приведения
+        uppers = np.array([p + b"\xff" if len(p) < KEY_BYTES else p for p in prefixes], dtype=KEY_DTYPE)
+        lo = np.searchsorted(self.keys, np.array(prefixes, dtype=KEY_DTYPE), side="left")
+        hi = np.searchsorted(self.keys, uppers, side="right")
+        return lo, hi
+
+    def _prefix_actors(self, word: str) -> np.ndarray:
+        (lo,), (hi,) = self._ranges([word])
+        return self.actors[lo:hi]
+
+    def _typo_actors(self, word: str, popularity: np.ndarray) -> np.ndarray:
+        lo, hi = self._ranges(sorted(_typos(word)))
+        parts = []
+        for a, b in zip(lo, hi):
+            part = self.actors[a:b]
+            # диапазон префикса охватывает много разных ключей и отсортирован по ним,
+            # а не по популярности — отбираем самых известных до усечения
+            if len(part) > TYPO_RANGE_LIMIT:
+                part = part[np.argpartition(-popularity[part], TYPO_RANGE_LIMIT - 1)[:TYPO_RANGE_LIMIT]]
+            if len(part):
+                parts.append(part)
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+
+    def search(self, query: str, popularity: np.ndarray, limit: int = 10) -> list:
+        """
+        Плотные индексы актёров, у которых каждое слово запроса — префикс
+        какого-то слова имени. Сначала точные совпадения, потом с одной
+        опечаткой в последнем слове; внутри — по убыванию popularity.
+        """
+        words = fold(query).split()
+        if not words:
+            return []
+
+        # все слова, кроме последнего, уже дописаны и должны совпасть без опечаток
+        required = None
+        for word in words[:-1]:
+            found = np.unique(self._prefix_actors(word))
+            required = found if required is None else np.intersect1d(required, found, assume_unique=True)
+
+        def rank(candidates, exclude=()):
+            if required is not None:
+                candidates = candidates[np.isin(candidates, required)]
+            if len(exclude):
+                candidates = candidates[~np.isin(candidates, exclude)]
+            # актёр встречается по разу на каждое подходящее слово имени — берём с запасом
+            top = limit * 4
+            if len(candidates) > top:
+                candidates = candidates[np.argpartition(-popularity[candidates], top - 1)[:top]]
+            candidates = candidates[np.argsort(-popularity[candidates], kind="stable")]
+            _, first = np.unique(candidates, return_index=True)
+            return candidates[np.sort(first)][:limit]
+
+        best = rank(self._prefix_actors(words[-1]))
+        if len(best) < limit and len(words[-1]) >= TYPO_MIN_LENGTH:
+            best = np.concatenate([best, rank(self._typo_actors(words[-1], popularity), best)[:limit - len(best)]])
+        return [int(v) for v in best]
@@ -0,0 +1,69 @@
+"""
+Плотный оракул расстояний между топ-N популярными актёрами.
+
+distances.npy — uint8-матрица N × N (строка и столбец — позиция актёра
+в actors.npy), row_of.npy — плотный индекс актёра графа → позиция или -1.
+Оба файла открываются через mmap, поэтому запрос расстояния — два чтения
+массива без поиска по графу. UNKNOWN — путь длиннее MAX_DEPTH или его нет.
+"""
+from pathlib import Path
+
+import numpy as np
+
+UNKNOWN = 255
+
+# глубже этого BFS не идёт: у популярных актёров цепочки заметно короче
+MAX_DEPTH = 32
+
+NOT_IN_ORACLE = -1
+
+
+class DistanceOracle:
+    def __init__(self, actors: np.ndarray, row_of: np.ndarray, distances: np.ndarray):
+        self.actors = actors
+        self.row_of = row_of
+        self.distances = distances
+
+    @classmethod
+    def create(cls, path: Path, actors: np.ndarray, num_actors: int) -> "DistanceOracle":
+        """Заводит пустые файлы оракула; матрицу дальше заполняют воркеры по строкам."""
+        path.mkdir(parents=True, exist_ok=True)
+        actors = np.asarray(actors, dtype=np.int32)
+        row_of = np.full(num_actors, NOT_IN_ORACLE, dtype=np.int32)
+        row_of[actors] = np.arange(len(actors), dtype=np.int32)
+
+        np.save(path / "actors.npy", actors)
+        np.save(path / "row_of.npy", row_of)
+        distances = np.lib.format.open_memmap(
+            path / "distances.npy", mode="w+", dtype=np.uint8, shape=(len(actors), len(actors)),
+        )
+        distances[:] = UNKNOWN
+        distances.flush()
+        return cls(actors, row_of, distances)
+
+    @classmethod
+    def load(cls, path: Path, mode: str = "r") -> "DistanceOracle":
+        return cls(
+            np.load(path / "actors.npy", mmap_mode="r"),
+            np.load(path / "row_of.npy", mmap_mode="r"),
+            np.load(path / "distances.npy", mmap_mode=mode),
+        )
+
+    def __len__(self):
+        return len(self.actors)
+
+    def __contains__(self, v: int) -> bool:
+        return 0 <= v < len(self.row_of) and self.row_of[v] != NOT_IN_ORACLE
+
+    def distance(self, u: int, v: int):
+        """Расстояние между актёрами графа u и v; None — оракул не знает ответа."""
+        if u not in self or v not in self:
+            return None
+        d = int(self.distances[self.row_of[u], self.row_of[v]])
+        return None if d == UNKNOWN else d
+
+    def distances_from(self, u: int) -> np.ndarray:
+        """Строка матрицы для актёра u (uint8, UNKNOWN — нет ответа) или None."""
+        if u not in self:
+            return None
+        return self.distances[self.row_of[u]]
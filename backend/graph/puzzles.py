@@ -0,0 +1,70 @@
+"""
+Пул готовых головоломок «от актёра A до актёра B ровно за N рукопожатий».
+
+Пул строит etl/puzzle_pool/build.py и атомарно подменяет таблицу целиком.
+Строки пронумерованы плотно (distance, seq), поэтому случайная головоломка —
+одно чтение по первичному ключу: новая игра не ждёт поиска по графу.
+"""
+import random
+import threading
+
+from django.db import connection
+
+POOL_TABLE = "puzzle_pool"
+
+MIN_DISTANCE = 2
+MAX_DISTANCE = 6
+
+DDL = """
+CREATE TABLE {table} (
+    distance  smallint NOT NULL,
+    seq       integer  NOT NULL,
+    start_id  bigint   NOT NULL,
+    target_id bigint   NOT NULL,
+    PRIMARY KEY (distance, seq)
+)
+"""
+
+_lock = threading.Lock()
+_counts = None
+# oid таблицы пула, по которой посчитан _counts: пересборка подменяет таблицу,
+# и oid меняется — это и есть версия пула
+_counts_oid = None
+
+
+def pool_counts(refresh: bool = False) -> dict:
+    """distance → число головоломок; кэшируется в процессе, пока таблица пула та же."""
+    global _counts, _counts_oid
+    with _lock, connection.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s)::oid", [POOL_TABLE])
+        oid = cur.fetchone()[0]
+        if _counts is None or refresh or oid != _counts_oid:
+            if oid is None:
+                _counts = {}
+            else:
+                cur.execute(f"SELECT distance, count(*) FROM {POOL_TABLE} GROUP BY distance")
+                _counts = dict(cur.fetchall())
+            _counts_oid = oid
+        return _counts
+
+
+def random_puzzle(distance: int = None):
+    """(start_id, target_id, distance) из пула или None, если подходящих нет."""
+    for refresh in (False, True):
+        counts = pool_counts(refresh)
+        choices = [distance] if distance is not None else sorted(counts)
+        choices = [d for d in choices if counts.get(d)]
+        if not choices:
+            continue
+
+        d = random.choice(choices)
+        with connection.cursor() as cur:
+            cur.execute(
+                f"SELECT start_id, target_id FROM {POOL_TABLE} WHERE distance = %s AND seq = %s",
+                [d, random.randrange(counts[d])],
+            )
+            row = cur.fetchone()
+        if row is not None:
+            return row[0], row[1], d
+        # пул подменили между чтением счётчиков и выборкой — перечитываем
+    return None
@@ -0,0 +1,241 @@
+"""
+Кратчайшая цепочка между актёрами: двунаправленный BFS по CSR-графу.
+
+Фронтир раскрывается целиком NumPy-операциями (repeat/unique по срезам
+indptr), каждый шаг растит меньшую по числу рёбер сторону. Массивы
+родителей и глубин живут в thread-local scratch-буферах на весь граф и после
+поиска сбрасываются только в тронутых вершинах — запрос не платит O(N)
+за инициализацию.
+
+Фильтры по тайтлам (только фильмы, минимум голосов) превращаются в маску
+рёбер: ребро живо, если живёт хоть один общий тайтл. Маска считается одним
+np.logical_or.reduceat и кэшируется на граф.
+
+Для массовых расчётов (пул головоломок) есть bitset_distances: BFS сразу
+из 64 источников, где фронтир каждой вершины — одно uint64-слово с битом
+на источник, а шаг — pull-проход по CSR через np.bitwise_or.reduceat.
+"""
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from graph.csr import CoStarGraph
+from graph.oracle import UNKNOWN
+
+# сколько источников умещается в одно слово bitset-BFS
+BITSET_SOURCES = 64
+
+# сколько рёбер bitset-BFS собирает за один проход reduceat — ограничивает память
+BITSET_BLOCK_EDGES = 1 << 22
+
+# сколько разных масок фильтров держим на один граф
+EDGE_FILTER_CACHE = 16
+
+NO_PARENT = -1
+
+_scratch = threading.local()
+_filters_lock = threading.Lock()
+_filters = weakref.WeakKeyDictionary()
+
+
+class TitleFilter:
+    """Какие тайтлы считаются связью: movies_only и/или min_votes."""
+
+    def __init__(self, movies_only: bool = False, min_votes: int = 0):
+        self.movies_only = bool(movies_only)
+        self.min_votes = max(int(min_votes), 0)
+
+    @property
+    def key(self) -> tuple:
+        return self.movies_only, self.min_votes
+
+    def __bool__(self):
+        return self.movies_only or self.min_votes > 0
+
+    def title_mask(self, graph: CoStarGraph) -> np.ndarray:
+        mask = np.ones(len(graph.title_ids), dtype=bool)
+        if self.movies_only:
+            mask &= graph.title_is_movie
+        if self.min_votes:
+            mask &= graph.title_votes >= self.min_votes
+        return mask
+
+    def masks(self, graph: CoStarGraph):
+        """(маска тайтлов, маска рёбер) для графа; None, если фильтр пустой."""
+        if not self:
+            return None, None
+
+        with _filters_lock:
+            cache = _filters.setdefault(graph, OrderedDict())
+            if self.key in cache:
+                cache.move_to_end(self.key)
+                return cache[self.key]
+
+        titles = self.title_mask(graph)
+        edges = np.zeros(graph.num_edges, dtype=bool)
+        if graph.num_edges:
+            # у каждого ребра хотя бы один тайтл, поэтому пустых сегментов нет
+            edges = np.logical_or.reduceat(titles[graph.edge_titles], graph.edge_title_ptr[:-1])
+
+        with _filters_lock:
+            cache[self.key] = titles, edges
+            while len(cache) > EDGE_FILTER_CACHE:
+                cache.popitem(last=False)
+        return titles, edges
+
+
+def _buffers(num_actors: int):
+    """Thread-local массивы родителей и глубин для обеих сторон поиска."""
+    if getattr(_scratch, "size", None) != num_actors:
+        _scratch.size = num_actors
+        _scratch.parent = [np.full(num_actors, NO_PARENT, dtype=np.int32) for _ in range(2)]
+        _scratch.depth = [np.zeros(num_actors, dtype=np.int16) for _ in range(2)]
+    return _scratch.parent, _scratch.depth
+
+
+def _expand(graph: CoStarGraph, frontier: np.ndarray, edge_mask):
+    """Все рёбра фронтира одним махом → (откуда, куда)."""
+    starts = graph.indptr[frontier]
+    counts = graph.indptr[frontier + 1] - starts
+    total = int(counts.sum())
+    if not total:
+        return frontier[:0], frontier[:0]
+
+    offsets = np.cumsum(counts) - counts
+    pos = np.repeat(starts - offsets, counts) + np.arange(total)
+    src = np.repeat(frontier, counts)
+    if edge_mask is not None:
+        keep = edge_mask[pos]
+        pos, src = pos[keep], src[keep]
+    return src, graph.indices[pos]
+
+
+def _frontier_cost(graph: CoStarGraph, frontier: np.ndarray) -> int:
+    return int((graph.indptr[frontier + 1] - graph.indptr[frontier]).sum())
+
+
+def shortest_path(graph: CoStarGraph, source: int, target: int, max_depth: int = None, edge_mask=None):
+    """
+    Плотные индексы актёров от source до target включительно
+    или None, если цепочки не длиннее max_depth рёбер нет.
+    """
+    if source == target:
+        return [source]
+
+    parent, depth = _buffers(graph.num_actors)
+    frontiers = [np.array([source], dtype=np.int32), np.array([target], dtype=np.int32)]
+    levels = [0, 0]
+    touched = [[frontiers[0]], [frontiers[1]]]
+    parent[0][source] = source
+    parent[1][target] = target
+
+    try:
+        while len(frontiers[0]) and len(frontiers[1]):
+            if max_depth is not None and levels[0] + levels[1] >= max_depth:
+                return None
+
+            side = 0 if _frontier_cost(graph, frontiers[0]) <= _frontier_cost(graph, frontiers[1]) else 1
+            other = 1 - side
+
+            src, dst = _expand(graph, frontiers[side], edge_mask)
+            fresh = parent[side][dst] == NO_PARENT
+            dst, first = np.unique(dst[fresh], return_index=True)
+            src = src[fresh][first]
+
+            levels[side] += 1
+            parent[side][dst] = src
+            depth[side][dst] = levels[side]
+            touched[side].append(dst)
+            frontiers[side] = dst
+
+            met = dst[parent[other][dst] != NO_PARENT]
+            if len(met):
+                # встреча с вершиной, ближайшей к другому концу, даёт кратчайшую цепочку
+                meet = int(met[np.argmin(depth[other][met])])
+                return _join(parent, meet, source, target)
+        return None
+    finally:
+        for s in (0, 1):
+            seen = np.concatenate(touched[s])
+            parent[s][seen] = NO_PARENT
+            depth[s][seen] = 0
+
+
+def _join(parent, meet: int, source: int, target: int) -> list:
+    forward = [meet]
+    while forward[-1] != source:
+        forward.append(int(parent[0][forward[-1]]))
+    backward = []
+    v = meet
+    while v != target:
+        v = int(parent[1][v])
+        backward.append(v)
+    return forward[::-1] + backward
+
+
+def distance_field(graph: CoStarGraph, target: int, max_depth: int = UNKNOWN - 1) -> np.ndarray:
+    """Расстояние от каждого актёра до target (uint8, UNKNOWN — недостижим)."""
+    field = np.full(graph.num_actors, UNKNOWN, dtype=np.uint8)
+    field[target] = 0
+    frontier = np.array([target], dtype=np.int32)
+
+    level = 0
+    while len(frontier) and level < max_depth:
+        level += 1
+        _, dst = _expand(graph, frontier, None)
+        frontier = np.unique(dst[field[dst] == UNKNOWN])
+        field[frontier] = level
+    return field
+
+
+def _pull(graph: CoStarGraph, frontier: np.ndarray, active: np.ndarray) -> np.ndarray:
+    """OR фронтир-слов соседей для каждой вершины с ненулевой степенью, блоками по рёбрам."""
+    starts = graph.indptr[active]
+    ends = graph.indptr[active + 1]
+    reached = np.empty(len(active), dtype=np.uint64)
+
+    lo = 0
+    while lo < len(active):
+        hi = max(int(np.searchsorted(ends, starts[lo] + BITSET_BLOCK_EDGES, side="right")), lo + 1)
+        e0, e1 = starts[lo], ends[hi - 1]
+        words = frontier[graph.indices[e0:e1]]
+        reached[lo:hi] = np.bitwise_or.reduceat(words, starts[lo:hi] - e0)
+        lo = hi
+    return reached
+
+
+def bitset_distances(graph: CoStarGraph, sources, targets, max_depth: int) -> np.ndarray:
+    """
+    Точные расстояния от каждого из ≤ 64 источников до каждой цели:
+    int8-матрица len(sources) × len(targets), -1 — дальше max_depth или нет пути.
+    """
+    sources = np.asarray(sources, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.int64)
+    if len(sources) > BITSET_SOURCES:
+        raise ValueError(f"не больше {BITSET_SOURCES} источников за проход")
+
+    dist = np.full((len(sources), len(targets)), -1, dtype=np.int8)
+
+    def record(words, level):
+        # бит i слова цели ⇔ источник i впервые дотянулся до неё на этом уровне
+        octets = words[targets].astype("<u8").view(np.uint8).reshape(-1, 8)
+        hit = np.unpackbits(octets, axis=1, bitorder="little")[:, :len(sources)].astype(bool)
+        dist[hit.T] = level
+
+    visited = np.zeros(graph.num_actors, dtype=np.uint64)
+    np.bitwise_or.at(visited, sources, np.uint64(1) << np.arange(len(sources), dtype=np.uint64))
+    frontier = visited.copy()
+    record(frontier, 0)
+
+    active = np.flatnonzero(np.diff(graph.indptr))
+    for level in range(1, max_depth + 1):
+        new = _pull(graph, frontier, active) & ~visited[active]
+        if not new.any():
+            break
+        frontier = np.zeros(graph.num_actors, dtype=np.uint64)
+        frontier[active] = new
+        visited[active] |= new
+        record(frontier, level)
+    return dist
@@ -0,0 +1,229 @@
+"""
+Компактный бинарный снимок подграфа топ-N актёров для офлайн-игры.
+
+Формат (всё после заголовка — беззнаковые LEB128-varint, файл целиком в gzip):
+
+    MAGIC
+    num_actors, num_titles, num_edges          рёбра неориентированные, u < v
+    actor_nconst[num_actors]                   дельты по возрастанию nconst
+    actor_votes[num_actors]
+    title_tconst[num_titles]                   дельты по возрастанию tconst
+    title_votes[num_titles]
+    title_year[num_titles]                     0 — год неизвестен
+    title_is_movie[num_titles]                 по байту: 1 — фильм, 0 — сериал
+    degree[num_actors]                         число соседей v > u
+    neighbors[num_edges]                       первый — v - u, дальше дельты
+    edge_title_count[num_edges]
+    edge_titles[…]                             первый — индекс тайтла, дальше дельты
+    len, actor_names                           UTF-8 через «\\n», в порядке актёров
+    len, title_names                           UTF-8 через «\\n», в порядке тайтлов
+
+Актёры и тайтлы пронумерованы плотно в порядке nconst/tconst, как в полном
+графе. Версия — первые 16 hex sha256 несжатого содержимого, она же ETag.
+"""
+import gzip
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+
+from graph.csr import CoStarGraph
+
+MAGIC = b"SIXSNAP\x01"
+
+SNAPSHOT_FILE = "snapshot.bin.gz"
+META_FILE = "snapshot.json"
+
+
+def encode_varints(values) -> bytes:
+    """Вектор неотрицательных целых → LEB128 без цикла по элементам."""
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b""
+
+    sizes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        sizes += rest > 0
+        rest >>= np.uint64(7)
+
+    out = np.empty(int(sizes.sum()), dtype=np.uint8)
+    offsets = np.cumsum(sizes) - sizes
+    for i in range(int(sizes.max())):
+        m = sizes > i
+        low = (values[m] >> np.uint64(7 * i)) & np.uint64(0x7F)
+        more = (sizes[m] > i + 1).astype(np.uint64) << np.uint64(7)
+        out[offsets[m] + i] = (low | more).astype(np.uint8)
+    return out.tobytes()
+
+
+def decode_varints(data: bytes, count: int, pos: int = 0):
+    """Обратное к encode_varints: (вектор из count чисел, позиция после них)."""
+    if not count:
+        return np.zeros(0, dtype=np.uint64), pos
+    raw = np.frombuffer(data, dtype=np.uint8, offset=pos)
+    ends = np.flatnonzero(raw < 0x80)
+    if len(ends) < count:
+        raise ValueError("снимок обрезан: varint не закончился")
+    raw = raw[:ends[count - 1] + 1]
+
+    # номер числа и номер 7-битной группы внутри него для каждого байта
+    starts = np.concatenate([[0], ends[:count - 1] + 1])
+    owner = np.repeat(np.arange(count), np.diff(np.append(starts, len(raw))))
+    shift = (np.arange(len(raw)) - starts[owner]).astype(np.uint64) * np.uint64(7)
+
+    values = np.zeros(count, dtype=np.uint64)
+    np.add.at(values, owner, (raw & 0x7F).astype(np.uint64) << shift)
+    return values, pos + len(raw)
+
+
+def _undeltas(deltas: np.ndarray, counts: np.ndarray, base: np.ndarray) -> np.ndarray:
+    """Обратное к _deltas: накопленные суммы внутри групп, начиная от base группы."""
+    total = np.cumsum(np.asarray(deltas, dtype=np.int64))
+    firsts = np.cumsum(counts) - counts
+    before = np.concatenate([[0], total])[firsts]
+    return total - np.repeat(before - np.asarray(base, dtype=np.int64), counts)
+
+
+def parse(payload: bytes) -> dict:
+    """
+    Эталонный разбор несжатого снимка по формату из docstring модуля —
+    для проверки build(). Рёбра — пары (u, v) локальных индексов актёров,
+    общие тайтлы ребра e — edge_titles[edge_title_ptr[e]:edge_title_ptr[e + 1]].
+    """
+    if not payload.startswith(MAGIC):
+        raise ValueError("не снимок: неверная сигнатура")
+    pos = len(MAGIC)
+
+    def ints(count):
+        nonlocal pos
+        values, pos = decode_varints(payload, count, pos)
+        return values.astype(np.int64)
+
+    def text(count):
+        nonlocal pos
+        (size,) = ints(1)
+        blob = payload[pos:pos + size].decode("utf-8")
+        pos += size
+        return blob.split("\n") if count else []
+
+    num_actors, num_titles, num_edges = (int(n) for n in ints(3))
+    out = {
+        "actor_nconst": np.cumsum(ints(num_actors)),
+        "actor_votes": ints(num_actors),
+        "title_tconst": np.cumsum(ints(num_titles)),
+        "title_votes": ints(num_titles),
+        "title_year": ints(num_titles),
+    }
+    out["title_is_movie"] = np.frombuffer(payload, dtype=np.uint8, count=num_titles, offset=pos).astype(bool)
+    pos += num_titles
+
+    degree = ints(num_actors)
+    if int(degree.sum()) != num_edges:
+        raise ValueError("снимок повреждён: сумма степеней не равна числу рёбер")
+    out["u"] = np.repeat(np.arange(num_actors), degree)
+    out["v"] = _undeltas(ints(num_edges), degree, np.arange(num_actors))
+
+    title_counts = ints(num_edges)
+    out["edge_title_ptr"] = np.concatenate([[0], np.cumsum(title_counts)])
+    out["edge_titles"] = _undeltas(ints(int(title_counts.sum())), title_counts, np.zeros(num_edges))
+
+    out["actor_names"] = text(num_actors)
+    out["title_names"] = text(num_titles)
+    if pos != len(payload):
+        raise ValueError("снимок повреждён: лишние байты в конце")
+    return out
+
+
+def _segments(ptr: np.ndarray, rows: np.ndarray):
+    """Позиции всех элементов CSR-строк rows и длины строк."""
+    starts = ptr[rows]
+    counts = ptr[rows + 1] - starts
+    offsets = np.cumsum(counts) - counts
+    return np.repeat(starts - offsets, counts) + np.arange(int(counts.sum())), counts
+
+
+def _deltas(values: np.ndarray, counts: np.ndarray, base: np.ndarray) -> np.ndarray:
+    """Дельты внутри групп длиной counts; первая в группе — от base группы."""
+    values = np.asarray(values, dtype=np.int64)
+    prev = np.empty_like(values)
+    prev[1:] = values[:-1]
+    firsts = (np.cumsum(counts) - counts)[counts > 0]
+    prev[firsts] = np.asarray(base, dtype=np.int64)[counts > 0]
+    return values - prev
+
+
+def _text(lines) -> bytes:
+    blob = "\n".join(line.replace("\n", " ") for line in lines).encode("utf-8")
+    return encode_varints([len(blob)]) + blob
+
+
+def build(graph: CoStarGraph, top: int, actor_names: dict, title_names: dict, title_years: dict) -> bytes:
+    """
+    Подграф top самых популярных актёров → несжатые байты снимка.
+    *_names и title_years — словари по Actor.id / Title.id.
+    """
+    actors = np.sort(graph.top_actors(top))
+    local = np.full(graph.num_actors, -1, dtype=np.int64)
+    local[actors] = np.arange(len(actors))
+
+    # рёбра между оставленными актёрами, каждое один раз (u < v)
+    pos, degree = _segments(graph.indptr, actors)
+    u = np.repeat(np.arange(len(actors)), degree)
+    v = local[graph.indices[pos]]
+    keep = v > u
+    pos, u, v = pos[keep], u[keep], v[keep]
+    degree = np.bincount(u, minlength=len(actors))
+
+    title_pos, title_counts = _segments(graph.edge_title_ptr, pos)
+    titles, edge_titles = np.unique(graph.edge_titles[title_pos], return_inverse=True)
+
+    actor_pk = np.asarray(graph.actor_ids)[actors]
+    title_pk = np.asarray(graph.title_ids)[titles]
+    nconst = np.asarray(graph.actor_nconst)[actors]
+    tconst = np.asarray(graph.title_tconst)[titles]
+
+    parts = [
+        MAGIC,
+        encode_varints([len(actors), len(titles), len(u)]),
+        encode_varints(np.diff(nconst, prepend=0)),
+        encode_varints(np.asarray(graph.actor_votes)[actors]),
+        encode_varints(np.diff(tconst, prepend=0)),
+        encode_varints(np.asarray(graph.title_votes)[titles]),
+        encode_varints([title_years.get(int(pk)) or 0 for pk in title_pk]),
+        np.asarray(graph.title_is_movie)[titles].astype(np.uint8).tobytes(),
+        encode_varints(degree),
+        encode_varints(_deltas(v, degree, np.arange(len(actors)))),
+        encode_varints(title_counts),
+        encode_varints(_deltas(edge_titles, title_counts, np.zeros(len(title_counts)))),
+        _text(actor_names.get(int(pk), "") for pk in actor_pk),
+        _text(title_names.get(int(pk), "") for pk in title_pk),
+    ]
+    return b"".join(parts)
+
+
+def save(path: Path, payload: bytes, **meta) -> dict:
+    """Пишет gzip-файл и snapshot.json с версией; старый снимок подменяется атомарно."""
+    path.mkdir(parents=True, exist_ok=True)
+    version = hashlib.sha256(payload).hexdigest()[:16]
+
+    tmp = path / f"{SNAPSHOT_FILE}.tmp"
+    with open(tmp, "wb") as f:
+        # mtime=0 — одинаковое содержимое даёт байт-в-байт одинаковый файл
+        with gzip.GzipFile(fileobj=f, mode="wb", compresslevel=9, mtime=0) as gz:
+            gz.write(payload)
+    tmp.replace(path / SNAPSHOT_FILE)
+
+    meta = {"version": version, "raw_bytes": len(payload), "bytes": (path / SNAPSHOT_FILE).stat().st_size, **meta}
+    (path / f"{META_FILE}.tmp").write_text(json.dumps(meta))
+    (path / f"{META_FILE}.tmp").replace(path / META_FILE)
+    return meta
+
+
+def load_meta(path: Path):
+    """snapshot.json или None, если снимок ещё не собран."""
+    try:
+        return json.loads((path / META_FILE).read_text())
+    except FileNotFoundError:
+        return None
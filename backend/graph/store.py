@@ -0,0 +1,119 @@
+"""
+Процессный кэш снимка графа с горячей подменой версий.
+
+Все структуры одной версии (граф, индекс имён, поля подсказок)
+живут в одном объекте Snapshot, и запрос берёт его целиком один раз —
+так он никогда не смешивает данные двух версий. Раз в STAMP_CHECK_INTERVAL
+воркер сверяет штамп CURRENT; новую версию фоновый поток открывает
+через mmap, прогревает и только потом подменяет ссылку. Старый Snapshot
+освобождается сборщиком, когда его отпустят запросы, которые ещё в работе.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from graph import versions
+from graph.csr import CoStarGraph
+from graph.fields import FieldCache
+from graph.names import NameIndex
+from graph.search import TitleFilter, shortest_path
+
+logger = logging.getLogger(__name__)
+
+# как часто (сек) воркер проверяет, не опубликована ли новая версия
+STAMP_CHECK_INTERVAL = 1.0
+
+# сколько поисков между самыми популярными актёрами делаем при прогреве
+WARM_SEARCHES = 32
+
+
+class GraphNotPublished(FileNotFoundError):
+    """ETL ещё ни разу не опубликовал граф — API отвечает 503."""
+
+
+class Snapshot:
+    def __init__(self, version: str, path):
+        self.version = version
+        self.path = path
+        self.graph = CoStarGraph.load(path)
+        self.names = NameIndex.load(path / "names") if (path / "names").exists() else None
+        self.fields = FieldCache(settings.HINT_CACHE_BYTES)
+
+    def warm(self):
+        """Подтягивает страницы mmap и типовые кэши до того, как версия пойдёт в бой."""
+        graph = self.graph
+        for name in ("indptr", "indices", "actor_ids", "actor_nconst", "actor_votes"):
+            np.add.reduce(getattr(graph, name), dtype=np.int64)
+        if self.names is not None:
+            np.add.reduce(self.names.actors, dtype=np.int64)
+        TitleFilter(movies_only=True).masks(graph)
+
+        top = graph.top_actors(WARM_SEARCHES + 1)
+        for u, v in zip(top, top[1:]):
+            shortest_path(graph, int(u), int(v), max_depth=6)
+
+
+_lock = threading.Lock()
+_current = None
+_checked = 0.0
+_loading = None
+
+
+def _load(version: str) -> Snapshot:
+    snap = Snapshot(version, versions.path(settings.GRAPH_DIR, version))
+    start = time.time()
+    snap.warm()
+    logger.info("граф %s прогрет за %.2f сек", version, time.time() - start)
+    return snap
+
+
+def _swap_in_background(version: str):
+    global _current, _loading
+    try:
+        snap = _load(version)
+        with _lock:
+            _current = snap
+    except Exception:
+        logger.exception("не удалось открыть версию графа %s", version)
+    finally:
+        with _lock:
+            _loading = None
+
+
+def get_snapshot() -> Snapshot:
+    global _current, _checked, _loading
+    now = time.monotonic()
+    snap = _current
+
+    if snap is None:
+        with _lock:
+            if _current is None:
+                version = versions.current(settings.GRAPH_DIR)
+                if version is None:
+                    raise GraphNotPublished(f"в {settings.GRAPH_DIR} нет опубликованной версии графа")
+                _current = _load(version)
+                _checked = now
+            return _current
+
+    if now - _checked >= STAMP_CHECK_INTERVAL:
+        _checked = now
+        version = versions.current(settings.GRAPH_DIR)
+        with _lock:
+            if version and version != snap.version and _loading is None:
+                _loading = version
+                threading.Thread(target=_swap_in_background, args=(version,), daemon=True).start()
+    return snap
+
+
+def preload():
+    """Открывает и прогревает текущую версию при старте воркера, не блокируя его."""
+    def run():
+        try:
+            get_snapshot()
+        except GraphNotPublished:
+            logger.warning("граф ещё не опубликован — воркер стартует без него")
+
+    threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,123 @@
+"""
+Версии снимков графа на диске.
+
+    GRAPH_DIR/
+        versions/<version>/    граф, oracle/, names/, snapshot/ одной сборки
+        NEXT                   версия, которую сейчас собирает ETL
+        CURRENT                версия, которую обслуживает API
+
+Сборка графа заводит новую версию и пишет её в NEXT, остальные стадии ETL
+дописывают свои файлы туда же, а publish() одной атомарной заменой CURRENT
+отдаёт версию воркерам. Файлы опубликованной версии больше не меняются,
+поэтому воркеры могут держать их mmap сколько угодно. Стадия, запущенная
+без сборки графа (imdb_etl --only graph.oracle), получает от building()
+новую версию — копию опубликованной на жёстких ссылках.
+"""
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+VERSIONS_DIR = "versions"
+CURRENT = "CURRENT"
+NEXT = "NEXT"
+
+# сколько опубликованных версий держим на диске (текущая и предыдущая — для отката)
+KEEP_VERSIONS = 2
+
+# стадии поверх графа идут параллельно — новую версию из опубликованной заводит одна
+_fork_lock = threading.Lock()
+
+
+def _read_stamp(root: Path, name: str):
+    try:
+        return (root / name).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _write_stamp(root: Path, name: str, version: str):
+    tmp = root / f"{name}.tmp"
+    tmp.write_text(version)
+    tmp.replace(root / name)
+
+
+def path(root: Path, version: str) -> Path:
+    return root / VERSIONS_DIR / version
+
+
+def current(root: Path):
+    """Опубликованная версия или None."""
+    return _read_stamp(root, CURRENT)
+
+
+def _new_version(root: Path):
+    """Создаёт каталог новой версии; сборки в одну секунду получают суффикс -01, -02, …"""
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    (root / VERSIONS_DIR).mkdir(parents=True, exist_ok=True)
+    newest = max((p.name for p in (root / VERSIONS_DIR).iterdir()), default="")
+    for n in range(100):
+        # суффикс сортируется после имени без него и до следующей секунды;
+        # имя новой версии должно быть больше всех существующих — publish() чистит по порядку имён
+        version = f"{stamp}-{n:02d}" if n else stamp
+        if version <= newest:
+            continue
+        target = path(root, version)
+        try:
+            target.mkdir()
+        except FileExistsError:
+            continue
+        return version, target
+    raise FileExistsError(f"в {root} слишком много версий с меткой {stamp}")
+
+
+def start(root: Path) -> Path:
+    """Заводит каталог новой версии и помечает её как собираемую."""
+    version, target = _new_version(root)
+    _write_stamp(root, NEXT, version)
+    return target
+
+
+def building(root: Path) -> Path:
+    """
+    Каталог собираемой версии. Если сборки нет, заводит новую версию копией
+    опубликованной: файлы не копируются, а связываются жёсткими ссылками —
+    стадии подменяют каталоги целиком (replace_dir), а не пишут в файлы.
+    """
+    with _fork_lock:
+        version = _read_stamp(root, NEXT)
+        if version is not None:
+            return path(root, version)
+
+        published = current(root)
+        if published is None:
+            raise FileNotFoundError(f"в {root} нет ни собираемой, ни опубликованной версии графа")
+
+        version, target = _new_version(root)
+        shutil.copytree(path(root, published), target, copy_function=os.link, dirs_exist_ok=True)
+        _write_stamp(root, NEXT, version)
+        return target
+
+
+def replace_dir(staging: Path, target: Path):
+    """Подменяет каталог целиком: файлы, открытые через mmap, не перезаписываются на месте."""
+    shutil.rmtree(target, ignore_errors=True)
+    staging.rename(target)
+
+
+def publish(root: Path) -> str:
+    """NEXT → CURRENT; старые версии сверх KEEP_VERSIONS удаляются."""
+    version = _read_stamp(root, NEXT)
+    if version is None:
+        raise FileNotFoundError(f"в {root} нет собранной версии для публикации")
+
+    _write_stamp(root, CURRENT, version)
+    (root / NEXT).unlink()
+
+    # имена версий — метки времени, поэтому сортировка по имени хронологическая;
+    # mmap уже удалённых файлов у воркеров остаются валидными до закрытия
+    published = sorted(p.name for p in (root / VERSIONS_DIR).iterdir() if p.name <= version)
+    for old in published[:-KEEP_VERSIONS]:
+        shutil.rmtree(path(root, old), ignore_errors=True)
+    return version